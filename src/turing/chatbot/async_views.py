@@ -0,0 +1,303 @@
+# chatbot/async_views.py
+"""
+Versiones async (ASGI) de las vistas del chat.
+
+Mientras se espera al modelo o al embedding de la pregunta no se ocupa ningún
+hilo, así que un solo proceso atiende muchos chats a la vez. Las urls las usan
+en lugar de las de views.py cuando CHAT_ASYNC_VIEWS está activo, lo que hace
+turing/asgi.py.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db import close_old_connections
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET, require_POST
+
+from courses.answer_cache import answer_cache
+from courses.rag_utils import rag_processor
+from turing.llm_gateway import get_gateway
+from users.decorators import student_required
+from .models import ChatSession, ChatMessage
+from .events import message_notifier
+from .pipeline import Timings, submit
+from .prompts import prompt_compiler
+from .views import (
+    ERROR_REPLY, build_messages, chat_context_messages, history_queryset, parse_message_id, poll_etag,
+    poll_response, render_markdown, search_knowledge, serialize_message, session_with_latest_message, sse_event,
+    with_error_notice,
+)
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+
+# Markdown y Pygments consumen CPU: fuera del event loop
+arender_markdown = sync_to_async(render_markdown, thread_sensitive=False)
+# Casi siempre sale de la caché; si no, compila las capas con el ORM
+aprompt_for_session = sync_to_async(prompt_compiler.for_session)
+
+
+async def save_and_load_history(user, session, message):
+    """Guarda el mensaje del estudiante y devuelve el mensaje y la memoria de conversación."""
+    user_msg = await ChatMessage.objects.acreate(session=session, sender='user', message=message)
+    recent_messages = [msg async for msg in history_queryset(session)]
+    return user_msg, chat_context_messages(session, recent_messages)
+
+
+async def find_context(user, session, query, system_prompt):
+    """
+    Caché semántica y contexto RAG: el embedding de la pregunta se espera sin
+    ocupar un hilo y la búsqueda (consultas por bloques y numpy) corre en el
+    pool del chat.
+    """
+    if not session.course_id:
+        return None, ""
+    try:
+        query_embedding = await rag_processor.aembed_query(query, session.course_id)
+    except Exception:
+        return None, ""
+    return await asyncio.wrap_future(submit(search_knowledge, user, session, query, system_prompt, query_embedding))
+
+
+async def prepare_messages(user, session, user_message, timings):
+    """Historial y búsqueda RAG en paralelo, y los mensajes para el modelo (como views.prepare_messages)."""
+    system_prompt = await timings.timed('prompt', aprompt_for_session)(user, session)
+    (user_msg, context_messages), (probe, rag_context) = await asyncio.gather(
+        timings.timed('history', save_and_load_history)(user, session, user_message),
+        timings.timed('retrieval', find_context)(user, session, user_message, system_prompt),
+    )
+    timings.mark('prepare')
+    if probe and probe.answer:
+        return user_msg, None, probe
+    return user_msg, build_messages(system_prompt, user_message, context_messages, rag_context), probe
+
+
+async def get_session(request):
+    return await ChatSession.objects.select_related('course').aget(
+        id=request.POST.get('session_id'), user=await request.auser()
+    )
+
+
+@student_required
+@login_required
+async def send_message(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    try:
+        user_message = request.POST.get('message') or ''
+        session = await get_session(request)
+        timings = Timings()
+        _, messages_for_api, probe = await prepare_messages(await request.auser(), session, user_message, timings)
+
+        try:
+            if probe and probe.answer:
+                bot_message = probe.answer
+            else:
+                llm_started = time.monotonic()
+                bot_message = await get_gateway().achat(messages_for_api, model=settings.CHAT_MODEL)
+                timings.mark('llm', since=llm_started)
+                answer_cache.remember(probe, bot_message)
+            bot_message = await arender_markdown(bot_message)
+        except Exception:
+            logger.exception("Error with OpenAI API")
+            bot_message = ERROR_REPLY
+
+        await ChatMessage.objects.acreate(session=session, sender='bot', message=bot_message)
+        response = JsonResponse({'bot_message': bot_message})
+        response['Server-Timing'] = timings.header()
+        return response
+
+    except ChatSession.DoesNotExist:
+        return JsonResponse({'error': 'Chat session not found'}, status=404)
+    except Exception:
+        return JsonResponse({'error': 'An error occurred'}, status=500)
+
+
+async def cached_stream(answer):
+    yield answer
+
+
+async def stream_reply(session, user_msg, messages_for_api, timings, probe=None):
+    """Los mismos eventos SSE que views.stream_reply."""
+    yield sse_event('user', {'id': user_msg.id, 'timestamp': user_msg.timestamp.strftime('%H:%M')})
+
+    pieces = []
+    llm_started = time.monotonic()
+    if probe and probe.answer:
+        upstream = cached_stream(probe.answer)
+    else:
+        upstream = get_gateway().astream(messages_for_api, model=settings.CHAT_MODEL)
+    try:
+        async for piece in upstream:
+            if not pieces:
+                timings.mark('first_token', since=llm_started)
+            pieces.append(piece)
+            yield sse_event('delta', {'text': piece})
+        timings.mark('llm', since=llm_started)
+        answer_cache.remember(probe, ''.join(pieces))
+        bot_message = await arender_markdown(''.join(pieces))
+    except (asyncio.CancelledError, GeneratorExit):
+        # El navegador se desconectó: se corta la generación en el proveedor y se
+        # guarda lo que alcanzó a ver el estudiante
+        await upstream.aclose()
+        if pieces:
+            await ChatMessage.objects.acreate(
+                session=session, sender='bot', message=await arender_markdown(''.join(pieces))
+            )
+        raise
+    except Exception:
+        logger.exception("Error with OpenAI API")
+        failed = True
+        bot_message = with_error_notice(await arender_markdown(''.join(pieces)) if pieces else '')
+    else:
+        failed = False
+    finally:
+        await upstream.aclose()
+
+    msg = await ChatMessage.objects.acreate(session=session, sender='bot', message=bot_message)
+    yield sse_event('done', {
+        'id': msg.id,
+        'html': bot_message,
+        'timestamp': msg.timestamp.strftime('%H:%M'),
+        'timing': timings.header(),
+        'error': failed,
+    })
+
+
+@student_required
+@login_required
+@require_POST
+async def send_message_stream(request):
+    user_message = request.POST.get('message') or ''
+    try:
+        session = await get_session(request)
+    except (ChatSession.DoesNotExist, ValueError):
+        return JsonResponse({'error': 'Chat session not found'}, status=404)
+
+    timings = Timings()
+    user_msg, messages_for_api, probe = await prepare_messages(await request.auser(), session, user_message, timings)
+
+    response = StreamingHttpResponse(
+        stream_reply(session, user_msg, messages_for_api, timings, probe),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    response['Server-Timing'] = timings.header()
+    return response
+
+
+@student_required
+@login_required
+@require_GET
+async def poll_messages(request):
+    session_id = request.GET.get('session_id')
+    after_id = request.GET.get('after_id')
+
+    if not session_id:
+        return JsonResponse({'error': 'session_id requerido'}, status=400)
+
+    session = await session_with_latest_message(await request.auser(), session_id).afirst()
+    if session is None:
+        return JsonResponse({'error': 'Sesión no encontrada'}, status=404)
+
+    etag = poll_etag(session)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    after_id = parse_message_id(after_id)
+    out = []
+    if after_id is None or after_id < (session.latest_message_id or 0):
+        qs = ChatMessage.objects.filter(session=session).order_by('id')
+        if after_id is not None:
+            qs = qs.filter(id__gt=after_id)
+        out = [serialize_message(msg) async for msg in qs]
+
+    return poll_response(out, etag)
+
+
+def new_messages(session_id, after_id):
+    """
+    Mensajes de la sesión posteriores a `after_id`, ya serializados. La
+    conexión se libera al terminar: un stream dura minutos y no debe retener
+    una conexión (ni un hilo) entre consultas.
+    """
+    try:
+        qs = ChatMessage.objects.filter(session_id=session_id).order_by('id')
+        if after_id is not None:
+            qs = qs.filter(id__gt=after_id)
+        return [(msg.id, serialize_message(msg)) for msg in qs]
+    finally:
+        close_old_connections()
+
+
+# En el pool compartido, no en el hilo propio de la petición
+anew_messages = sync_to_async(new_messages, thread_sensitive=False)
+
+
+async def message_events(session, after_id):
+    """
+    Eventos `message` con cada mensaje nuevo de la sesión (su id como id del
+    evento, para que el navegador retome desde ahí al reconectar). Entre
+    mensajes solo se consulta el índice (session, id), al recibir un aviso de
+    este proceso o cada CHAT_EVENTS_INTERVAL segundos.
+    """
+    event = message_notifier.subscribe(session.pk)
+    # El stream se cierra de vez en cuando (el navegador reconecta solo), así las
+    # conexiones se reparten entre los workers nuevos tras un despliegue
+    deadline = time.monotonic() + settings.CHAT_EVENTS_MAX_SECONDS
+    idle = 0.0
+    try:
+        yield f"retry: {settings.CHAT_EVENTS_RETRY_MS}\n\n"
+        while time.monotonic() < deadline:
+            event.clear()
+            messages = await anew_messages(session.pk, after_id)
+            if messages:
+                for after_id, data in messages:
+                    yield f"id: {after_id}\n" + sse_event('message', data)
+                idle = 0.0
+                continue
+            try:
+                await asyncio.wait_for(event.wait(), timeout=settings.CHAT_EVENTS_INTERVAL)
+            except asyncio.TimeoutError:
+                idle += settings.CHAT_EVENTS_INTERVAL
+                if idle >= HEARTBEAT_SECONDS:
+                    # Mantiene viva la conexión a través de proxies
+                    yield ": ping\n\n"
+                    idle = 0.0
+    finally:
+        message_notifier.unsubscribe(session.pk, event)
+
+
+@student_required
+@login_required
+@require_GET
+async def message_stream(request):
+    """
+    Entrega por server-sent events de los mensajes de una sesión: reemplaza al
+    polling de poll_messages cuando el chat corre bajo ASGI.
+    """
+    session_id = request.GET.get('session_id')
+    if not session_id:
+        return JsonResponse({'error': 'session_id requerido'}, status=400)
+    try:
+        session = await ChatSession.objects.aget(id=session_id, user=await request.auser())
+    except (ChatSession.DoesNotExist, ValueError):
+        return JsonResponse({'error': 'Sesión no encontrada'}, status=404)
+    finally:
+        # La conexión de la petición (sesión, usuario) queda libre mientras dura el stream
+        await sync_to_async(close_old_connections)()
+
+    # Al reconectar, EventSource envía el id del último evento recibido
+    after_id = parse_message_id(request.headers.get('Last-Event-ID') or request.GET.get('after_id'))
+    response = StreamingHttpResponse(message_events(session, after_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,47 @@
+# chatbot/events.py
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class MessageNotifier:
+    """
+    Wakes the event streams (async_views.message_events) waiting on a session
+    as soon as a message is saved in this process.
+
+    Messages saved by another worker process are not seen here: the streams
+    also check the database every CHAT_EVENTS_INTERVAL seconds, so a
+    notification only makes delivery faster, never required.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = defaultdict(dict)  # session id -> {event: its event loop}
+
+    def subscribe(self, session_id: int) -> asyncio.Event:
+        event = asyncio.Event()
+        with self.lock:
+            self.waiters[session_id][event] = asyncio.get_running_loop()
+        return event
+
+    def unsubscribe(self, session_id: int, event: asyncio.Event) -> None:
+        with self.lock:
+            waiters = self.waiters.get(session_id)
+            if waiters is not None:
+                waiters.pop(event, None)
+                if not waiters:
+                    del self.waiters[session_id]
+
+    def notify(self, session_id: int) -> None:
+        """Callable from any thread (messages are saved from worker threads too)."""
+        with self.lock:
+            waiters = list(self.waiters.get(session_id, {}).items())
+        for event, loop in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # Its loop is already closed
+
+
+# Global instance
+message_notifier = MessageNotifier()
@@ -0,0 +1,91 @@
+# chatbot/management/commands/benchmark_markdown.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from chatbot.rendering import MarkdownRenderer, new_renderer
+
+PROSE = (
+    "Un **árbol binario de búsqueda** guarda en cada nodo una clave mayor que las de su "
+    "subárbol izquierdo y menor que las del derecho, así que buscar cuesta `O(h)`.\n\n"
+)
+CODE = '''```python
+def insertar(nodo, clave):
+    """Inserta la clave y devuelve la raíz del subárbol."""
+    if nodo is None:
+        return Nodo(clave)
+    if clave < nodo.clave:
+        nodo.izquierdo = insertar(nodo.izquierdo, clave)
+    else:
+        nodo.derecho = insertar(nodo.derecho, clave)
+    return nodo
+```
+
+'''
+
+
+def sample_reply(size: int) -> str:
+    """A reply of about `size` characters, half prose and half code."""
+    parts, length, i = [], 0, 0
+    while length < size:
+        part = PROSE if i % 2 == 0 else CODE
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return ''.join(parts)
+
+
+class Command(BaseCommand):
+    help = "Measure the render time of chat replies of several sizes, before and after the render cache and pools."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 8000, 32000])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--threads', type=int, default=8,
+                            help="Concurrent requests rendering at once for the throughput table")
+
+    def timed(self, fn, texts) -> float:
+        """Median milliseconds per reply."""
+        times = []
+        for text in texts:
+            started = time.perf_counter()
+            fn(text)
+            times.append((time.perf_counter() - started) * 1000)
+        return sorted(times)[len(times) // 2]
+
+    def concurrent(self, fn, texts, threads) -> float:
+        """Milliseconds to render all `texts` from `threads` request threads at once."""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(fn, texts))
+        return (time.perf_counter() - started) * 1000
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        pooled = MarkdownRenderer(cache_size=0, workers=0)
+        offloaded = MarkdownRenderer(cache_size=0, workers=2, offload_chars=0)
+        cached = MarkdownRenderer(workers=0)
+        offloaded.render(sample_reply(100))  # Start the worker processes outside the measurement
+
+        self.stdout.write(f"{'tamaño':>8} {'nuevo':>9} {'pool':>9} {'procesos':>9} {'caché':>9}  (ms por respuesta, mediana)")
+        for size in options['sizes']:
+            # A different reply each time, so only the cached column hits the cache
+            texts = [sample_reply(size) + f"\n\nRespuesta {i}." for i in range(repeat)]
+            for text in texts:
+                cached.render(text)
+            row = [
+                self.timed(lambda text: new_renderer().convert(text), texts),
+                self.timed(pooled.render, texts),
+                self.timed(offloaded.render, texts),
+                self.timed(cached.render, texts),
+            ]
+            self.stdout.write(f"{size:>8} " + ' '.join(f"{ms:>9.2f}" for ms in row))
+
+        threads = options['threads']
+        self.stdout.write(f"\n{'tamaño':>8} {'hilos':>9} {'procesos':>9}  (ms para {repeat} respuestas desde {threads} hilos)")
+        for size in options['sizes']:
+            texts = [sample_reply(size) + f"\n\nRespuesta {i}." for i in range(repeat)]
+            row = [self.concurrent(pooled.render, texts, threads), self.concurrent(offloaded.render, texts, threads)]
+            self.stdout.write(f"{size:>8} " + ' '.join(f"{ms:>9.2f}" for ms in row))
+        offloaded.executor.shutdown()
@@ -0,0 +1,147 @@
+# chatbot/memory.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.html import strip_tags
+
+from turing.llm_gateway import get_gateway
+from .models import ChatMessage, ChatSession
+
+INSTRUCTIONS = (
+    "Mantienes la memoria de una conversación entre un estudiante universitario y un "
+    "asistente de IA. Recibes el resumen anterior (puede estar vacío) y los mensajes "
+    "nuevos. Escribe un resumen actualizado de como máximo {words} palabras que conserve "
+    "los temas tratados, las dudas del estudiante, lo que ya se le explicó y cualquier "
+    "dato o preferencia que haya dado. Escribe solo el resumen."
+)
+
+SPEAKERS = {'user': 'Estudiante', 'bot': 'Asistente'}
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationSummarizer:
+    """
+    Keeps a running summary of each chat session, so the model remembers
+    long conversations while the prompt stays the same size.
+
+    The prompt carries the session's summary plus the messages it does not
+    cover yet (at most recent + batch of them). Once `batch` messages have
+    fallen out of the `recent` window, the oldest ones are folded into the
+    summary in the background, after the reply is saved: the LLM gets only
+    the previous summary and those messages, never the whole conversation.
+
+    Summaries run on their own small pool (CHAT_SUMMARY_WORKERS), not on
+    courses.background: imports and reprocessing can keep that one busy for
+    minutes, and a lagging summary means older turns drop out of the prompt.
+    """
+
+    def __init__(self, gateway=None, chat_model=None, recent=None, batch=None, max_message_chars=2000):
+        self._gateway = gateway
+        self._chat_model = chat_model
+        self._recent = recent
+        self._batch = batch
+        self.max_message_chars = max_message_chars
+        self.lock = threading.Lock()
+        self.pending = set()
+        self._executor = None
+
+    @property
+    def gateway(self):
+        return self._gateway or get_gateway()
+
+    @property
+    def chat_model(self) -> str:
+        return self._chat_model or settings.CHAT_SUMMARY_MODEL
+
+    @property
+    def recent(self) -> int:
+        return settings.CHAT_RECENT_MESSAGES if self._recent is None else self._recent
+
+    @property
+    def batch(self) -> int:
+        return settings.CHAT_SUMMARY_BATCH if self._batch is None else self._batch
+
+    @property
+    def history_limit(self) -> int:
+        """Most messages sent with the summary (when it lags behind, the oldest are dropped)."""
+        return self.recent + self.batch
+
+    def _transcript(self, messages: List[Tuple[int, str, str]]) -> str:
+        # The bot's messages are stored as rendered HTML
+        return '\n\n'.join(
+            f"{SPEAKERS.get(sender, sender)}: {strip_tags(text)[:self.max_message_chars]}"
+            for _, sender, text in messages
+        )
+
+    def summarize(self, summary: str, messages: List[Tuple[int, str, str]]) -> str:
+        return self.gateway.chat(
+            [
+                {"role": "system", "content": INSTRUCTIONS.format(words=settings.CHAT_SUMMARY_MAX_WORDS)},
+                {"role": "user", "content": (
+                    f"Resumen anterior:\n{summary or '(vacío)'}\n\nMensajes nuevos:\n{self._transcript(messages)}"
+                )},
+            ],
+            model=self.chat_model,
+            temperature=0.2,
+            max_tokens=settings.CHAT_SUMMARY_MAX_WORDS * 2,
+        ).strip()
+
+    def update(self, session_id: int) -> Optional[str]:
+        """Fold the messages that left the recent window into the summary, if there are enough."""
+        session = ChatSession.objects.filter(pk=session_id).values('summary', 'summarized_until').first()
+        if session is None:
+            return None
+        until = session['summarized_until']
+        messages = list(
+            ChatMessage.objects.filter(session_id=session_id, id__gt=until)
+            .order_by('id').values_list('id', 'sender', 'message')
+        )
+        if len(messages) < self.recent + self.batch:
+            return None
+
+        folded = messages[:-self.recent] if self.recent else messages
+        summary = self.summarize(session['summary'], folded)
+        # Conditional on the old mark, so a concurrent update is not overwritten
+        ChatSession.objects.filter(pk=session_id, summarized_until=until).update(
+            summary=summary, summarized_until=folded[-1][0]
+        )
+        return summary
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.CHAT_SUMMARY_WORKERS,
+                    thread_name_prefix='turing-summary',
+                )
+            return self._executor
+
+    def _run(self, session_id: int) -> None:
+        with self.lock:
+            self.pending.discard(session_id)
+        try:
+            self.update(session_id)
+        except Exception:
+            logger.exception("Could not summarize chat session %s", session_id)
+        finally:
+            connections.close_all()
+
+    def schedule(self, session_id: int) -> None:
+        """Update the session's summary in the background once the current transaction commits."""
+        if not settings.CHAT_SUMMARY_ENABLED:
+            return
+        with self.lock:
+            if session_id in self.pending:
+                return
+            self.pending.add(session_id)
+        transaction.on_commit(lambda: self.executor.submit(self._run, session_id))
+
+
+# Global instance
+conversation_summarizer = ConversationSummarizer()
@@ -11,9 +11,19 @@ class ChatSession(models.Model):
     )
     name = models.CharField(max_length=255, default='New Chat')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Memoria de la conversación: resumen de los mensajes hasta summarized_until
+    # (id de ChatMessage); los posteriores se envían completos (chatbot.memory)
+    summary = models.TextField(blank=True, default='')
+    summarized_until = models.BigIntegerField(default=0)
 
 class ChatMessage(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     sender = models.CharField(max_length=20)
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # "¿Hay mensajes nuevos?" (polling, ETag y eventos) es una sola lectura de este índice
+            models.Index(fields=['session', 'id'], name='chat_message_session_id_idx'),
+        ]
@@ -0,0 +1,105 @@
+# chatbot/pipeline.py
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import close_old_connections
+
+from turing.llm_gateway import coalesced_calls
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _executor_instance() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.CHAT_PREPARE_WORKERS,
+                    thread_name_prefix='turing-chat',
+                )
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    # Same connection lifecycle as a request: persistent connections
+    # (CONN_MAX_AGE) are reused across messages instead of reopened each time
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    Run a stage of a chat request on the chat thread pool, so it overlaps
+    with the work the request thread does meanwhile.
+
+    Unlike courses.background, this pool only runs short stages whose result
+    the request waits for. Stages must not wait on other stages (only the
+    request thread does), so a busy pool can never deadlock. With CHAT_PREPARE_WORKERS = 0 the stage runs
+    inline, one after another as before.
+
+    The stage runs in a copy of the caller's context, so context variables
+    set for the request (such as the list Timings uses to collect coalesced
+    calls) are seen from the pool thread too.
+    """
+    if not settings.CHAT_PREPARE_WORKERS:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    context = contextvars.copy_context()
+    return _executor_instance().submit(context.run, _run, fn, args, kwargs)
+
+
+class Timings:
+    """
+    Durations of the stages of a request, reported in a Server-Timing header,
+    along with the LLM calls it shared with identical requests in flight.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.coalesced = []
+        coalesced_calls.set(self.coalesced)
+
+    def mark(self, name: str, since: float = None) -> float:
+        """Record the time elapsed since `since` (default: the start) under `name`."""
+        now = time.monotonic()
+        self.stages[name] = now - (self.started if since is None else since)
+        return now
+
+    def timed(self, name: str, fn):
+        """`fn` wrapped to record how long each call takes under `name` (from any thread)."""
+        if iscoroutinefunction(fn):
+            async def async_wrapper(*args, **kwargs):
+                started = time.monotonic()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.stages[name] = time.monotonic() - started
+            return async_wrapper
+
+        def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.stages[name] = time.monotonic() - started
+        return wrapper
+
+    def header(self) -> str:
+        metrics = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        if self.coalesced:
+            metrics.append(f'coalesced;desc="{" ".join(self.coalesced)}"')
+        return ', '.join(metrics)
@@ -0,0 +1,114 @@
+# chatbot/prompts.py
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from courses.models import Course, CoursePrompt, Enrollment, Group
+from teachers.models import PromptConfig
+
+BASE_PROMPT = "Eres un asistente de IA útil para estudiantes universitarios."
+GLOBAL_PROMPT_KEY = 'global'
+
+
+def group_instructions(group: Group, course_name: str) -> str:
+    return f"""Instrucciones específicas para el grupo {group.name} del curso {course_name}:
+
+{group.ai_prompt}
+
+Recuerda seguir estas instrucciones en todas tus respuestas."""
+
+
+class PromptCompiler:
+    """
+    Builds the system prompt of a chat from its layers: the base prompt, the
+    global instructions (PromptConfig), the course prompt and the group's AI
+    prompt, joined into one static text.
+
+    The text only depends on the (course, group) pair, so it is compiled once
+    and kept in the cache until one of its layers is saved (see signals). The
+    student's group is cached as well, so a message no longer queries the
+    enrollment and the prompt layers. Sending the prompt as the first message,
+    always byte-identical, lets the provider reuse its prompt cache for it.
+    """
+
+    def __init__(self, timeout: Optional[int] = None):
+        self._timeout = timeout
+
+    @property
+    def timeout(self) -> int:
+        return settings.CHAT_PROMPT_CACHE_TIMEOUT if self._timeout is None else self._timeout
+
+    @staticmethod
+    def prompt_key(course_id, group_id) -> str:
+        return f"chat-prompt:{course_id or 0}:{group_id or 0}"
+
+    @staticmethod
+    def group_key(user_id, course_id) -> str:
+        return f"chat-prompt-group:{user_id}:{course_id}"
+
+    def compile(self, course_id: Optional[int], group_id: Optional[int]) -> str:
+        """The layers joined, base prompt first and the most specific layer last."""
+        layers = [BASE_PROMPT]
+
+        global_prompt = PromptConfig.objects.filter(key=GLOBAL_PROMPT_KEY).values_list('content', flat=True).first()
+        if global_prompt and global_prompt.strip():
+            layers.append(global_prompt.strip())
+
+        if course_id:
+            course = Course.objects.select_related('prompt').filter(pk=course_id).first()
+            course_prompt = getattr(course, 'prompt', None) if course else None
+            if course_prompt and course_prompt.content.strip():
+                layers.append(course_prompt.content.strip())
+
+            group = Group.objects.filter(pk=group_id, course_id=course_id).first() if group_id else None
+            if course and group and group.ai_prompt and group.ai_prompt.strip():
+                layers.append(group_instructions(group, course.name))
+
+        return "\n\n".join(layers)
+
+    def prompt(self, course_id: Optional[int], group_id: Optional[int]) -> str:
+        key = self.prompt_key(course_id, group_id)
+        text = cache.get(key)
+        if text is None:
+            text = self.compile(course_id, group_id)
+            cache.set(key, text, self.timeout)
+        return text
+
+    def group_id(self, user, course_id: int) -> Optional[int]:
+        """Id of the student's group in the course (None when not enrolled)."""
+        key = self.group_key(user.pk, course_id)
+        group_id = cache.get(key)
+        if group_id is None:
+            group_id = Enrollment.objects.filter(
+                student=user, group__course_id=course_id
+            ).values_list('group_id', flat=True).first() or 0
+            cache.set(key, group_id, self.timeout)
+        return group_id or None
+
+    def for_session(self, user, session) -> str:
+        """System prompt of a chat session of `user`."""
+        if not session.course_id:
+            return self.prompt(None, None)
+        return self.prompt(session.course_id, self.group_id(user, session.course_id))
+
+    def invalidate_groups(self, course_id: int, group_ids: Iterable[int]) -> None:
+        cache.delete_many([self.prompt_key(course_id, group_id) for group_id in [None, *group_ids]])
+
+    def invalidate_course(self, course_id: int) -> None:
+        self.invalidate_groups(course_id, Group.objects.filter(course_id=course_id).values_list('pk', flat=True))
+
+    def invalidate_all(self) -> None:
+        keys = [self.prompt_key(None, None)]
+        for course_id in Course.objects.values_list('pk', flat=True):
+            keys.append(self.prompt_key(course_id, None))
+        for course_id, group_id in Group.objects.values_list('course_id', 'pk'):
+            keys.append(self.prompt_key(course_id, group_id))
+        cache.delete_many(keys)
+
+    def invalidate_student(self, user_id: int, course_id: int) -> None:
+        cache.delete(self.group_key(user_id, course_id))
+
+
+# Global instance
+prompt_compiler = PromptCompiler()
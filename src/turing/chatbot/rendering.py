@@ -0,0 +1,115 @@
+# chatbot/rendering.py
+import hashlib
+import multiprocessing
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import markdown
+from django.conf import settings
+
+EXTENSIONS = ['codehilite', 'fenced_code']
+
+_worker_renderer = None
+
+
+def new_renderer() -> markdown.Markdown:
+    return markdown.Markdown(extensions=EXTENSIONS)
+
+
+def _render_in_worker(text: str) -> str:
+    """Runs in a process of the highlighting pool, one task at a time."""
+    global _worker_renderer
+    if _worker_renderer is None:
+        _worker_renderer = new_renderer()
+    return _worker_renderer.reset().convert(text)
+
+
+class MarkdownRenderer:
+    """
+    Converts the bot's markdown answers to HTML with syntax highlighting.
+
+    Markdown instances are expensive to build and not thread-safe, so a pool
+    of them is reused (reset between uses). Results are kept in an LRU cache
+    keyed by the hash of the markdown, since the same answer is rendered more
+    than once (a repeated question, a streamed reply that is cut short).
+    Long answers with code blocks are rendered in a small process pool:
+    Pygments is pure Python, and highlighting them in the web process would
+    hold the GIL while other requests wait.
+    """
+
+    def __init__(self, cache_size=None, workers=None, offload_chars=None):
+        self._cache_size = cache_size
+        self._workers = workers
+        self._offload_chars = offload_chars
+        self.renderers = queue.LifoQueue()
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self._executor = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache_size(self) -> int:
+        return settings.MARKDOWN_CACHE_SIZE if self._cache_size is None else self._cache_size
+
+    @property
+    def workers(self) -> int:
+        return settings.MARKDOWN_RENDER_WORKERS if self._workers is None else self._workers
+
+    @property
+    def offload_chars(self) -> int:
+        return settings.MARKDOWN_OFFLOAD_CHARS if self._offload_chars is None else self._offload_chars
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self._executor is None:
+                # 'spawn': forking a process that already runs threads is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def render_local(self, text: str) -> str:
+        try:
+            renderer = self.renderers.get_nowait()
+        except queue.Empty:
+            renderer = new_renderer()
+        try:
+            return renderer.reset().convert(text)
+        finally:
+            self.renderers.put(renderer)
+
+    def _render(self, text: str) -> str:
+        if self.workers and len(text) >= self.offload_chars and '```' in text:
+            try:
+                return self.executor.submit(_render_in_worker, text).result()
+            except BrokenProcessPool:
+                with self.lock:
+                    self._executor = None  # Rebuilt on the next long answer
+        return self.render_local(text)
+
+    def render(self, text: str) -> str:
+        key = hashlib.sha256(text.encode('utf-8')).digest()
+        with self.lock:
+            html = self.cache.get(key)
+            if html is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = self._render(text)
+        if self.cache_size:
+            with self.lock:
+                self.cache[key] = html
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return html
+
+
+# Global instance
+markdown_renderer = MarkdownRenderer()
@@ -0,0 +1,57 @@
+# chatbot/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from courses.models import Course, CoursePrompt, Enrollment, Group
+from teachers.models import PromptConfig
+from .events import message_notifier
+from .memory import conversation_summarizer
+from .models import ChatMessage
+from .prompts import prompt_compiler
+
+
+@receiver(post_save, sender=ChatMessage)
+def notify_new_message(sender, instance, created, **kwargs):
+    """Despierta a los streams de eventos que esperan mensajes de la sesión."""
+    if created:
+        transaction.on_commit(lambda: message_notifier.notify(instance.session_id))
+
+
+@receiver(post_save, sender=ChatMessage)
+def summarize_conversation(sender, instance, created, **kwargs):
+    """Tras cada respuesta, resume en segundo plano los mensajes que salieron de la ventana reciente."""
+    if created and instance.sender == 'bot':
+        conversation_summarizer.schedule(instance.session_id)
+
+
+# Prompt del sistema compilado: se descarta cuando cambia alguna de sus capas
+
+@receiver([post_save, post_delete], sender=PromptConfig)
+def invalidate_global_prompt(sender, instance, **kwargs):
+    transaction.on_commit(prompt_compiler.invalidate_all)
+
+
+@receiver([post_save, post_delete], sender=CoursePrompt)
+def invalidate_course_prompt(sender, instance, **kwargs):
+    transaction.on_commit(lambda: prompt_compiler.invalidate_course(instance.course_id))
+
+
+@receiver(post_save, sender=Course)
+def invalidate_course_name(sender, instance, created, **kwargs):
+    # El nombre del curso aparece en las instrucciones del grupo
+    if not created:
+        transaction.on_commit(lambda: prompt_compiler.invalidate_course(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_group_prompt(sender, instance, **kwargs):
+    transaction.on_commit(lambda: prompt_compiler.invalidate_groups(instance.course_id, [instance.pk]))
+
+
+@receiver([post_save, post_delete], sender=Enrollment)
+def invalidate_student_group(sender, instance, **kwargs):
+    if instance.group_id:
+        course_id = Group.objects.filter(pk=instance.group_id).values_list('course_id', flat=True).first()
+        if course_id:
+            transaction.on_commit(lambda: prompt_compiler.invalidate_student(instance.student_id, course_id))
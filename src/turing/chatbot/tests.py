@@ -1,3 +1,402 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import openai
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from courses import background
+from courses.models import Course, CoursePrompt, Enrollment, Group
+from courses.rag_utils import rag_processor
+
+from teachers.models import PromptConfig
+from turing.llm_gateway import CircuitBreaker, CircuitOpenError, LLMGateway, SingleFlight, StubGateway, set_gateway
+from . import async_views, views
+from .async_views import message_events, new_messages
+from .memory import ConversationSummarizer
+from .models import ChatMessage, ChatSession
+from .pipeline import Timings, submit
+from .prompts import BASE_PROMPT, prompt_compiler
+from .rendering import MarkdownRenderer
+
+
+def make_student(n='1'):
+    return get_user_model().objects.create_user(
+        email=f"s{n}@example.com", password='pw', name='Luis', last_name='Gómez',
+        cedula=n, university_code=n, user_group='g', role='Student',
+    )
+
+
+def make_teacher(n='100'):
+    return get_user_model().objects.create_user(
+        email=f"t{n}@example.com", password='pw', name='Ana', last_name='Pérez',
+        cedula=n, university_code=n, user_group='g', role='Teacher',
+    )
+
+
+def provider_down():
+    raise openai.APIConnectionError(request=httpx.Request('POST', 'http://llm.invalid/v1'))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self.gateway = LLMGateway(client=object(), breaker=self.breaker, max_retries=0)
+
+    def open_circuit(self):
+        for _ in range(2):
+            with self.assertRaises(openai.APIConnectionError):
+                self.gateway._call(provider_down)
+
+    def half_open(self):
+        self.breaker.opened_at -= 60
+
+    def test_opens_after_consecutive_failures(self):
+        self.open_circuit()
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            self.gateway._call(lambda: self.fail("called while open"))
+
+    def test_successful_trial_closes(self):
+        self.open_circuit()
+        self.half_open()
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertEqual(self.gateway._call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_failed_trial_reopens(self):
+        self.open_circuit()
+        self.half_open()
+        with self.assertRaises(openai.APIConnectionError):
+            self.gateway._call(provider_down)
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_one_trial_at_a_time(self):
+        self.open_circuit()
+        self.half_open()
+        self.breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_cancelled_trial_lets_the_next_call_through(self):
+        self.open_circuit()
+        self.half_open()
+
+        async def run():
+            started = asyncio.Event()
+
+            async def hangs():
+                started.set()
+                await asyncio.Event().wait()
+
+            trial = asyncio.ensure_future(self.gateway._acall(hangs))
+            await started.wait()
+            with self.assertRaises(CircuitOpenError):
+                await self.gateway._acall(self.fail)
+            trial.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await trial
+
+            async def answers():
+                return 'ok'
+            return await self.gateway._acall(answers)
+
+        self.assertEqual(asyncio.run(run()), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+
+
+class SingleFlightStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.opened = 0
+
+    def open_upstream(self):
+        self.opened += 1
+        yield from ['Hola', ' mundo', '.']
+
+    async def open_async_upstream(self):
+        self.opened += 1
+        for piece in ['Hola', ' mundo', '.']:
+            await asyncio.sleep(0)
+            yield piece
+
+    def test_concurrent_readers_share_one_upstream(self):
+        first = self.flights.stream('stream', 'k', self.open_upstream)
+        second = self.flights.stream('stream', 'k', self.open_upstream)
+
+        self.assertEqual(''.join(first), 'Hola mundo.')
+        self.assertEqual(''.join(second), 'Hola mundo.')
+        self.assertEqual(self.opened, 1)
+        self.assertEqual(self.flights.coalesced['stream'], 1)
+
+    def test_finished_stream_is_forgotten(self):
+        ''.join(self.flights.stream('stream', 'k', self.open_upstream))
+        self.assertEqual(self.flights.streams, {})
+
+        ''.join(self.flights.stream('stream', 'k', self.open_upstream))
+        self.assertEqual(self.opened, 2)
+        self.assertEqual(self.flights.coalesced['stream'], 0)
+
+    def test_last_reader_leaving_closes_upstream(self):
+        reader = self.flights.stream('stream', 'k', self.open_upstream)
+        self.assertEqual(next(reader), 'Hola')
+        reader.close()
+
+        self.assertEqual(self.flights.streams, {})
+        self.assertEqual(''.join(self.flights.stream('stream', 'k', self.open_upstream)), 'Hola mundo.')
+        self.assertEqual(self.opened, 2)
+
+    def test_async_readers_share_one_upstream(self):
+        async def read_all(reader):
+            return ''.join([piece async for piece in reader])
+
+        async def run():
+            readers = [self.flights.astream('stream', 'k', self.open_async_upstream) for _ in range(3)]
+            texts = await asyncio.gather(*(read_all(reader) for reader in readers))
+            return texts, dict(self.flights._loop_dict(self.flights._async_streams))
+
+        texts, left = asyncio.run(run())
+        self.assertEqual(texts, ['Hola mundo.'] * 3)
+        self.assertEqual(self.opened, 1)
+        self.assertEqual(self.flights.coalesced['stream'], 2)
+        self.assertEqual(left, {})
+
+
+class MarkdownRendererTests(SimpleTestCase):
+    def setUp(self):
+        self.renderer = MarkdownRenderer(cache_size=2, workers=0)
+
+    def test_repeated_answer_is_rendered_once(self):
+        with mock.patch.object(self.renderer, 'render_local', wraps=self.renderer.render_local) as render_local:
+            first = self.renderer.render('**Derivada**')
+            second = self.renderer.render('**Derivada**')
+        self.assertEqual(first, second)
+        self.assertIn('<strong>Derivada</strong>', first)
+        self.assertEqual(render_local.call_count, 1)
+        self.assertEqual((self.renderer.hits, self.renderer.misses), (1, 1))
+
+    def test_least_recently_used_answer_is_evicted(self):
+        for text in ['uno', 'dos', 'uno', 'tres']:
+            self.renderer.render(text)
+        self.renderer.render('uno')
+        self.renderer.render('dos')
+        self.assertEqual((self.renderer.hits, self.renderer.misses), (2, 4))
+
+    def test_renderers_are_reset_between_answers(self):
+        html = self.renderer.render('```python\nx = 1\n```')
+        self.assertIn('codehilite', html)
+        self.assertEqual(self.renderer.render('Texto'), '<p>Texto</p>')
+
+
+@override_settings(CHAT_PREPARE_WORKERS=2)
+class PipelineTests(SimpleTestCase):
+    def test_calls_coalesced_on_the_pool_are_reported(self):
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def lead():
+            started.set()
+            release.wait(5)
+            return 'vector'
+
+        leader = threading.Thread(target=flights.do, args=('embedding', 'k', lead))
+        leader.start()
+        started.wait(5)
+
+        timings = Timings()
+        stage = submit(flights.do, 'embedding', 'k', lambda: 'other')
+        # Let the stage join the leader's call before it ends
+        while not flights.coalesced['embedding']:
+            time.sleep(0.01)
+        release.set()
+        leader.join(5)
+
+        self.assertEqual(stage.result(5), 'vector')
+        self.assertEqual(timings.coalesced, ['embedding'])
+        self.assertIn('coalesced;desc="embedding"', timings.header())
+
+
+class MessageEventsTests(TransactionTestCase):
+    def setUp(self):
+        self.session = ChatSession.objects.create(user=make_student())
+        self.first = ChatMessage.objects.create(session=self.session, sender='user', message='Hola')
+
+    def test_probe_releases_the_connection(self):
+        with mock.patch('chatbot.async_views.close_old_connections') as close:
+            messages = new_messages(self.session.pk, None)
+        self.assertEqual([pk for pk, _ in messages], [self.first.pk])
+        close.assert_called_once()
+
+    @override_settings(CHAT_EVENTS_INTERVAL=0.05, CHAT_EVENTS_MAX_SECONDS=5)
+    def test_stream_delivers_messages_after_the_last_id(self):
+        async def run():
+            events = message_events(self.session, self.first.pk)
+            self.assertTrue((await events.__anext__()).startswith('retry:'))
+            await ChatMessage.objects.acreate(session=self.session, sender='bot', message='Respuesta')
+            event = await asyncio.wait_for(events.__anext__(), timeout=2)
+            await events.aclose()
+            return event
+
+        event = asyncio.run(run())
+        reply = ChatMessage.objects.get(sender='bot')
+        self.assertTrue(event.startswith(f"id: {reply.pk}\nevent: message\n"))
+        self.assertIn('Respuesta', event)
+
+
+class FailingStreamGateway(StubGateway):
+    """Sends two pieces and then loses the provider."""
+
+    def stream(self, messages, model=None, timeout=None, retries=None, **kwargs):
+        yield 'Una derivada '
+        yield 'es '
+        provider_down()
+
+    async def astream(self, messages, model=None, timeout=None, retries=None, **kwargs):
+        for piece in ['Una derivada ', 'es ']:
+            yield piece
+        provider_down()
+
+
+class StreamReplyTests(TransactionTestCase):
+    def setUp(self):
+        set_gateway(FailingStreamGateway())
+        self.addCleanup(set_gateway, None)
+        self.session = ChatSession.objects.create(user=make_student())
+        self.question = ChatMessage.objects.create(session=self.session, sender='user', message='¿Qué es?')
+
+    def done_event(self, events):
+        frame = events[-1]
+        self.assertTrue(frame.startswith('event: done\n'))
+        return json.loads(frame.split('data: ', 1)[1])
+
+    def assert_partial_reply_kept(self, done):
+        reply = ChatMessage.objects.get(session=self.session, sender='bot')
+        self.assertTrue(done['error'])
+        self.assertEqual(done['html'], reply.message)
+        self.assertIn('Una derivada es', reply.message)
+        self.assertIn(views.ERROR_REPLY, reply.message)
+
+    def test_failure_mid_stream_keeps_what_was_sent(self):
+        with self.assertLogs('chatbot.views', 'ERROR'):
+            events = list(views.stream_reply(self.session, self.question, [], Timings()))
+        self.assert_partial_reply_kept(self.done_event(events))
+
+    def test_async_failure_mid_stream_keeps_what_was_sent(self):
+        async def run():
+            return [event async for event in async_views.stream_reply(self.session, self.question, [], Timings())]
+
+        with self.assertLogs('chatbot.async_views', 'ERROR'):
+            events = asyncio.run(run())
+        self.assert_partial_reply_kept(self.done_event(events))
+
+
+class SearchKnowledgeTests(TestCase):
+    def setUp(self):
+        set_gateway(StubGateway())
+        self.addCleanup(set_gateway, None)
+        cache.clear()
+        self.student = make_student()
+        self.course = Course.objects.create(name='Cálculo', owner=make_teacher(), level='1')
+        self.group = Group.objects.create(course=self.course, name='G1', schedule='L 8-10')
+        Enrollment.objects.create(student=self.student, group=self.group)
+        self.session = ChatSession.objects.create(user=self.student, course=self.course)
+
+    def search(self):
+        return views.search_knowledge(self.student, self.session, '¿Qué es una derivada?', 'Eres un asistente.')
+
+    def test_group_is_not_read_on_every_message(self):
+        self.search()
+        with CaptureQueriesContext(connection) as queries:
+            self.search()
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn(Enrollment._meta.db_table, tables)
+        self.assertNotIn(Group._meta.db_table, tables)
+
+    def test_group_scope_change_is_seen(self):
+        self.assertFalse(rag_processor.chat_group(self.course.pk, self.group.pk).scoped_knowledge)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.scoped_knowledge = True
+            self.group.save()
+        self.assertTrue(rag_processor.chat_group(self.course.pk, self.group.pk).scoped_knowledge)
+
+
+class PromptCompilerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = make_student()
+        self.course = Course.objects.create(name='Cálculo', owner=make_teacher(), level='1')
+        self.group = Group.objects.create(course=self.course, name='G1', schedule='L 8-10', ai_prompt='Usa ejemplos.')
+        Enrollment.objects.create(student=self.student, group=self.group)
+        self.session = ChatSession.objects.create(user=self.student, course=self.course)
+
+    def prompt(self):
+        return prompt_compiler.for_session(self.student, self.session)
+
+    def test_layers_from_base_to_group(self):
+        PromptConfig.objects.create(key='global', content='Sé amable.')
+        CoursePrompt.objects.create(course=self.course, content='Enfócate en derivadas.')
+        prompt = self.prompt()
+        positions = [prompt.index(text) for text in (BASE_PROMPT, 'Sé amable.', 'Enfócate en derivadas.', 'Usa ejemplos.')]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_cached_until_a_layer_changes(self):
+        self.prompt()
+        with self.assertNumQueries(0):
+            self.prompt()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CoursePrompt.objects.create(course=self.course, content='Enfócate en derivadas.')
+        self.assertIn('Enfócate en derivadas.', self.prompt())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PromptConfig.objects.create(key='global', content='Sé amable.')
+        self.assertIn('Sé amable.', self.prompt())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.ai_prompt = 'Responde con pasos.'
+            self.group.save()
+        self.assertIn('Responde con pasos.', self.prompt())
+        self.assertNotIn('Usa ejemplos.', self.prompt())
+
+    def test_changing_group_changes_the_prompt(self):
+        self.prompt()
+        other = Group.objects.create(course=self.course, name='G2', schedule='M 8-10', ai_prompt='Sé breve.')
+        with self.captureOnCommitCallbacks(execute=True):
+            enrollment = Enrollment.objects.get(student=self.student)
+            enrollment.group = other
+            enrollment.save()
+        self.assertIn('Sé breve.', self.prompt())
+
+
+class ConversationSummarizerTests(TransactionTestCase):
+    def setUp(self):
+        set_gateway(StubGateway())
+        self.addCleanup(set_gateway, None)
+        self.session = ChatSession.objects.create(user=make_student())
+        for n in range(4):
+            ChatMessage.objects.create(session=self.session, sender='user' if n % 2 == 0 else 'bot', message=f"Mensaje {n}")
+
+    def test_summary_does_not_wait_for_background_work(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        for _ in range(settings.BACKGROUND_WORKERS):
+            background.submit(release.wait, 10)
+
+        summarizer = ConversationSummarizer(recent=2, batch=2)
+        summarizer.schedule(self.session.pk)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            self.session.refresh_from_db()
+            if self.session.summary:
+                break
+            time.sleep(0.05)
+        self.assertIn('Mensaje 1', self.session.summary)
+        self.assertEqual(self.session.summarized_until, ChatMessage.objects.get(message='Mensaje 1').pk)
@@ -1,6 +1,12 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Bajo ASGI (turing/asgi.py) el envío y la consulta de mensajes usan las vistas async
+chat_views = views
+if settings.CHAT_ASYNC_VIEWS:
+    from . import async_views as chat_views
+
 app_name = 'chatbot'
 
 urlpatterns = [
@@ -8,8 +14,13 @@ urlpatterns = [
     path('course/<int:course_id>/', views.chatbot_view, name='course_chat'),
     path('course/<int:course_id>/create_session/', views.create_session_course, name='create_session_course'),
     path('chat/<int:session_id>/', views.chatbot_view, name='chat_detail'),
-    path('send_message/', views.send_message, name='send_message'),
+    path('send_message/', chat_views.send_message, name='send_message'),
+    path('send_message/stream/', chat_views.send_message_stream, name='send_message_stream'),
     path('delete_session/<int:session_id>/', views.delete_session, name='delete_session'),
     path('session/<int:pk>/rename/', views.rename_session, name='rename_session'),
-    path('poll_messages/', views.poll_messages, name='poll_messages'),
+    path('poll_messages/', chat_views.poll_messages, name='poll_messages'),
 ]
+
+if settings.CHAT_ASYNC_VIEWS:
+    # Mantener abierta una conexión por pestaña solo es viable sin workers síncronos
+    urlpatterns.append(path('events/', chat_views.message_stream, name='message_events'))
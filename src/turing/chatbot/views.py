@@ -1,24 +1,29 @@
+import json
+import logging
+import time
 from datetime import datetime
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST, require_GET
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Q
+from django.db.models import OuterRef, Q, Subquery
+from django.utils.cache import get_conditional_response
 from django.utils.html import escape
 
 from users.decorators import student_required
 from .models import ChatSession, ChatMessage
+from .pipeline import Timings, submit
+from .memory import conversation_summarizer
+from .prompts import prompt_compiler
+from .rendering import markdown_renderer
 from courses.models import Enrollment, Course, Group
+from courses.answer_cache import answer_cache
 from courses.rag_utils import rag_processor
+from turing.llm_gateway import get_gateway
 
-import os
-import json
-from openai import OpenAI
-
-import markdown
-from markdown.extensions import codehilite
+logger = logging.getLogger(__name__)
 
 @login_required
 def chatbot_view(request, session_id=None, course_id=None):
@@ -86,6 +91,7 @@ def chatbot_view(request, session_id=None, course_id=None):
         'recent_chats': recent_chats,
         'current_session': session,
         'current_course': course,
+        'message_events': settings.CHAT_ASYNC_VIEWS,
     })
 
 
@@ -98,62 +104,31 @@ def send_message(request):
             session_id = request.POST.get('session_id')
 
             session = ChatSession.objects.select_related('course').get(id=session_id, user=request.user)
-            ChatMessage.objects.create(session=session, sender='user', message=user_message)
+            timings = Timings()
+            _, messages_for_api, probe = prepare_messages(request.user, session, user_message, timings)
 
             try:
-                # Configura la API Key de OpenAI
-                os.environ['OPENAI_API_KEY'] = getattr(settings, 'OPENAI_API_KEY', None) or os.getenv('OPENAI_API_KEY')
-                client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-                # Memoria de conversación (incluye prompt del grupo si existe)
-                context_messages = get_chat_context(request.user, session, limit=5)
-                
-                # RAG: Buscar contexto relevante de la base de conocimiento
-                rag_context = ""
-                if session.course_id:
-                    try:
-                        rag_context = rag_processor.create_rag_context(user_message, session.course_id)
-                    except Exception:
-                        rag_context = ""
+                if probe and probe.answer:
+                    # Pregunta casi igual a otra ya respondida en el grupo
+                    bot_message = probe.answer
                 else:
-                    rag_context = ""
-                
-                # Construir el prompt del sistema base
-                system_prompt = "Eres un asistente de IA útil para estudiantes universitarios."
-                
-                # Preparar mensajes para OpenAI
-                messages_for_api = [{"role": "system", "content": system_prompt}]
-                
-                # Añadir contexto de conversación (incluye prompt del grupo si existe)
-                messages_for_api.extend(context_messages)
-                
-                # Añadir contexto RAG si está disponible
-                if rag_context:
-                    messages_for_api.append({"role": "system", "content": rag_context})
-                
-                # Añadir mensaje del usuario
-                messages_for_api.append({"role": "user", "content": user_message})
-
-                completion = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=messages_for_api
-                )
-
-                data = json.loads(completion.model_dump_json())
-                bot_message = data['choices'][0]['message']['content']
+                    llm_started = time.monotonic()
+
+                    # Pasarela compartida: conexiones reutilizadas, timeout y reintentos
+                    bot_message = get_gateway().chat(messages_for_api, model=settings.CHAT_MODEL)
+                    timings.mark('llm', since=llm_started)
+                    answer_cache.remember(probe, bot_message)
 
                 # Procesar markdown a HTML con resaltado de sintaxis
-                md = markdown.Markdown(extensions=[
-                    'codehilite',
-                    'fenced_code'
-                ])
-                bot_message = md.convert(bot_message)
-            except Exception as e:
-                print(f"Error with OpenAI API: {e}")
-                bot_message = "Sorry, there was an error with the AI service."
+                bot_message = render_markdown(bot_message)
+            except Exception:
+                logger.exception("Error with OpenAI API")
+                bot_message = ERROR_REPLY
 
             ChatMessage.objects.create(session=session, sender='bot', message=bot_message)
-            return JsonResponse({'bot_message': bot_message})
+            response = JsonResponse({'bot_message': bot_message})
+            response['Server-Timing'] = timings.header()
+            return response
 
         except ChatSession.DoesNotExist:
             return JsonResponse({'error': 'Chat session not found'}, status=404)
@@ -163,6 +138,100 @@ def send_message(request):
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 
+ERROR_REPLY = "Sorry, there was an error with the AI service."
+
+
+def with_error_notice(html):
+    """Respuesta cortada por un error del modelo: lo que ya se envió, seguido del aviso."""
+    return f"{html}<p><em>{ERROR_REPLY}</em></p>" if html else ERROR_REPLY
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def cached_stream(answer):
+    """La respuesta de la caché semántica, como un stream de un solo fragmento."""
+    yield answer
+
+
+def stream_reply(session, user_msg, messages_for_api, timings, probe=None):
+    """
+    Eventos SSE de la respuesta: `user` con el mensaje ya guardado, un `delta` por
+    cada fragmento que llega del modelo y `done` con el mensaje final guardado
+    (`error` indica que el modelo falló y el mensaje quedó cortado).
+    """
+    yield sse_event('user', {'id': user_msg.id, 'timestamp': user_msg.timestamp.strftime('%H:%M')})
+
+    pieces = []
+    llm_started = time.monotonic()
+    if probe and probe.answer:
+        upstream = cached_stream(probe.answer)
+    else:
+        upstream = get_gateway().stream(messages_for_api, model=settings.CHAT_MODEL)
+    try:
+        for piece in upstream:
+            if not pieces:
+                timings.mark('first_token', since=llm_started)
+            pieces.append(piece)
+            yield sse_event('delta', {'text': piece})
+        timings.mark('llm', since=llm_started)
+        answer_cache.remember(probe, ''.join(pieces))
+        bot_message = render_markdown(''.join(pieces))
+    except GeneratorExit:
+        # El navegador se desconectó: se corta la generación en el proveedor y se
+        # guarda lo que alcanzó a ver el estudiante
+        upstream.close()
+        if pieces:
+            ChatMessage.objects.create(session=session, sender='bot', message=render_markdown(''.join(pieces)))
+        raise
+    except Exception:
+        logger.exception("Error with OpenAI API")
+        # Se guarda lo que el estudiante ya vio, con el aviso: `done` lleva lo mismo
+        failed = True
+        bot_message = with_error_notice(render_markdown(''.join(pieces)) if pieces else '')
+    else:
+        failed = False
+    finally:
+        upstream.close()
+
+    msg = ChatMessage.objects.create(session=session, sender='bot', message=bot_message)
+    yield sse_event('done', {
+        'id': msg.id,
+        'html': bot_message,
+        'timestamp': msg.timestamp.strftime('%H:%M'),
+        'timing': timings.header(),
+        'error': failed,
+    })
+
+
+@student_required
+@login_required
+@require_POST
+def send_message_stream(request):
+    """
+    Variante de send_message que envía la respuesta con server-sent events a
+    medida que el modelo la genera, en lugar de esperar la respuesta completa.
+    """
+    user_message = request.POST.get('message') or ''
+    try:
+        session = ChatSession.objects.select_related('course').get(id=request.POST.get('session_id'), user=request.user)
+    except (ChatSession.DoesNotExist, ValueError):
+        return JsonResponse({'error': 'Chat session not found'}, status=404)
+
+    timings = Timings()
+    user_msg, messages_for_api, probe = prepare_messages(request.user, session, user_message, timings)
+
+    response = StreamingHttpResponse(
+        stream_reply(session, user_msg, messages_for_api, timings, probe),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Que los proxies no acumulen el stream
+    response['Server-Timing'] = timings.header()
+    return response
+
+
 @student_required
 @login_required
 def create_session_course(request, course_id):
@@ -194,47 +263,143 @@ def delete_session(request, session_id):
     return redirect('chatbot:chatbot')
 
 
-def get_student_group(user, course_id):
-    enrollment = Enrollment.objects.select_related('group').filter(
-        student=user,
-        group__course_id=course_id
-    ).first()
-    
-    if enrollment:
-        return enrollment.group
-    return None
+def save_and_load_history(user, session, message):
+    """Guarda el mensaje del estudiante y devuelve el mensaje y la memoria de conversación."""
+    user_msg = ChatMessage.objects.create(session=session, sender='user', message=message)
+    return user_msg, get_chat_context(session)
+
+
+def prepare_messages(user, session, user_message, timings):
+    """
+    Guarda el mensaje del estudiante y arma los mensajes para el modelo.
+
+    Las etapas independientes corren en paralelo: el embedding de la pregunta y
+    el guardado del mensaje con la carga del historial van al pool del chat
+    mientras este hilo hace las consultas de la búsqueda RAG.
+
+    Devuelve también la consulta a la caché semántica del curso (None si no la
+    usa); si trae respuesta no hay mensajes para el modelo.
+    """
+    embedding = None
+    if session.course_id:
+        embedding = submit(timings.timed('embedding', rag_processor.embed_query), user_message, session.course_id)
+    history = submit(timings.timed('history', save_and_load_history), user, session, user_message)
+
+    # Prompt del sistema compilado (global + curso + grupo), en caché por curso y grupo
+    system_prompt = timings.timed('prompt', prompt_compiler.for_session)(user, session)
+    probe, rag_context = timings.timed('retrieval', search_knowledge)(
+        user, session, user_message, system_prompt, embedding
+    )
+    # Memoria de conversación
+    user_msg, context_messages = history.result()
+    timings.mark('prepare')
+    if probe and probe.answer:
+        return user_msg, None, probe
+    return user_msg, build_messages(system_prompt, user_message, context_messages, rag_context), probe
+
+
+def render_markdown(text):
+    """Markdown de la respuesta a HTML con resaltado de sintaxis (con caché y pool de renderizadores)."""
+    return markdown_renderer.render(text)
+
 
+def search_knowledge(user, session, query, system_prompt, query_embedding=None):
+    """
+    Consulta la caché semántica del curso y, si no hay respuesta guardada,
+    arma el contexto RAG. Devuelve (consulta a la caché, contexto); nunca
+    lanza, sin caché ni contexto se responde igual.
+
+    La caché solo se usa con la primera pregunta de la sesión: una pregunta de
+    seguimiento ("¿y el segundo?") depende de la conversación y la respuesta
+    de otro estudiante no le sirve.
+    """
+    if not session.course_id:
+        return None, ""
+    try:
+        # El grupo del estudiante ya está en la caché del prompt
+        group = rag_processor.chat_group(session.course_id, prompt_compiler.group_id(user, session.course_id))
+    except Exception:
+        return None, ""
+
+    probe = None
+    try:
+        if is_first_turn(session):
+            probe = answer_cache.probe(session.course_id, group, system_prompt, query, query_embedding)
+    except Exception:
+        logger.exception("Error with the answer cache")
+    if probe and probe.answer:
+        return probe, ""
 
-def get_chat_context(user, session, limit=5):
+    try:
+        return probe, rag_processor.create_rag_context(
+            query, session.course_id, group=group, query_embedding=query_embedding
+        )
+    except Exception:
+        return probe, ""
+
+
+def is_first_turn(session):
+    """Si el bot aún no respondió nada en la sesión (sin importar el mensaje que se está guardando)."""
+    return not session.summary and not ChatMessage.objects.filter(session=session, sender='bot').exists()
+
+
+def build_messages(system_prompt, user_message, context_messages, rag_context):
     """
-    Devuelve los últimos mensajes en formato messages para OpenAI,
-    incluyendo siempre el prompt del grupo específico si existe
+    Mensajes para el modelo: prompt del sistema, historial, contexto RAG y la pregunta.
+
+    Lo estático va primero y lo que cambia en cada mensaje al final, para que el
+    proveedor pueda reutilizar su caché de prompts con el prefijo común.
     """
-    recent_messages = ChatMessage.objects.filter(
-        session=session
-    ).order_by('-timestamp')[:limit]
+    # Prompt del sistema compilado (base, global, curso y grupo)
+    messages_for_api = [{"role": "system", "content": system_prompt}]
+
+    # Añadir contexto de conversación
+    messages_for_api.extend(context_messages)
+
+    # Añadir contexto RAG si está disponible
+    if rag_context:
+        messages_for_api.append({"role": "system", "content": rag_context})
+
+    # Añadir mensaje del usuario
+    messages_for_api.append({"role": "user", "content": user_message})
+    return messages_for_api
+
+
+def get_chat_context(session):
+    """
+    Devuelve la memoria de la conversación en formato messages para OpenAI:
+    el resumen de la sesión y los mensajes que aún no cubre.
+    El prompt del grupo va en el prompt del sistema (ver chatbot.prompts).
+    """
+    return chat_context_messages(session, list(history_queryset(session)))
+
+
+def history_queryset(session):
+    """Mensajes posteriores al resumen, del más reciente al más antiguo."""
+    if settings.CHAT_SUMMARY_ENABLED:
+        queryset = ChatMessage.objects.filter(session=session, id__gt=session.summarized_until)
+        limit = conversation_summarizer.history_limit
+    else:
+        queryset = ChatMessage.objects.filter(session=session)
+        limit = settings.CHAT_RECENT_MESSAGES
+    return queryset.order_by('-id')[:limit]
+
 
+def chat_context_messages(session, recent_messages):
+    """Resumen de la conversación (si hay) y el historial, del mensaje más antiguo al más reciente."""
     messages = []
-    
-    if session.course_id:
-        try:
-            group = get_student_group(user, session.course_id)
-            
-            if group and group.ai_prompt and group.ai_prompt.strip():
-                group_context = f"""Instrucciones específicas para el grupo {group.name} del curso {session.course.name}:
 
-{group.ai_prompt}
+    if settings.CHAT_SUMMARY_ENABLED and session.summary:
+        messages.append({
+            "role": "system",
+            "content": f"Resumen de la conversación hasta ahora:\n\n{session.summary}",
+        })
 
-Recuerda seguir estas instrucciones en todas tus respuestas."""
-                messages.append({"role": "system", "content": group_context})
-        except Exception as e:
-            print(f"Error loading group prompt: {e}")
-    
     # Añadir historial de conversación
     for msg in reversed(recent_messages):
         role = 'assistant' if msg.sender == 'bot' else 'user'
         messages.append({"role": role, "content": msg.message})
-        
+
     return messages
 
 
@@ -268,31 +433,62 @@ def poll_messages(request):
     if not session_id:
         return JsonResponse({'error': 'session_id requerido'}, status=400)
 
-    try:
-        session = ChatSession.objects.select_related('course').get(id=session_id, user=request.user)
-    except ChatSession.DoesNotExist:
+    session = session_with_latest_message(request.user, session_id).first()
+    if session is None:
         return JsonResponse({'error': 'Sesión no encontrada'}, status=404)
 
-    qs = ChatMessage.objects.filter(session=session).order_by('id')
-    if after_id:
-        try:
-            qs = qs.filter(id__gt=int(after_id))
-        except ValueError:
-            pass
+    # La mayoría de las consultas no traen nada nuevo: se responden sin leer mensajes
+    etag = poll_etag(session)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
 
+    after_id = parse_message_id(after_id)
     out = []
-    for msg in qs:
-        # El bot guarda HTML ya convertido con markdown; el usuario es texto plano.
-        if msg.sender == 'user':
-            html = escape(msg.message)  # evitamos inyección accidental
-        else:
-            html = msg.message  # ya es HTML seguro para mostrar
-
-        out.append({
-            'id': msg.id,
-            'sender': msg.sender,
-            'html': html,
-            'timestamp': msg.timestamp.strftime('%H:%M'),
-        })
+    if after_id is None or after_id < (session.latest_message_id or 0):
+        qs = ChatMessage.objects.filter(session=session).order_by('id')
+        if after_id is not None:
+            qs = qs.filter(id__gt=after_id)
+        out = [serialize_message(msg) for msg in qs]
+
+    return poll_response(out, etag)
 
-    return JsonResponse({'messages': out})
\ No newline at end of file
+
+def session_with_latest_message(user, session_id):
+    """La sesión del usuario anotada con el id de su último mensaje (una sola consulta)."""
+    latest = ChatMessage.objects.filter(session=OuterRef('pk')).order_by('-id').values('id')[:1]
+    return ChatSession.objects.filter(id=session_id, user=user).annotate(latest_message_id=Subquery(latest))
+
+
+def poll_etag(session):
+    # Los mensajes no se editan: el último id identifica la respuesta de cada after_id
+    return f'W/"{session.latest_message_id or 0}"'
+
+
+def poll_response(messages, etag):
+    response = JsonResponse({'messages': messages})
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'  # El navegador revalida con If-None-Match
+    return response
+
+
+def parse_message_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def serialize_message(msg):
+    # El bot guarda HTML ya convertido con markdown; el usuario es texto plano.
+    if msg.sender == 'user':
+        html = escape(msg.message)  # evitamos inyección accidental
+    else:
+        html = msg.message  # ya es HTML seguro para mostrar
+
+    return {
+        'id': msg.id,
+        'sender': msg.sender,
+        'html': html,
+        'timestamp': msg.timestamp.strftime('%H:%M'),
+    }
@@ -0,0 +1,141 @@
+# courses/answer_cache.py
+import hashlib
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import background
+from .models import AnswerCache, CachedAnswer
+from .rag_utils import rag_processor
+
+
+def _version(parts: Iterable) -> str:
+    return hashlib.sha1('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+class AnswerCacheProbe:
+    """A question looked up in a course's answer cache, and the answer found (or None)."""
+
+    def __init__(self, config: AnswerCache, group_id: Optional[int], prompt_version: str, index_version: str,
+                 model: str, vector: np.ndarray, question: str):
+        self.config = config
+        self.group_id = group_id
+        self.prompt_version = prompt_version
+        self.index_version = index_version
+        self.model = model
+        self.vector = vector
+        self.question = question
+        self.answer: Optional[str] = None
+
+
+class SemanticAnswerCache:
+    """
+    Opt-in cache of the chatbot's answers, per course and group.
+
+    During exam weeks many students of a group ask the same question in
+    slightly different words. When the course enables the cache, a question
+    whose embedding is at least `similarity_threshold` similar to one already
+    answered gets that answer at once, without retrieval or a completion.
+    Entries only match within the same group, the same compiled system
+    prompt and the same searchable documents: editing a prompt layer or the
+    knowledge base changes those versions and the old answers stop matching
+    (they age out or are purged). Lookups and hits are counted per course.
+    """
+
+    def __init__(self, max_entries=None):
+        self._max_entries = max_entries
+
+    @property
+    def max_entries(self) -> int:
+        return settings.ANSWER_CACHE_MAX_ENTRIES if self._max_entries is None else self._max_entries
+
+    def probe(self, course_id: int, group, system_prompt: str, question: str,
+              query_embedding) -> Optional[AnswerCacheProbe]:
+        """
+        Look `question` up in the course's cache. None when the course does not
+        use it; otherwise a probe whose `answer` is set on a hit, to be passed
+        to `remember` with the new answer on a miss. `query_embedding` is a
+        result of `embed_query` or a Future of one.
+        """
+        config = AnswerCache.objects.filter(course_id=course_id, enabled=True).first()
+        if config is None:
+            return None
+        index_version = rag_processor.index_version(course_id, group)
+        if isinstance(query_embedding, Future):
+            query_embedding = query_embedding.result()
+        model, vector = query_embedding if query_embedding is not None else rag_processor.embed_query(question, course_id)
+
+        probe = AnswerCacheProbe(
+            config, group.pk if group else None, _version([system_prompt]), index_version, model, vector, question
+        )
+        probe.answer = self.lookup(probe)
+        return probe
+
+    def lookup(self, probe: AnswerCacheProbe) -> Optional[str]:
+        rows = [
+            (pk, vector) for pk, vector in self._entries(probe).values_list('id', 'vector')
+            if len(vector) == probe.vector.nbytes
+        ]
+        best = None
+        if rows:
+            matrix = np.frombuffer(b''.join(bytes(vector) for _, vector in rows), dtype=np.float32).reshape(len(rows), -1)
+            scores = matrix @ probe.vector
+            index = int(np.argmax(scores))
+            if scores[index] >= probe.config.similarity_threshold:
+                best = rows[index][0]
+
+        AnswerCache.objects.filter(pk=probe.config.pk).update(
+            lookups=F('lookups') + 1, hits=F('hits') + (1 if best else 0)
+        )
+        if best is None:
+            return None
+        CachedAnswer.objects.filter(pk=best).update(hits=F('hits') + 1)
+        return CachedAnswer.objects.filter(pk=best).values_list('answer', flat=True).first()
+
+    def _entries(self, probe: AnswerCacheProbe):
+        return CachedAnswer.objects.filter(
+            course_id=probe.config.course_id,
+            group_id=probe.group_id,
+            prompt_version=probe.prompt_version,
+            index_version=probe.index_version,
+            model=probe.model,
+            created_at__gte=timezone.now() - timedelta(hours=probe.config.max_age_hours),
+        )
+
+    def store(self, probe: AnswerCacheProbe, answer: str) -> None:
+        course_id = probe.config.course_id
+        CachedAnswer.objects.create(
+            course_id=course_id,
+            group_id=probe.group_id,
+            prompt_version=probe.prompt_version,
+            index_version=probe.index_version,
+            model=probe.model,
+            question=probe.question,
+            answer=answer,
+            vector=probe.vector.astype(np.float32).tobytes(),
+        )
+        # The oldest entries of the course go first once it is over its limit
+        stale = CachedAnswer.objects.filter(course_id=course_id).order_by('-created_at', '-id')[self.max_entries:]
+        stale_ids = list(stale.values_list('id', flat=True))
+        if stale_ids:
+            CachedAnswer.objects.filter(pk__in=stale_ids).delete()
+
+    def remember(self, probe: Optional[AnswerCacheProbe], answer: str) -> None:
+        """Store a fresh answer to the probed question in the background."""
+        if probe is not None and probe.answer is None and answer:
+            background.submit(self.store, probe, answer)
+
+    def purge(self, course_id: int) -> int:
+        """Delete every cached answer of the course and reset its metrics."""
+        deleted, _ = CachedAnswer.objects.filter(course_id=course_id).delete()
+        AnswerCache.objects.filter(course_id=course_id).update(lookups=0, hits=0)
+        return deleted
+
+
+# Global instance
+answer_cache = SemanticAnswerCache()
@@ -0,0 +1,46 @@
+# courses/background.py
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _executor_instance() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.BACKGROUND_WORKERS,
+                    thread_name_prefix='turing-background',
+                )
+    return _executor
+
+
+def _run(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(fn, '__name__', fn))
+        raise
+    finally:
+        # Each worker thread has its own database connections
+        connections.close_all()
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    Run `fn` on the process-wide background thread pool.
+
+    There is no task queue in this project: work started here lives in the
+    web process, so it must be safe to redo (e.g. reprocessing a file) if the
+    process restarts before it finishes.
+    """
+    return _executor_instance().submit(_run, fn, args, kwargs)
@@ -0,0 +1,224 @@
+# courses/bulk_import.py
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.utils import timezone
+
+from . import background
+from .ingest import ingest_pdf
+from .models import KnowledgeImport, KnowledgeImportItem
+
+logger = logging.getLogger(__name__)
+
+
+class ImportArchiveError(Exception):
+    """The archive cannot be imported; the message is shown to the user."""
+
+
+def _pdf_members(archive):
+    for info in archive.infolist():
+        basename = posixpath.basename(info.filename)
+        if info.is_dir() or info.filename.startswith('__MACOSX/') or basename.startswith('.'):
+            continue
+        if basename.lower().endswith('.pdf'):
+            yield info
+
+
+def create_import(course, user, archive) -> KnowledgeImport:
+    """
+    Register the PDFs of an uploaded zip and start processing them.
+
+    Only the central directory of the archive is read here; the PDFs are
+    streamed out of it one at a time by the background workers.
+    """
+    fd, path = tempfile.mkstemp(suffix='.zip')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for block in archive.chunks():
+                out.write(block)
+        
+        try:
+            with zipfile.ZipFile(path) as zf:
+                members = list(_pdf_members(zf))
+        except zipfile.BadZipFile:
+            raise ImportArchiveError("El archivo no es un zip válido.")
+        
+        if not members:
+            raise ImportArchiveError("El zip no contiene archivos PDF.")
+        if len(members) > settings.KNOWLEDGE_IMPORT_MAX_FILES:
+            raise ImportArchiveError(f"El zip contiene más de {settings.KNOWLEDGE_IMPORT_MAX_FILES} PDFs.")
+        
+        basenames = [posixpath.basename(info.filename) for info in members]
+        with transaction.atomic():
+            job = KnowledgeImport.objects.create(
+                course=course, created_by=user, archive_name=archive.name, archive_path=path,
+            )
+            items = []
+            for info, basename in zip(members, basenames):
+                # Two PDFs with the same name in different folders keep their path
+                item = KnowledgeImportItem(
+                    job=job,
+                    member=info.filename,
+                    name=basename if basenames.count(basename) == 1 else info.filename,
+                    size=info.file_size,
+                )
+                if info.file_size > settings.KNOWLEDGE_IMPORT_MAX_FILE_BYTES:
+                    item.status = KnowledgeImportItem.Status.FAILED
+                    item.error = "El archivo supera el tamaño máximo permitido."
+                items.append(item)
+            KnowledgeImportItem.objects.bulk_create(items)
+            transaction.on_commit(lambda: start_import(job.pk))
+        return job
+    except BaseException:
+        os.remove(path)
+        raise
+
+
+def _claim_next(job):
+    """Mark the next pending PDF of the job as processing and return it, or None when there is none."""
+    while True:
+        item = job.items.filter(status=KnowledgeImportItem.Status.PENDING).first()
+        if item is None:
+            return None
+        # Another worker may have claimed it first
+        if KnowledgeImportItem.objects.filter(pk=item.pk, status=KnowledgeImportItem.Status.PENDING).update(
+            status=KnowledgeImportItem.Status.PROCESSING
+        ):
+            return item
+
+
+def _heartbeat(job_pk):
+    KnowledgeImport.objects.filter(pk=job_pk).update(heartbeat_at=timezone.now())
+
+
+def _import_item(job, item):
+    """Stream one PDF out of the archive into a temporary file and ingest it."""
+    def progress(pages_done):
+        KnowledgeImportItem.objects.filter(pk=item.pk).update(pages_done=pages_done)
+        _heartbeat(job.pk)
+    
+    try:
+        with zipfile.ZipFile(job.archive_path) as zf, zf.open(item.member) as member:
+            upload = TemporaryUploadedFile(posixpath.basename(item.member), 'application/pdf', item.size, None)
+            with upload:
+                shutil.copyfileobj(member, upload, 1024 * 1024)
+                upload.seek(0)
+                file_obj, result = ingest_pdf(job.course, item.name, upload, progress=progress)
+        
+        item.knowledge_file = file_obj
+        item.chunks_count = result.get('chunks_count', 0)
+        item.error = result.get('error', '')
+        item.status = KnowledgeImportItem.Status.DONE if result['success'] else KnowledgeImportItem.Status.FAILED
+    except Exception as e:
+        logger.exception("Import of %s failed", item.member)
+        item.error = str(e)
+        item.status = KnowledgeImportItem.Status.FAILED
+    finally:
+        item.save(update_fields=['knowledge_file', 'chunks_count', 'error', 'status'])
+
+
+def _remove_archive(path):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _finish_if_complete(job):
+    """Close the job once no PDF is left; only the worker that closes it removes the archive."""
+    unfinished = [KnowledgeImportItem.Status.PENDING, KnowledgeImportItem.Status.PROCESSING]
+    if job.items.filter(status__in=unfinished).exists():
+        return
+    if KnowledgeImport.objects.filter(pk=job.pk, status=KnowledgeImport.Status.RUNNING).update(
+        status=KnowledgeImport.Status.DONE, finished_at=timezone.now()
+    ):
+        _remove_archive(job.archive_path)
+
+
+def import_next(job_pk: int) -> None:
+    """
+    Process one pending PDF of an import and queue the next one.
+
+    Each PDF is its own task on the background pool, so a long import takes
+    turns with other background work instead of holding a worker throughout.
+    """
+    job = KnowledgeImport.objects.select_related('course').get(pk=job_pk)
+    if job.status != KnowledgeImport.Status.RUNNING:
+        return
+    item = _claim_next(job)
+    if item is None:
+        _finish_if_complete(job)
+        return
+    _heartbeat(job.pk)
+    _import_item(job, item)
+    _heartbeat(job.pk)
+    background.submit(import_next, job_pk)
+
+
+def start_import(job_pk: int) -> None:
+    """Start `KNOWLEDGE_IMPORT_CONCURRENCY` chains of `import_next` for the job."""
+    KnowledgeImport.objects.filter(pk=job_pk, status=KnowledgeImport.Status.PENDING).update(
+        status=KnowledgeImport.Status.RUNNING, heartbeat_at=timezone.now()
+    )
+    for _ in range(max(1, settings.KNOWLEDGE_IMPORT_CONCURRENCY)):
+        background.submit(import_next, job_pk)
+
+
+def fail_stale_imports(course=None) -> int:
+    """
+    Mark as failed the imports that stopped making progress.
+
+    Work on the background pool lives in the web process; if it restarts in
+    the middle of an import nothing resumes it. Called from the views that
+    list or poll imports. Returns how many imports were failed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.KNOWLEDGE_IMPORT_STALE_AFTER)
+    stale = KnowledgeImport.objects.filter(
+        status__in=[KnowledgeImport.Status.PENDING, KnowledgeImport.Status.RUNNING],
+        heartbeat_at__lt=cutoff,
+    )
+    if course is not None:
+        stale = stale.filter(course=course)
+    
+    failed = 0
+    for job in stale:
+        closed = KnowledgeImport.objects.filter(pk=job.pk, status=job.status, heartbeat_at__lt=cutoff).update(
+            status=KnowledgeImport.Status.FAILED,
+            error="La importación se interrumpió; vuelve a subir el zip.",
+            finished_at=timezone.now(),
+        )
+        if not closed:
+            continue
+        job.items.filter(
+            status__in=[KnowledgeImportItem.Status.PENDING, KnowledgeImportItem.Status.PROCESSING]
+        ).update(status=KnowledgeImportItem.Status.FAILED, error="Importación interrumpida.")
+        _remove_archive(job.archive_path)
+        failed += 1
+    return failed
+
+
+def import_progress(job) -> dict:
+    """Overall and per-file progress of an import, for the polling endpoint."""
+    items = list(job.items.values('id', 'name', 'status', 'pages_done', 'chunks_count', 'error'))
+    finished = [item for item in items if item['status'] in (KnowledgeImportItem.Status.DONE, KnowledgeImportItem.Status.FAILED)]
+    return {
+        'id': job.pk,
+        'archive_name': job.archive_name,
+        'status': job.status,
+        'error': job.error,
+        'total': len(items),
+        'finished': len(finished),
+        'failed': sum(1 for item in finished if item['status'] == KnowledgeImportItem.Status.FAILED),
+        'percent': round(100 * len(finished) / len(items)) if items else 100,
+        'items': items,
+    }
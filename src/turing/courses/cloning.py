@@ -0,0 +1,115 @@
+# courses/cloning.py
+from django.db import transaction
+
+from .models import (
+    Course, CoursePrompt, Group, IndexSegment, KnowledgeBaseFile, KnowledgeSummary, RetrievalProfile,
+)
+
+
+def clone_course(source: Course, owner, include_groups: bool = True, **fields) -> Course:
+    """
+    Copy a course for a new semester and return the new course.
+
+    The prompt, the retrieval profile, the groups (with their AI prompts and
+    knowledge scopes, but no students) and the knowledge base are copied in
+    bulk. Knowledge files keep
+    pointing at the same stored PDF and processed document, and the course's
+    index segments and overview summary are copied as they are, so the new
+    course is searchable at once without extracting or embedding anything.
+    Re-uploading a file in either course creates a new document for it and
+    leaves the other course untouched. `fields` override the course's own
+    (name, description, level, schedule).
+    """
+    with transaction.atomic():
+        values = {
+            'name': source.name,
+            'description': source.description,
+            'level': source.level,
+            'schedule': source.schedule,
+        }
+        values.update(fields)
+        course = Course.objects.create(owner=owner, embedding_model=source.embedding_model, **values)
+
+        prompt = CoursePrompt.objects.filter(course=source).first()
+        if prompt:
+            CoursePrompt.objects.create(course=course, content=prompt.content, updated_by=owner)
+
+        # Same chunking, so the copied files keep matching their documents
+        profile = RetrievalProfile.objects.filter(course=source).first()
+        if profile:
+            RetrievalProfile.objects.create(
+                course=course,
+                chunk_size=profile.chunk_size,
+                chunk_overlap=profile.chunk_overlap,
+                top_k=profile.top_k,
+                score_threshold=profile.score_threshold,
+                engine=profile.engine,
+            )
+
+        files = list(source.knowledge_files.order_by('pk'))
+        copies = KnowledgeBaseFile.objects.bulk_create([
+            KnowledgeBaseFile(
+                course=course,
+                file=knowledge_file.file.name,
+                name=knowledge_file.name,
+                processed=knowledge_file.processed,
+                processing_error=knowledge_file.processing_error,
+                chunks_count=knowledge_file.chunks_count,
+                text_length=knowledge_file.text_length,
+                document_id=knowledge_file.document_id,
+            )
+            for knowledge_file in files
+        ])
+        file_ids = {original.pk: copy.pk for original, copy in zip(files, copies)}
+
+        IndexSegment.objects.bulk_create([
+            IndexSegment(
+                course=course,
+                model=segment.model,
+                documents=segment.documents,
+                tombstones=segment.tombstones,
+                rows=segment.rows,
+                chunk_ids=segment.chunk_ids,
+                row_documents=segment.row_documents,
+                vectors=segment.vectors,
+            )
+            for segment in IndexSegment.objects.filter(course=source)
+        ])
+
+        KnowledgeSummary.objects.bulk_create([
+            KnowledgeSummary(
+                level=summary.level,
+                course=course,
+                first_page=summary.first_page,
+                last_page=summary.last_page,
+                text=summary.text,
+                source_hash=summary.source_hash,
+                token_count=summary.token_count,
+                vector=summary.vector,
+                embedding_model=summary.embedding_model,
+            )
+            for summary in KnowledgeSummary.objects.filter(course=source, level=KnowledgeSummary.Level.COURSE)
+        ])
+
+        if include_groups:
+            groups = list(source.groups.order_by('pk').prefetch_related('knowledge_files'))
+            group_copies = Group.objects.bulk_create([
+                Group(
+                    course=course,
+                    teacher_id=group.teacher_id,
+                    name=group.name,
+                    schedule=group.schedule,
+                    ai_prompt=group.ai_prompt,
+                    scoped_knowledge=group.scoped_knowledge,
+                )
+                for group in groups
+            ])
+            Scope = Group.knowledge_files.through
+            Scope.objects.bulk_create([
+                Scope(group_id=copy.pk, knowledgebasefile_id=file_ids[knowledge_file.pk])
+                for group, copy in zip(groups, group_copies)
+                for knowledge_file in group.knowledge_files.all()
+                if knowledge_file.pk in file_ids
+            ])
+
+    return course
@@ -0,0 +1,109 @@
+# courses/direct_upload.py
+import os
+import uuid
+from datetime import timedelta
+from typing import Any, Dict
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from storages.utils import safe_join
+
+from .models import DirectUploadClaim
+
+SIGNING_SALT = 'courses.direct_upload'
+
+
+class DirectUploadError(Exception):
+    """The upload could not be started or completed; the message is shown to the user."""
+
+
+def direct_upload_enabled(storage=None) -> bool:
+    """Direct uploads need an S3-compatible backend (one with a boto3 bucket)."""
+    storage = storage or default_storage
+    return settings.DIRECT_UPLOADS_ENABLED and hasattr(storage, 'bucket')
+
+
+def start_upload(field_file, instance, filename: str, purpose: str, user, course_id: int) -> Dict[str, Any]:
+    """
+    Reserve a storage name for `filename` and presign a PUT to it.
+
+    The client sends the file straight to the bucket and then calls the
+    completion endpoint with the returned token, which binds the name to the
+    purpose, user and course it was issued for.
+    """
+    storage = field_file.storage
+    if not direct_upload_enabled(storage):
+        raise DirectUploadError("El almacenamiento configurado no admite subidas directas.")
+    if os.path.splitext(filename)[1].lower() != '.pdf':
+        raise DirectUploadError("Solo se permiten archivos PDF.")
+    
+    name = field_file.field.generate_filename(instance, filename)
+    root, extension = os.path.splitext(name)
+    # The bucket overwrites existing keys, so every upload gets its own name
+    name = f"{root}-{uuid.uuid4().hex[:8]}{extension}"
+    
+    url = storage.bucket.meta.client.generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': storage.bucket.name,
+            # The key S3Storage stores `name` under: the name inside its `location`
+            'Key': safe_join(storage.location, name),
+            'ContentType': 'application/pdf',
+        },
+        ExpiresIn=settings.DIRECT_UPLOAD_EXPIRES,
+        HttpMethod='PUT',
+    )
+    token = signing.dumps(
+        {'name': name, 'filename': filename, 'purpose': purpose, 'user': user.pk, 'course': course_id},
+        salt=SIGNING_SALT,
+    )
+    return {
+        'url': url,
+        'method': 'PUT',
+        'headers': {'Content-Type': 'application/pdf'},
+        'token': token,
+    }
+
+
+def finish_upload(field, token: str, purpose: str, user, course_id: int) -> Dict[str, Any]:
+    """
+    Validate a completion token and the uploaded object stored for the file
+    `field` (e.g. KnowledgeBaseFile's `file`).
+
+    Returns the token data: the storage `name` and the original `filename`.
+    A token is single-use: a second row pointing at the same object would
+    delete it from under the first one when either is removed, so a replay
+    is rejected. The claim is a DirectUploadClaim row, so it holds across
+    processes.
+    """
+    storage = field.storage
+    try:
+        data = signing.loads(token, salt=SIGNING_SALT, max_age=settings.DIRECT_UPLOAD_EXPIRES * 2)
+    except signing.BadSignature:
+        raise DirectUploadError("La subida expiró o no es válida. Intenta de nuevo.")
+    
+    if (data.get('purpose'), data.get('user'), data.get('course')) != (purpose, user.pk, course_id):
+        raise DirectUploadError("La subida no corresponde a este curso.")
+    
+    name = data['name']
+    if field.model._default_manager.filter(**{field.name: name}).exists():
+        raise DirectUploadError("Esta subida ya se registró.")
+    if not storage.exists(name):
+        raise DirectUploadError("El archivo no llegó al almacenamiento.")
+    if storage.size(name) > settings.DIRECT_UPLOAD_MAX_BYTES:
+        storage.delete(name)
+        raise DirectUploadError("El archivo supera el tamaño máximo permitido.")
+    # Claimed last, so a completion sent before the PUT finished can be retried.
+    # The unique name also rejects two completions racing each other.
+    try:
+        with transaction.atomic():
+            DirectUploadClaim.objects.create(name=name)
+    except IntegrityError:
+        raise DirectUploadError("Esta subida ya se registró.")
+    # Tokens older than this no longer validate, so their claims can go
+    expired = timezone.now() - timedelta(seconds=settings.DIRECT_UPLOAD_EXPIRES * 2)
+    DirectUploadClaim.objects.filter(claimed_at__lt=expired).delete()
+    return data
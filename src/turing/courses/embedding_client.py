@@ -0,0 +1,152 @@
+# courses/embedding_client.py
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from turing.llm_gateway import RETRYABLE_ERRORS, get_gateway
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self, amount: float) -> float:
+        """Take `amount` tokens and return 0, or return how long to wait for them."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount: float = 1.0) -> None:
+        """Block until `amount` tokens are available and take them."""
+        if not self.rate:
+            return
+        amount = min(amount, self.capacity)
+        while wait := self._take(amount):
+            time.sleep(wait)
+
+    async def aacquire(self, amount: float = 1.0) -> None:
+        """Wait, without blocking the event loop, until `amount` tokens are available and take them."""
+        if not self.rate:
+            return
+        amount = min(amount, self.capacity)
+        while wait := self._take(amount):
+            await asyncio.sleep(wait)
+
+
+class EmbeddingClient:
+    """
+    Sends embedding batches through the shared LLM gateway.
+
+    Batches run concurrently on a small thread pool, every request first takes
+    its share of the request and token quotas from two token buckets, and
+    429/5xx/network errors are retried with jittered exponential backoff
+    (here rather than in the gateway, so every retry also waits for quota).
+    """
+
+    def __init__(self, gateway=None, model=None, concurrency=None, requests_per_minute=None,
+                 tokens_per_minute=None, max_retries=None, backoff_base=0.5, backoff_max=20.0):
+        self._gateway = gateway
+        self.model = model or settings.EMBEDDING_MODEL
+        self.concurrency = concurrency or settings.EMBEDDING_CONCURRENCY
+        self.max_retries = settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        requests_per_minute = requests_per_minute or settings.EMBEDDING_REQUESTS_PER_MINUTE
+        tokens_per_minute = tokens_per_minute or settings.EMBEDDING_TOKENS_PER_MINUTE
+        # Allow bursts of up to ten seconds worth of quota
+        self.request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute / 6)
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 6)
+
+    @property
+    def gateway(self):
+        return self._gateway or get_gateway()
+
+    @staticmethod
+    def estimate_tokens(texts: Sequence[str]) -> int:
+        """Rough token count (about four characters per token) used for rate limiting."""
+        return sum(len(text) for text in texts) // 4 + 1
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # Full jitter keeps concurrent batches from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def embed(self, texts: Sequence[str], model: Optional[str] = None) -> List[List[float]]:
+        """Embed a single batch with `model` (default: the configured one), retrying transient failures."""
+        attempt = 0
+        while True:
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(self.estimate_tokens(texts))
+            try:
+                return self.gateway.embed(
+                    texts, model=model or self.model, timeout=settings.EMBEDDING_TIMEOUT, retries=0
+                )
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    async def aembed(self, texts: Sequence[str], model: Optional[str] = None) -> List[List[float]]:
+        """Async version of embed, for the ASGI views."""
+        attempt = 0
+        while True:
+            await self.request_bucket.aacquire(1)
+            await self.token_bucket.aacquire(self.estimate_tokens(texts))
+            try:
+                return await self.gateway.aembed(
+                    texts, model=model or self.model, timeout=settings.EMBEDDING_TIMEOUT, retries=0
+                )
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt, e))
+                attempt += 1
+
+    def embed_batches(self, batches: Sequence[Sequence[str]], model: Optional[str] = None) -> Tuple[List[Optional[List[List[float]]]], Dict[int, Exception]]:
+        """
+        Embed several batches concurrently.
+
+        Returns the embeddings of each batch (None for batches that failed after
+        all retries) and a dict with the error of every failed batch.
+        """
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+        errors: Dict[int, Exception] = {}
+        if not batches:
+            return results, errors
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as executor:
+            futures = {executor.submit(self.embed, batch, model): i for i, batch in enumerate(batches)}
+            for future, i in futures.items():
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    errors[i] = e
+        return results, errors
+
+
+# Global instance
+embedding_client = EmbeddingClient()
@@ -1,6 +1,6 @@
 # courses/forms.py
 from django import forms
-from .models import Course, CoursePrompt, KnowledgeBaseFile, TutoringSchedule
+from .models import AnswerCache, Course, CoursePrompt, KnowledgeBaseFile, RetrievalProfile, TutoringSchedule
 
 class CourseForm(forms.ModelForm):
     class Meta:
@@ -10,6 +10,28 @@ class CourseForm(forms.ModelForm):
         widgets = {'description': forms.Textarea(attrs={'rows': 3})}
 
 
+class RetrievalProfileForm(forms.ModelForm):
+    class Meta:
+        model = RetrievalProfile
+        fields = ['chunk_size', 'chunk_overlap', 'top_k', 'score_threshold', 'engine']
+        widgets = {'score_threshold': forms.NumberInput(attrs={'step': '0.05'})}
+
+    def clean(self):
+        cleaned_data = super().clean()
+        chunk_size = cleaned_data.get('chunk_size')
+        chunk_overlap = cleaned_data.get('chunk_overlap')
+        if chunk_size and chunk_overlap is not None and chunk_overlap * 2 > chunk_size:
+            self.add_error('chunk_overlap', 'El solapamiento no puede superar la mitad del tamaño de fragmento.')
+        return cleaned_data
+
+
+class AnswerCacheForm(forms.ModelForm):
+    class Meta:
+        model = AnswerCache
+        fields = ['enabled', 'similarity_threshold', 'max_age_hours']
+        widgets = {'similarity_threshold': forms.NumberInput(attrs={'step': '0.01'})}
+
+
 class JoinByCodeTeacherForm(forms.Form):
     code = forms.CharField(max_length=12)
 
@@ -39,3 +61,10 @@ class TutoringScheduleForm(forms.ModelForm):
         widgets = {
             'file': forms.FileInput(attrs={'accept': '.pdf'}),
         }
+
+
+class KnowledgeImportForm(forms.Form):
+    archive = forms.FileField(
+        label="Archivo zip con PDFs",
+        widget=forms.FileInput(attrs={'accept': '.zip'}),
+    )
@@ -0,0 +1,111 @@
+# courses/ingest.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from django.db import transaction
+
+from .models import KnowledgeBaseFile, KnowledgeDocument
+from .rag_utils import rag_processor
+from .storage_cache import local_copy, storage_cache
+
+
+class StorageUploadError(Exception):
+    """The PDF could not be saved to storage."""
+
+
+def ingest_pdf(course, name: str, upload, progress: Optional[Callable[[int], None]] = None) -> Tuple[KnowledgeBaseFile, Dict[str, Any]]:
+    """
+    Store `upload` as the knowledge base file `name` of `course` and process it.
+
+    Returns the file and the result of `process_pdf_file`; the result has
+    `stored_copy=True` (and `deduplicated=True`) when an identical PDF already
+    in storage was reused, processed document included, instead of uploading
+    and processing it again. Raises StorageUploadError if the upload to
+    storage fails.
+
+    A new version of an existing file only replaces the previous PDF once it
+    is stored: the old object is deleted after the commit, and kept (with the
+    file marked as not processed) if the upload fails.
+    """
+    # Si el mismo PDF ya está en el almacenamiento (en cualquier curso) solo se
+    # guarda una referencia; si además ya se procesó con la misma fragmentación
+    # no se vuelve a extraer ni a generar embeddings.
+    sha256 = rag_processor.file_sha256(upload)
+    document = KnowledgeDocument.objects.filter(
+        sha256=sha256, processed=True, **rag_processor.profile_for(course.pk).chunking
+    ).first()
+    stored_copy = KnowledgeBaseFile.objects.filter(document__sha256=sha256).exclude(file='').first()
+    
+    # Un archivo con el mismo nombre en el curso se trata como una nueva versión:
+    # se reemplaza el PDF y solo se reprocesan las páginas que cambiaron.
+    file_obj = KnowledgeBaseFile.objects.filter(course=course, name=name).first()
+    is_new = file_obj is None
+    if is_new:
+        file_obj = KnowledgeBaseFile(course=course, name=name)
+    previous = None if is_new else file_obj.file.name
+    
+    def release_previous():
+        if previous:
+            transaction.on_commit(lambda: file_obj.release_file(previous))
+    
+    if stored_copy:
+        file_obj.file = stored_copy.file.name
+        file_obj.processing_error = ""
+        file_obj.save()
+        release_previous()
+        if not document:
+            # Otra fragmentación del mismo PDF: solo se procesa, desde la subida local
+            with local_copy(upload) as source:
+                try:
+                    result = rag_processor.process_pdf_file(file_obj, source=source, sha256=sha256, progress=progress)
+                except Exception as e:
+                    result = {'success': False, 'error': str(e)}
+            return file_obj, result
+        rag_processor.attach_document(file_obj, document)
+        rag_processor.publish(file_obj)
+        return file_obj, {
+            'success': True,
+            'stored_copy': True,
+            'deduplicated': True,
+            'chunks_count': document.chunks_count,
+            'text_length': document.text_length,
+        }
+    
+    # La subida al almacenamiento corre en un hilo mientras el texto se extrae
+    # del archivo temporal local, así el PDF no se descarga de vuelta.
+    storage = file_obj.file.storage
+    target = file_obj.file.field.generate_filename(file_obj, upload.name)
+    source = local_copy(upload)
+    with source, ThreadPoolExecutor(max_workers=1) as executor:
+        stored = executor.submit(storage.save, target, upload, max_length=file_obj.file.field.max_length)
+        file_obj.file = target  # Nombre provisional: evita que save() vuelva a subir el archivo
+        file_obj.processing_error = ""
+        file_obj.save()
+        
+        try:
+            result = rag_processor.process_pdf_file(file_obj, source=source, sha256=sha256, progress=progress)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        
+        try:
+            stored_name = stored.result()
+        except Exception as e:
+            # Lo ya indexado corresponde a un PDF que no quedó guardado
+            rag_processor.unpublish(file_obj)
+            if is_new:
+                file_obj.delete()
+            else:
+                # Conserva la versión anterior; reprocesar la vuelve a indexar
+                file_obj.file = previous or ''
+                file_obj.processed = False
+                file_obj.processing_error = str(e)
+                file_obj.save(update_fields=['file', 'processed', 'processing_error'])
+            raise StorageUploadError(str(e)) from e
+        
+        if stored_name != target:
+            file_obj.file = stored_name
+            file_obj.save(update_fields=['file'])
+        release_previous()
+        storage_cache.put(stored_name, source)
+    
+    return file_obj, result
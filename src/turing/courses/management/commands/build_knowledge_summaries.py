@@ -0,0 +1,35 @@
+# courses/management/commands/build_knowledge_summaries.py
+from django.core.management.base import BaseCommand
+
+from courses.models import Course
+from courses.rag_utils import rag_processor
+from courses.summaries import summary_builder
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the summary tree (sections, files and course overview) of each "
+        "course's knowledge base. Only nodes whose content changed call the LLM."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='courses',
+                            help="Only these course ids (repeatable)")
+
+    def handle(self, *args, **options):
+        courses = Course.objects.all()
+        if options['courses']:
+            courses = courses.filter(pk__in=options['courses'])
+        
+        for course in courses:
+            try:
+                node = summary_builder.build_course(course.pk, rag_processor.course_embedding_model(course.pk))
+            except Exception as e:
+                self.stderr.write(f"{course}: {e}")
+                continue
+            nodes = course.summaries.count() + sum(
+                file.document.summaries.count()
+                for file in course.knowledge_files.filter(processed=True, document__isnull=False).select_related('document')
+            )
+            self.stdout.write(f"{course}: {nodes} resúmenes" + ("" if node else " (sin documentos procesados)"))
+        self.stdout.write(self.style.SUCCESS("Resúmenes completos."))
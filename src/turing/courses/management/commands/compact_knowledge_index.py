@@ -0,0 +1,33 @@
+# courses/management/commands/compact_knowledge_index.py
+from django.core.management.base import BaseCommand
+
+from courses.models import Course
+from courses.rag_utils import rag_processor
+from courses.segments import course_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge the index segments of each course into one, dropping tombstoned "
+        "documents. With --rebuild, reseal every processed document from scratch "
+        "(e.g. for courses indexed before segments existed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', dest='courses',
+                            help="Only these course ids (repeatable)")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Rebuild the segments from the chunk rows")
+
+    def handle(self, *args, **options):
+        courses = Course.objects.all()
+        if options['courses']:
+            courses = courses.filter(pk__in=options['courses'])
+        
+        for course in courses:
+            model = rag_processor.course_embedding_model(course.pk)
+            if options['rebuild']:
+                course_index.rebuild(course.pk, model)
+            merged = course_index.merge(course.pk, model, force=True)
+            self.stdout.write(f"{course}: {merged} segmentos compactados.")
+        self.stdout.write(self.style.SUCCESS("Compactación completa."))
@@ -0,0 +1,99 @@
+# courses/management/commands/reindex_knowledge.py
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from courses.models import Course, KnowledgeBaseFile
+from courses.reindex import (
+    ReindexProgress,
+    course_documents,
+    missing_chunks,
+    promote_vectors,
+    reindex_document,
+    switch_ready_courses,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-embed the knowledge base of every course with a new embedding model. "
+        "Courses keep answering from their current index until their new one is "
+        "complete and then switch atomically. The run can be interrupted and "
+        "resumed: it continues with the chunks still missing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=settings.EMBEDDING_MODEL,
+                            help="Target embedding model (default: EMBEDDING_MODEL)")
+        parser.add_argument('--course', type=int, action='append', dest='courses',
+                            help="Only reindex these course ids (repeatable)")
+        parser.add_argument('--workers', type=int, default=2,
+                            help="Documents re-embedded in parallel")
+        parser.add_argument('--report-every', type=float, default=10.0,
+                            help="Seconds between progress reports")
+        parser.add_argument('--no-promote', action='store_true',
+                            help="Keep the new vectors staged instead of replacing the old ones at the end")
+
+    def handle(self, *args, **options):
+        model = options['model']
+        course_ids = options['courses'] or list(Course.objects.values_list('pk', flat=True))
+        document_ids = list(course_documents(course_ids))
+        progress = ReindexProgress(missing_chunks(model, document_ids).count())
+        self.stdout.write(
+            f"Reindexando {len(document_ids)} documentos de {len(course_ids)} cursos con {model}: "
+            f"{progress.chunks_total} fragmentos pendientes."
+        )
+        
+        # Courses with nothing left to embed (or no documents) switch right away
+        switched = switch_ready_courses(model, course_ids)
+        
+        done = threading.Event()
+        
+        def report():
+            while not done.wait(options['report_every']):
+                self.stdout.write(progress.summary())
+        
+        reporter = threading.Thread(target=report, daemon=True)
+        reporter.start()
+        
+        def work(document_id):
+            try:
+                reindex_document(document_id, model, progress)
+            finally:
+                connections.close_all()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                futures = {executor.submit(work, document_id): document_id for document_id in document_ids}
+                for future in as_completed(futures):
+                    document_id = futures[future]
+                    error = future.exception()
+                    progress.document_finished(failed=error is not None)
+                    if error:
+                        self.stderr.write(f"Documento {document_id}: {error}")
+                        continue
+                    # A course switches as soon as its last document is complete
+                    affected = KnowledgeBaseFile.objects.filter(
+                        document_id=document_id, course_id__in=course_ids
+                    ).values_list('course_id', flat=True)
+                    switched += switch_ready_courses(model, set(affected))
+        finally:
+            done.set()
+        
+        self.stdout.write(progress.summary())
+        self.stdout.write(f"Cursos que ya consultan {model}: {len(switched)} cambiados en esta ejecución.")
+        
+        if progress.documents_failed:
+            self.stdout.write(self.style.WARNING(
+                "Algunos documentos fallaron; sus cursos siguen con el índice anterior. "
+                "Vuelve a ejecutar el comando para continuar."
+            ))
+            return
+        
+        if not options['no_promote']:
+            promoted = promote_vectors(model)
+            self.stdout.write(f"Vectores promovidos a los fragmentos: {promoted}.")
+        self.stdout.write(self.style.SUCCESS("Reindexación completa."))
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_json_chunks_to_rows(apps, schema_editor):
+    """
+    Copia los fragmentos y embeddings guardados en JSON a filas de KnowledgeChunk
+    y vacía los campos JSON para que las filas de archivo dejen de pesar megabytes.
+    """
+    KnowledgeBaseFile = apps.get_model('courses', 'KnowledgeBaseFile')
+    KnowledgeChunk = apps.get_model('courses', 'KnowledgeChunk')
+    db_alias = schema_editor.connection.alias
+
+    for kf in KnowledgeBaseFile.objects.using(db_alias).iterator(chunk_size=20):
+        chunks = kf.text_chunks or []
+        embeddings = kf.embeddings or []
+        if chunks and len(chunks) == len(embeddings):
+            KnowledgeChunk.objects.using(db_alias).bulk_create([
+                KnowledgeChunk(file_id=kf.pk, ordinal=i, text=text, embedding=emb)
+                for i, (text, emb) in enumerate(zip(chunks, embeddings))
+            ], batch_size=500)
+            kf.chunks_count = len(chunks)
+        else:
+            # Datos inconsistentes: se reprocesarán desde el PDF.
+            kf.processed = False
+        kf.text_length = len(kf.extracted_text or '')
+        kf.text_chunks = []
+        kf.embeddings = []
+        kf.save(update_fields=['chunks_count', 'text_length', 'text_chunks', 'embeddings', 'processed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0012_alter_group_options_group_ai_prompt_group_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgebasefile',
+            name='chunks_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of chunks persisted for RAG'),
+        ),
+        migrations.AddField(
+            model_name='knowledgebasefile',
+            name='text_length',
+            field=models.PositiveIntegerField(default=0, help_text='Length of the cleaned text processed so far'),
+        ),
+        migrations.CreateModel(
+            name='KnowledgeChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ordinal', models.PositiveIntegerField(help_text='Position of the chunk inside the file')),
+                ('text', models.TextField()),
+                ('embedding', models.JSONField(blank=True, default=list)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='courses.knowledgebasefile')),
+            ],
+            options={
+                'ordering': ['file', 'ordinal'],
+                'unique_together': {('file', 'ordinal')},
+            },
+        ),
+        migrations.RunPython(move_json_chunks_to_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0013_knowledgechunk'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='knowledgechunk',
+            options={'ordering': ['file', 'page', 'ordinal']},
+        ),
+        migrations.AlterUniqueTogether(
+            name='knowledgechunk',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='knowledgebasefile',
+            name='page_hashes',
+            field=models.JSONField(blank=True, default=list, help_text='Content hash of each cleaned page'),
+        ),
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-1 of the chunk text', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='page',
+            field=models.PositiveIntegerField(default=0, help_text='PDF page the chunk was taken from'),
+        ),
+        migrations.AlterField(
+            model_name='knowledgechunk',
+            name='ordinal',
+            field=models.PositiveIntegerField(help_text='Position of the chunk inside its page'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgechunk',
+            index=models.Index(fields=['file', 'page'], name='courses_kno_file_id_6c5c91_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgechunk',
+            index=models.Index(fields=['file', 'content_hash'], name='courses_kno_file_id_c13b65_idx'),
+        ),
+    ]
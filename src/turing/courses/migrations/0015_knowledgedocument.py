@@ -0,0 +1,93 @@
+# Generated by Django 5.2.2 on 2026-10-19 12:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_documents(apps, schema_editor):
+    """
+    Crea un KnowledgeDocument por cada archivo existente y le traspasa sus
+    fragmentos. El SHA-256 queda vacío hasta que el archivo se reprocese.
+    """
+    KnowledgeBaseFile = apps.get_model('courses', 'KnowledgeBaseFile')
+    KnowledgeDocument = apps.get_model('courses', 'KnowledgeDocument')
+    KnowledgeChunk = apps.get_model('courses', 'KnowledgeChunk')
+    db_alias = schema_editor.connection.alias
+
+    for kf in KnowledgeBaseFile.objects.using(db_alias).all():
+        document = KnowledgeDocument.objects.using(db_alias).create(
+            page_hashes=kf.page_hashes,
+            chunks_count=kf.chunks_count,
+            text_length=kf.text_length,
+            processed=kf.processed,
+        )
+        kf.document = document
+        kf.save(update_fields=['document'])
+        KnowledgeChunk.objects.using(db_alias).filter(file_id=kf.pk).update(document=document)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0014_knowledge_page_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('page_hashes', models.JSONField(blank=True, default=list, help_text='Content hash of each cleaned page')),
+                ('chunks_count', models.PositiveIntegerField(default=0)),
+                ('text_length', models.PositiveIntegerField(default=0)),
+                ('processed', models.BooleanField(default=False, help_text='Whether every page has been chunked and embedded')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='knowledgebasefile',
+            name='document',
+            field=models.ForeignKey(blank=True, help_text='Processed content shared with identical uploads', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='files', to='courses.knowledgedocument'),
+        ),
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='document',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='courses.knowledgedocument'),
+        ),
+        migrations.RunPython(create_documents, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='knowledgechunk',
+            name='document',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='courses.knowledgedocument'),
+        ),
+        migrations.RemoveIndex(
+            model_name='knowledgechunk',
+            name='courses_kno_file_id_6c5c91_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='knowledgechunk',
+            name='courses_kno_file_id_c13b65_idx',
+        ),
+        migrations.RemoveField(
+            model_name='knowledgechunk',
+            name='file',
+        ),
+        migrations.RemoveField(
+            model_name='knowledgebasefile',
+            name='page_hashes',
+        ),
+        migrations.AlterModelOptions(
+            name='knowledgechunk',
+            options={'ordering': ['document', 'page', 'ordinal']},
+        ),
+        migrations.AlterField(
+            model_name='knowledgechunk',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-1 of the chunk text', max_length=40),
+        ),
+        migrations.AddConstraint(
+            model_name='knowledgechunk',
+            constraint=models.UniqueConstraint(fields=('document', 'page', 'ordinal'), name='unique_chunk_position'),
+        ),
+    ]
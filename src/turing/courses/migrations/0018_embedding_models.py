@@ -0,0 +1,38 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0017_chunk_vectors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='embedding_model',
+            field=models.CharField(blank=True, db_column='modelo_embeddings', max_length=100),
+        ),
+        # Los fragmentos existentes se generaron con el modelo fijo hasta ahora
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='embedding_model',
+            field=models.CharField(db_index=True, default='text-embedding-3-small', help_text='Model that produced `vector`', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='ChunkEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('vector', models.BinaryField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='courses.knowledgechunk')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('model', 'chunk'), name='unique_chunk_embedding')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0018_embedding_models'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('documents', models.JSONField(default=list, help_text='Documents whose chunks are in the segment')),
+                ('tombstones', models.JSONField(blank=True, default=list, help_text='Documents deleted from the segment')),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('chunk_ids', models.BinaryField(help_text='int64 chunk id of each row')),
+                ('row_documents', models.BinaryField(help_text='int64 document id of each row')),
+                ('vectors', models.BinaryField(help_text='float32 unit vectors, one row per chunk')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='index_segments', to='courses.course')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['course', 'model'], name='index_segment_course_idx')],
+            },
+        ),
+    ]
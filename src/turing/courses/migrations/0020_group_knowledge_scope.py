@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0019_indexsegment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='knowledge_files',
+            field=models.ManyToManyField(blank=True, related_name='scoped_groups', to='courses.knowledgebasefile', verbose_name='Documentos del grupo'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='scoped_knowledge',
+            field=models.BooleanField(default=False, help_text='Si está activo, el chatbot solo usa los documentos seleccionados para este grupo', verbose_name='Limitar base de conocimiento'),
+        ),
+    ]
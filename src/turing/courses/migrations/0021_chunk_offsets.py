@@ -0,0 +1,86 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:24
+
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_pages(apps, schema_editor):
+    """
+    Rebuilds the text of each page from its chunks, merging the overlap
+    between consecutive chunks, and stores the chunks as offsets into it.
+    """
+    KnowledgeChunk = apps.get_model('courses', 'KnowledgeChunk')
+    KnowledgePage = apps.get_model('courses', 'KnowledgePage')
+    db_alias = schema_editor.connection.alias
+
+    def flush(key, text, chunks):
+        KnowledgePage.objects.using(db_alias).create(
+            document_id=key[0], page=key[1], compressed_text=zlib.compress(text.encode('utf-8'))
+        )
+        KnowledgeChunk.objects.using(db_alias).bulk_update(chunks, ['start', 'end'])
+
+    key, text, chunks = None, '', []
+    rows = (
+        KnowledgeChunk.objects.using(db_alias)
+        .order_by('document_id', 'page', 'ordinal')
+        .only('id', 'document_id', 'page', 'text')
+        .iterator(chunk_size=500)
+    )
+    for chunk in rows:
+        if (chunk.document_id, chunk.page) != key:
+            if chunks:
+                flush(key, text, chunks)
+            key, text, chunks = (chunk.document_id, chunk.page), '', []
+        # Los fragmentos consecutivos se solapan: se reutiliza la parte común
+        overlap = text.find(chunk.text[:50], max(0, len(text) - 400)) if text else -1
+        if overlap != -1 and chunk.text.startswith(text[overlap:]):
+            chunk.start = overlap
+            text += chunk.text[len(text) - overlap:]
+        else:
+            text += ' ' if text else ''
+            chunk.start = len(text)
+            text += chunk.text
+        chunk.end = chunk.start + len(chunk.text)
+        chunks.append(chunk)
+    if chunks:
+        flush(key, text, chunks)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0020_group_knowledge_scope'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='end',
+            field=models.PositiveIntegerField(default=0, help_text='End offset (exclusive) of the chunk text'),
+        ),
+        migrations.AddField(
+            model_name='knowledgechunk',
+            name='start',
+            field=models.PositiveIntegerField(default=0, help_text="Offset of the chunk text in its page's text"),
+        ),
+        migrations.CreateModel(
+            name='KnowledgePage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.PositiveIntegerField(help_text='PDF page number')),
+                ('compressed_text', models.BinaryField(help_text='zlib-compressed cleaned text of the page')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='courses.knowledgedocument')),
+            ],
+            options={
+                'ordering': ['document', 'page'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'page'), name='unique_document_page')],
+            },
+        ),
+        migrations.RunPython(build_pages, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='knowledgechunk',
+            name='text',
+        ),
+    ]
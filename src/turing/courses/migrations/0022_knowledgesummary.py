@@ -0,0 +1,35 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0021_chunk_offsets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(choices=[('section', 'Sección'), ('file', 'Archivo'), ('course', 'Curso')], max_length=10)),
+                ('first_page', models.PositiveIntegerField(default=0)),
+                ('last_page', models.PositiveIntegerField(default=0)),
+                ('text', models.TextField()),
+                ('source_hash', models.CharField(help_text='Hash of the content summarized, to skip unchanged nodes', max_length=40)),
+                ('token_count', models.PositiveIntegerField(default=0)),
+                ('vector', models.BinaryField(blank=True, default=b'', help_text='Embedding as packed float32 values')),
+                ('embedding_model', models.CharField(max_length=100)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='courses.course')),
+                ('document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='courses.knowledgedocument')),
+            ],
+            options={
+                'ordering': ['document', 'level', 'first_page'],
+                'indexes': [models.Index(fields=['document', 'level'], name='kb_summary_document_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:30
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0022_knowledgesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetrievalProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_size', models.PositiveIntegerField(default=1000, help_text='Máximo de caracteres por fragmento', validators=[django.core.validators.MinValueValidator(200), django.core.validators.MaxValueValidator(4000)], verbose_name='Tamaño de fragmento')),
+                ('chunk_overlap', models.PositiveIntegerField(default=200, help_text='Caracteres compartidos entre fragmentos consecutivos', validators=[django.core.validators.MaxValueValidator(1000)], verbose_name='Solapamiento')),
+                ('top_k', models.PositiveIntegerField(default=3, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(20)], verbose_name='Fragmentos por respuesta')),
+                ('score_threshold', models.FloatField(default=0.0, help_text='Los fragmentos con menor similitud coseno se descartan', validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(1.0)], verbose_name='Similitud mínima')),
+                ('engine', models.CharField(choices=[('exact', 'Exacto'), ('ann', 'Aproximado (ANN)'), ('hybrid', 'Híbrido (vectores + palabras clave)')], default='exact', max_length=10, verbose_name='Motor de búsqueda')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Perfil de recuperación',
+                'verbose_name_plural': 'Perfiles de recuperación',
+            },
+        ),
+        migrations.AddField(
+            model_name='knowledgedocument',
+            name='chunk_overlap',
+            field=models.PositiveIntegerField(default=200),
+        ),
+        migrations.AddField(
+            model_name='knowledgedocument',
+            name='chunk_size',
+            field=models.PositiveIntegerField(default=1000),
+        ),
+        migrations.AlterField(
+            model_name='knowledgedocument',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='knowledgedocument',
+            constraint=models.UniqueConstraint(fields=('sha256', 'chunk_size', 'chunk_overlap'), name='unique_document_chunking'),
+        ),
+        migrations.AddField(
+            model_name='retrievalprofile',
+            name='course',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='retrieval_profile', to='courses.course'),
+        ),
+    ]
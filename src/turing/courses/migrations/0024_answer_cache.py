@@ -0,0 +1,51 @@
+# Generated by Django 5.2.2 on 2026-10-19 11:54
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0023_retrieval_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=False, help_text='Responde al instante las preguntas casi iguales a otras ya respondidas en el mismo grupo', verbose_name='Activar caché de respuestas')),
+                ('similarity_threshold', models.FloatField(default=0.95, help_text='Similitud coseno entre preguntas para reutilizar una respuesta', validators=[django.core.validators.MinValueValidator(0.8), django.core.validators.MaxValueValidator(1.0)], verbose_name='Similitud mínima')),
+                ('max_age_hours', models.PositiveIntegerField(default=168, help_text='Las respuestas más antiguas ya no se reutilizan', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(2160)], verbose_name='Vigencia (horas)')),
+                ('lookups', models.PositiveIntegerField(default=0)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='answer_cache', to='courses.course')),
+            ],
+            options={
+                'verbose_name': 'Caché de respuestas',
+                'verbose_name_plural': 'Cachés de respuestas',
+            },
+        ),
+        migrations.CreateModel(
+            name='CachedAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prompt_version', models.CharField(max_length=40)),
+                ('index_version', models.CharField(max_length=40)),
+                ('model', models.CharField(help_text='Embedding model of the question', max_length=100)),
+                ('question', models.TextField()),
+                ('answer', models.TextField(help_text='Markdown of the answer')),
+                ('vector', models.BinaryField(help_text='float32 unit embedding of the question')),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cached_answers', to='courses.course')),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cached_answers', to='courses.group')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['course', 'group', 'prompt_version', 'index_version'], name='cached_answer_key_idx')],
+            },
+        ),
+    ]
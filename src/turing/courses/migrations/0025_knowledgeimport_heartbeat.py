@@ -0,0 +1,24 @@
+# Generated by Django 5.2.2 on 2026-10-19 12:24
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0024_answer_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgeimport',
+            name='archive_path',
+            field=models.CharField(blank=True, help_text='Temporary copy of the zip while the import runs', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='knowledgeimport',
+            name='heartbeat_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.2 on 2026-10-19 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0025_knowledgeimport_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectUploadClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=500, unique=True)),
+                ('claimed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0026_direct_upload_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='knowledge_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
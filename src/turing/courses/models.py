@@ -1,14 +1,17 @@
 # courses/models.py
 import os
 import uuid
+import zlib
 from unidecode import unidecode
+from django.utils import timezone
 from django.utils.text import slugify
 from django.db import models
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
-from django.core.validators import FileExtensionValidator
+from django.core.validators import FileExtensionValidator, MaxValueValidator, MinValueValidator
 import secrets
 import string
+from .storage_cache import storage_cache
 
 User = settings.AUTH_USER_MODEL
 
@@ -30,6 +33,12 @@ class Course(models.Model):
     )
     code     = models.CharField(max_length=12, unique=True, db_index=True, db_column='codigo', blank=True)
     schedule = models.CharField(max_length=60, db_column='horario', blank=True)
+    # Modelo de embeddings con el que se consulta el índice del curso (vacío = settings.EMBEDDING_MODEL).
+    # Durante una reindexación cambia de forma atómica cuando el nuevo índice del curso está completo.
+    embedding_model = models.CharField(max_length=100, db_column='modelo_embeddings', blank=True)
+    # Aumenta cada vez que cambian los documentos consultables del curso o el alcance de un grupo;
+    # las cachés de alcance de todos los procesos usan este número en su clave (ver rag_utils)
+    knowledge_version = models.PositiveIntegerField(default=0, editable=False)
 
     def save(self, *args, **kwargs):
         # genera un código si viene vacío
@@ -59,6 +68,20 @@ class Group(models.Model):
         verbose_name="Prompt de IA del Grupo",
         help_text='Instrucciones personalizadas para el agente de IA de este grupo específico'
     )
+
+    # Alcance de la base de conocimiento: si está activo, el chatbot del grupo
+    # solo busca en los archivos seleccionados (p. ej. las unidades ya vistas)
+    scoped_knowledge = models.BooleanField(
+        default=False,
+        verbose_name="Limitar base de conocimiento",
+        help_text='Si está activo, el chatbot solo usa los documentos seleccionados para este grupo'
+    )
+    knowledge_files = models.ManyToManyField(
+        'KnowledgeBaseFile',
+        blank=True,
+        related_name='scoped_groups',
+        verbose_name="Documentos del grupo"
+    )
     
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Última actualización")
@@ -142,21 +165,384 @@ class CoursePrompt(models.Model):
         return f"Prompt de {self.course.name} (actualizado {self.updated_at:%Y-%m-%d %H:%M})"
     
 
+class RetrievalProfile(models.Model):
+    """Parámetros de recuperación (RAG) de un curso: fragmentación, top-k, umbral y motor de búsqueda."""
+
+    class Engine(models.TextChoices):
+        EXACT = 'exact', 'Exacto'
+        ANN = 'ann', 'Aproximado (ANN)'
+        HYBRID = 'hybrid', 'Híbrido (vectores + palabras clave)'
+
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, related_name='retrieval_profile')
+    chunk_size = models.PositiveIntegerField(
+        "Tamaño de fragmento", default=1000,
+        validators=[MinValueValidator(200), MaxValueValidator(4000)],
+        help_text="Máximo de caracteres por fragmento"
+    )
+    chunk_overlap = models.PositiveIntegerField(
+        "Solapamiento", default=200,
+        validators=[MaxValueValidator(1000)],
+        help_text="Caracteres compartidos entre fragmentos consecutivos"
+    )
+    top_k = models.PositiveIntegerField(
+        "Fragmentos por respuesta", default=3,
+        validators=[MinValueValidator(1), MaxValueValidator(20)]
+    )
+    score_threshold = models.FloatField(
+        "Similitud mínima", default=0.0,
+        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
+        help_text="Los fragmentos con menor similitud coseno se descartan"
+    )
+    engine = models.CharField("Motor de búsqueda", max_length=10, choices=Engine.choices, default=Engine.EXACT)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Perfil de recuperación"
+        verbose_name_plural = "Perfiles de recuperación"
+
+    @property
+    def chunking(self):
+        return {'chunk_size': self.chunk_size, 'chunk_overlap': self.chunk_overlap}
+
+    def __str__(self):
+        return f"Perfil de {self.course.name}"
+
+
+class AnswerCache(models.Model):
+    """
+    Caché semántica de respuestas de un curso (opcional): configuración y métricas.
+    Preguntas casi idénticas de un mismo grupo reciben la respuesta ya generada.
+    """
+    course = models.OneToOneField(Course, on_delete=models.CASCADE, related_name='answer_cache')
+    enabled = models.BooleanField(
+        "Activar caché de respuestas", default=False,
+        help_text="Responde al instante las preguntas casi iguales a otras ya respondidas en el mismo grupo"
+    )
+    similarity_threshold = models.FloatField(
+        "Similitud mínima", default=0.95,
+        validators=[MinValueValidator(0.8), MaxValueValidator(1.0)],
+        help_text="Similitud coseno entre preguntas para reutilizar una respuesta"
+    )
+    max_age_hours = models.PositiveIntegerField(
+        "Vigencia (horas)", default=168,
+        validators=[MinValueValidator(1), MaxValueValidator(24 * 90)],
+        help_text="Las respuestas más antiguas ya no se reutilizan"
+    )
+    lookups = models.PositiveIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Caché de respuestas"
+        verbose_name_plural = "Cachés de respuestas"
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def __str__(self):
+        return f"Caché de respuestas de {self.course.name}"
+
+
+class CachedAnswer(models.Model):
+    """
+    Answer of the chatbot reusable for similar questions. Only matched with
+    the same group, the same compiled system prompt and the same set of
+    searchable documents (`prompt_version`, `index_version`) it was answered with.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='cached_answers')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True, related_name='cached_answers')
+    prompt_version = models.CharField(max_length=40)
+    index_version = models.CharField(max_length=40)
+    model = models.CharField(max_length=100, help_text="Embedding model of the question")
+    question = models.TextField()
+    answer = models.TextField(help_text="Markdown of the answer")
+    vector = models.BinaryField(help_text="float32 unit embedding of the question")
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'group', 'prompt_version', 'index_version'], name='cached_answer_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.question[:50]} ({self.course})"
+
+
+class KnowledgeDocument(models.Model):
+    """
+    Processed content of a PDF (page hashes and chunks), identified by the SHA-256
+    of the file and the chunking parameters. Every upload of the same file, in any
+    course with the same chunking, references the same document, so identical
+    PDFs are only extracted and embedded once.
+    """
+    sha256 = models.CharField(max_length=64, null=True, blank=True)
+    chunk_size = models.PositiveIntegerField(default=1000)
+    chunk_overlap = models.PositiveIntegerField(default=200)
+    page_hashes = models.JSONField(default=list, blank=True, help_text="Content hash of each cleaned page")
+    chunks_count = models.PositiveIntegerField(default=0)
+    text_length = models.PositiveIntegerField(default=0)
+    processed = models.BooleanField(default=False, help_text="Whether every page has been chunked and embedded")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sha256', 'chunk_size', 'chunk_overlap'], name='unique_document_chunking'),
+        ]
+
+    def delete_if_unused(self):
+        """Borra el documento (y sus fragmentos) si ningún archivo lo referencia."""
+        if not self.files.exists():
+            self.delete()
+
+    def __str__(self):
+        return self.sha256 or f"Documento {self.pk}"
+
+
 class KnowledgeBaseFile(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='knowledge_files')
     file = models.FileField(upload_to='knowledge_base/', max_length=500)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=255, blank=True)
-    extracted_text = models.TextField(blank=True, help_text="Text extracted from PDF")
-    text_chunks = models.JSONField(default=list, blank=True, help_text="Text chunks for RAG")
-    embeddings = models.JSONField(default=list, blank=True, help_text="Vector embeddings for chunks")
     processed = models.BooleanField(default=False, help_text="Whether the file has been processed for RAG")
     processing_error = models.TextField(blank=True, help_text="Error message if processing failed")
+    chunks_count = models.PositiveIntegerField(default=0, help_text="Number of chunks persisted for RAG")
+    text_length = models.PositiveIntegerField(default=0, help_text="Length of the cleaned text processed so far")
+    document = models.ForeignKey(
+        KnowledgeDocument,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='files',
+        help_text="Processed content shared with identical uploads"
+    )
+
+    class Meta:
+        indexes = [
+            # Retrieval looks up the processed documents of a course through this index
+            models.Index(fields=['course', 'processed'], name='kb_file_course_processed_idx'),
+        ]
+
+    def release_file(self, name=None):
+        """
+        Borra el PDF del almacenamiento si ningún otro archivo usa el mismo objeto.
+        `name` es una versión anterior del archivo (por defecto, el PDF actual).
+        """
+        if name is None:
+            if self.file and not KnowledgeBaseFile.objects.filter(file=self.file.name).exclude(pk=self.pk).exists():
+                storage_cache.discard(self.file.name)
+                self.file.delete(save=False)
+        elif name != self.file.name and not KnowledgeBaseFile.objects.filter(file=name).exists():
+            storage_cache.discard(name)
+            self.file.storage.delete(name)
 
     def __str__(self):
         return self.name or self.file.name
+
+
+class KnowledgePage(models.Model):
+    """
+    Cleaned text of one page of a knowledge document, zlib-compressed.
+
+    Chunks overlap, so the page is stored once and each chunk only keeps the
+    offsets of its text inside it.
+    """
+    document = models.ForeignKey(KnowledgeDocument, on_delete=models.CASCADE, related_name='pages')
+    page = models.PositiveIntegerField(help_text="PDF page number")
+    compressed_text = models.BinaryField(help_text="zlib-compressed cleaned text of the page")
+
+    class Meta:
+        ordering = ['document', 'page']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page'], name='unique_document_page'),
+        ]
+
+    @staticmethod
+    def compress(text: str) -> bytes:
+        return zlib.compress(text.encode('utf-8'))
+
+    @property
+    def text(self) -> str:
+        return zlib.decompress(bytes(self.compressed_text)).decode('utf-8')
+
+    def __str__(self):
+        return f"{self.document} p{self.page}"
+
+
+class KnowledgeChunk(models.Model):
+    """A single text chunk of a knowledge document together with its embedding."""
+    document = models.ForeignKey(KnowledgeDocument, on_delete=models.CASCADE, related_name='chunks')
+    page = models.PositiveIntegerField(default=0, help_text="PDF page the chunk was taken from")
+    ordinal = models.PositiveIntegerField(help_text="Position of the chunk inside its page")
+    content_hash = models.CharField(max_length=40, blank=True, db_index=True, help_text="SHA-1 of the chunk text")
+    start = models.PositiveIntegerField(default=0, help_text="Offset of the chunk text in its page's text")
+    end = models.PositiveIntegerField(default=0, help_text="End offset (exclusive) of the chunk text")
+    token_count = models.PositiveIntegerField(default=0, help_text="Estimated number of tokens of the text")
+    vector = models.BinaryField(default=b'', blank=True, help_text="Embedding as packed float32 values")
+    embedding_model = models.CharField(max_length=100, db_index=True, help_text="Model that produced `vector`")
+
+    class Meta:
+        ordering = ['document', 'page', 'ordinal']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page', 'ordinal'], name='unique_chunk_position'),
+        ]
+
+    def __str__(self):
+        return f"{self.document} p{self.page} #{self.ordinal}"
+
+
+class ChunkEmbedding(models.Model):
+    """
+    Vector of a chunk for an embedding model other than the chunk's own.
+
+    Written by the reindex command while migrating to a new model, so courses
+    still on the old model keep reading `KnowledgeChunk.vector` meanwhile.
+    """
+    chunk = models.ForeignKey(KnowledgeChunk, on_delete=models.CASCADE, related_name='embeddings')
+    model = models.CharField(max_length=100)
+    vector = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'chunk'], name='unique_chunk_embedding'),
+        ]
+
+    def __str__(self):
+        return f"{self.chunk} ({self.model})"
+
+
+class IndexSegment(models.Model):
+    """
+    Sealed, append-only piece of a course's vector index.
+
+    Holds the normalized vectors of one or more documents for one embedding
+    model as a packed matrix. Segments are never modified except for their
+    tombstones: documents removed from the course (or reprocessed) are listed
+    there and ignored until a merge rewrites the segment without them.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='index_segments')
+    model = models.CharField(max_length=100)
+    documents = models.JSONField(default=list, help_text="Documents whose chunks are in the segment")
+    tombstones = models.JSONField(default=list, blank=True, help_text="Documents deleted from the segment")
+    rows = models.PositiveIntegerField(default=0)
+    chunk_ids = models.BinaryField(help_text="int64 chunk id of each row")
+    row_documents = models.BinaryField(help_text="int64 document id of each row")
+    vectors = models.BinaryField(help_text="float32 unit vectors, one row per chunk")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'model'], name='index_segment_course_idx'),
+        ]
+
+    def __str__(self):
+        return f"Segmento {self.pk} de {self.course} ({self.rows} filas)"
+
+
+class KnowledgeSummary(models.Model):
+    """
+    Node of the summary tree of the knowledge base, built offline after ingestion.
+
+    Sections summarize a few consecutive pages of a document, the file node
+    summarizes its sections and the course node summarizes the files of a
+    course. Broad questions are answered from one of these nodes instead of
+    several leaf chunks.
+    """
+    class Level(models.TextChoices):
+        SECTION = 'section', 'Sección'
+        FILE = 'file', 'Archivo'
+        COURSE = 'course', 'Curso'
+
+    level = models.CharField(max_length=10, choices=Level.choices)
+    document = models.ForeignKey(KnowledgeDocument, on_delete=models.CASCADE, null=True, blank=True, related_name='summaries')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, null=True, blank=True, related_name='summaries')
+    first_page = models.PositiveIntegerField(default=0)
+    last_page = models.PositiveIntegerField(default=0)
+    text = models.TextField()
+    source_hash = models.CharField(max_length=40, help_text="Hash of the content summarized, to skip unchanged nodes")
+    token_count = models.PositiveIntegerField(default=0)
+    vector = models.BinaryField(default=b'', blank=True, help_text="Embedding as packed float32 values")
+    embedding_model = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['document', 'level', 'first_page']
+        indexes = [
+            models.Index(fields=['document', 'level'], name='kb_summary_document_idx'),
+        ]
+
+    def __str__(self):
+        owner = self.document if self.document_id else self.course
+        return f"{self.get_level_display()} de {owner} (p{self.first_page}-{self.last_page})"
+
+
+class KnowledgeImport(models.Model):
+    """Carga masiva de PDFs a la base de conocimiento desde un archivo zip."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pendiente')
+        RUNNING = 'running', _('En proceso')
+        DONE = 'done', _('Terminado')
+        FAILED = 'failed', _('Fallido')
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='knowledge_imports')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    archive_name = models.CharField(max_length=255)
+    archive_path = models.CharField(max_length=500, blank=True, help_text="Temporary copy of the zip while the import runs")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Última señal de avance; si se detiene (p. ej. reinicio del proceso) la importación se da por fallida
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.archive_name} ({self.get_status_display()})"
+
+
+class KnowledgeImportItem(models.Model):
+    """Un PDF dentro de una carga masiva, con su propio estado de avance."""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pendiente')
+        PROCESSING = 'processing', _('Procesando')
+        DONE = 'done', _('Terminado')
+        FAILED = 'failed', _('Fallido')
+
+    job = models.ForeignKey(KnowledgeImport, on_delete=models.CASCADE, related_name='items')
+    member = models.CharField(max_length=500, help_text="Path of the PDF inside the archive")
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    pages_done = models.PositiveIntegerField(default=0)
+    chunks_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    knowledge_file = models.ForeignKey(KnowledgeBaseFile, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        ordering = ['job', 'id']
+
+    def __str__(self):
+        return self.member
     
 
+class DirectUploadClaim(models.Model):
+    """
+    Objeto del bucket ya registrado mediante una subida directa.
+    La restricción única hace que cada token de subida se use una sola vez,
+    aunque las finalizaciones lleguen a procesos distintos.
+    """
+    name = models.CharField(max_length=500, unique=True)
+    claimed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
 def sanitized_upload_to(instance, filename):
     """
     Renombra el archivo subido a un formato seguro y único.
@@ -1,27 +1,44 @@
 # courses/rag_utils.py
-import os
 import re
 import json
-from typing import List, Dict, Any, Tuple
+import heapq
+import itertools
+import hashlib
+import zlib
+import logging
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 from django.conf import settings
-from openai import OpenAI
+from django.core.cache import cache
+from django.db import transaction
 import PyPDF2
 import numpy as np
-from .models import KnowledgeBaseFile
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from django.db.models import F, Q
+from .models import ChunkEmbedding, Course, Group, KnowledgeBaseFile, KnowledgeChunk, KnowledgeDocument, KnowledgePage, KnowledgeSummary, RetrievalProfile
+from .embedding_client import embedding_client
+from .storage_cache import storage_cache
+from .segments import course_index
+from .summaries import summary_builder
 
+logger = logging.getLogger(__name__)
 
 class RAGProcessor:
     """Handles PDF text extraction, chunking, and retrieval-augmented generation."""
     
     def __init__(self):
+        # Defaults for courses without a RetrievalProfile
         self.chunk_size = 1000  # Maximum characters per chunk
         self.chunk_overlap = 200  # Characters to overlap between chunks
         self.max_chunks_for_context = 3  # Maximum chunks to include in context
+        self.hybrid_weight = 0.3  # Weight of the keyword overlap in hybrid search
+        self.hybrid_candidates = 4  # Hybrid search reranks this many times top-k vector hits
+        self.embedding_batch_size = 100  # Chunks sent per embedding request
+        self.embedding_client = embedding_client
+        self.boundary_window = 32  # Characters hashed to decide a content-defined boundary
+        self.boundary_divisor = 4  # On average one sentence end in N becomes a boundary
         
-    def extract_text_from_pdf(self, pdf_file) -> str:
-        """Extract text content from a PDF file."""
+    def iter_pdf_pages(self, pdf_file) -> Iterator[str]:
+        """Yield the text of each PDF page, one page at a time."""
         if not PyPDF2:
             raise ImportError("PyPDF2 is required for PDF processing")
             
@@ -30,14 +47,14 @@ class RAGProcessor:
             pdf_file.seek(0)  # Make sure we're at the beginning of the file
             reader = PyPDF2.PdfReader(pdf_file)
             
-            text = ""
             for page in reader.pages:
-                page_text = page.extract_text()
-                text += page_text + "\n"
-            
-            return text.strip()
+                yield page.extract_text() or ""
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
+
+    def extract_text_from_pdf(self, pdf_file) -> str:
+        """Extract text content from a PDF file."""
+        return "\n".join(self.iter_pdf_pages(pdf_file)).strip()
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize extracted text."""
@@ -47,166 +64,756 @@ class RAGProcessor:
         text = re.sub(r'[^\w\s\.\,\!\?\;\:\-\(\)]', ' ', text)
         return text.strip()
     
-    def chunk_text(self, text: str) -> List[str]:
+    def chunk_text(self, text: str, chunk_size: int = None, chunk_overlap: int = None) -> List[str]:
         """Split text into overlapping chunks for better retrieval."""
-        if not text:
-            return []
-            
-        chunks = []
-        start = 0
-        text_length = len(text)
+        return list(self.iter_chunks(text, chunk_size, chunk_overlap))
+
+    def _chunk_end(self, text: str, start: int, chunk_size: int) -> int:
+        """
+        Return where the chunk starting at `start` should end.
+
+        Boundaries are content-defined: the first sentence end past half the
+        chunk size whose preceding characters hash to a boundary marker. As the
+        decision only depends on nearby text, an edit moves the boundaries around
+        it but the following chunks come out identical to before.
+        """
+        end = start + chunk_size
+        if end >= len(text):
+            return len(text)
         
-        while start < text_length:
-            # Find the end of this chunk
-            end = start + self.chunk_size
-            
-            # If we're not at the end of the text, try to break at a sentence
-            if end < text_length:
-                # Look for sentence endings within the last 200 characters
-                look_back = min(200, self.chunk_size // 5)
-                sentence_end = text.rfind('.', end - look_back, end)
-                if sentence_end != -1:
-                    end = sentence_end + 1
-            
-            chunk = text[start:end].strip()
-            if chunk:  # Only add non-empty chunks
-                chunks.append(chunk)
-            
+        sentence_end = text.find('.', start + chunk_size // 2, end)
+        while sentence_end != -1:
+            window = text[max(0, sentence_end - self.boundary_window):sentence_end + 1]
+            if zlib.crc32(window.encode('utf-8')) % self.boundary_divisor == 0:
+                return sentence_end + 1
+            sentence_end = text.find('.', sentence_end + 1, end)
+        
+        # No marker found: try to break at the last sentence in the last 200 characters
+        look_back = min(200, chunk_size // 5)
+        sentence_end = text.rfind('.', end - look_back, end)
+        if sentence_end != -1:
+            end = sentence_end + 1
+        return end
+
+    def iter_chunk_spans(self, text: str, chunk_size: int = None, chunk_overlap: int = None) -> Iterator[Tuple[int, int]]:
+        """Yield the (start, end) offsets of overlapping chunks of `text`, without surrounding whitespace."""
+        chunk_size = chunk_size or self.chunk_size
+        chunk_overlap = self.chunk_overlap if chunk_overlap is None else chunk_overlap
+        start = 0
+        while start < len(text):
+            end = self._chunk_end(text, start, chunk_size)
+            chunk_start, chunk_end = start, end
+            while chunk_start < chunk_end and text[chunk_start].isspace():
+                chunk_start += 1
+            while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+                chunk_end -= 1
+            if chunk_start < chunk_end:  # Only add non-empty chunks
+                yield chunk_start, chunk_end
+            if end >= len(text):
+                break
             # Move to next chunk with overlap
-            start = max(start + 1, end - self.chunk_overlap)
-            
-        return chunks
+            start = max(start + 1, end - chunk_overlap)
+
+    def iter_chunks(self, text: str, chunk_size: int = None, chunk_overlap: int = None) -> Iterator[str]:
+        """Yield overlapping chunks of `text` with content-defined boundaries."""
+        for start, end in self.iter_chunk_spans(text, chunk_size, chunk_overlap):
+            yield text[start:end]
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """Stable hash used to recognise pages and chunks that did not change."""
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def pack_vector(embedding) -> bytes:
+        """Pack an embedding as float32 bytes for KnowledgeChunk.vector."""
+        return np.asarray(embedding, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def unpack_vector(data) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.float32)
     
-    def get_embeddings_openai(self, texts: List[str]) -> List[List[float]]:
+    def get_embeddings_openai(self, texts: List[str], model: str = None) -> List[List[float]]:
         """Get embeddings using OpenAI's embedding model."""
-        try:
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            embeddings = []
-            
-            # Process texts in batches to avoid rate limits
-            batch_size = 100
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                response = client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=batch
+        embeddings = []
+        for i in range(0, len(texts), self.embedding_batch_size):
+            embeddings.extend(self.embedding_client.embed(texts[i:i + self.embedding_batch_size], model=model))
+        return embeddings
+    
+    def _store_pages(self, document, pages) -> Dict[str, Any]:
+        """
+        Replace the text and chunks of the given changed pages in a single transaction.
+
+        The page text is stored once, compressed, and chunks only keep their
+        offsets into it. Vectors of chunks whose content hash is already stored (in this or any
+        other document) are copied; the remaining chunks are embedded in
+        concurrent batches. Pages with a chunk in a batch that failed are left as
+        they were (and keep their old page hash) so the next run picks them up again.
+        """
+        hashes = {chunk_hash for _, _, _, chunks in pages for _, _, chunk_hash in chunks}
+        model = self.embedding_client.model
+        vectors = dict(
+            KnowledgeChunk.objects
+            .filter(content_hash__in=hashes, embedding_model=model)
+            .values_list('content_hash', 'vector')
+        )
+        reused = sum(1 for _, _, _, chunks in pages for _, _, chunk_hash in chunks if chunk_hash in vectors)
+        
+        missing = {}
+        for _, _, text, chunks in pages:
+            for start, end, chunk_hash in chunks:
+                if chunk_hash not in vectors:
+                    missing.setdefault(chunk_hash, text[start:end])
+        
+        items = list(missing.items())
+        batches = [items[i:i + self.embedding_batch_size] for i in range(0, len(items), self.embedding_batch_size)]
+        results, errors = self.embedding_client.embed_batches([[text for _, text in batch] for batch in batches])
+        embedded = 0
+        for batch, embeddings in zip(batches, results):
+            if embeddings is not None:
+                vectors.update(zip((chunk_hash for chunk_hash, _ in batch), map(self.pack_vector, embeddings)))
+                embedded += len(batch)
+        
+        complete = [
+            (page, page_hash, text, chunks) for page, page_hash, text, chunks in pages
+            if all(chunk_hash in vectors for _, _, chunk_hash in chunks)
+        ]
+        
+        with transaction.atomic():
+            changed = [page for page, _, _, _ in complete]
+            KnowledgeChunk.objects.filter(document=document, page__in=changed).delete()
+            KnowledgePage.objects.filter(document=document, page__in=changed).delete()
+            KnowledgePage.objects.bulk_create([
+                KnowledgePage(document=document, page=page, compressed_text=KnowledgePage.compress(text))
+                for page, _, text, chunks in complete
+                if chunks
+            ])
+            KnowledgeChunk.objects.bulk_create([
+                KnowledgeChunk(
+                    document=document,
+                    page=page,
+                    ordinal=ordinal,
+                    content_hash=chunk_hash,
+                    start=start,
+                    end=end,
+                    token_count=self.embedding_client.estimate_tokens([text[start:end]]),
+                    vector=vectors[chunk_hash],
+                    embedding_model=model,
                 )
-                batch_embeddings = [item.embedding for item in response.data]
-                embeddings.extend(batch_embeddings)
+                for page, _, text, chunks in complete
+                for ordinal, (start, end, chunk_hash) in enumerate(chunks)
+            ])
+            page_hashes = list(document.page_hashes or [])
+            for page, page_hash, _, _ in complete:
+                page_hashes.extend([''] * (page + 1 - len(page_hashes)))
+                page_hashes[page] = page_hash
+            document.page_hashes = page_hashes
+            document.save(update_fields=['page_hashes'])
+        
+        return {
+            'chunks_reused': reused,
+            'chunks_embedded': embedded,
+            'batches_total': len(batches),
+            'batches_failed': len(errors),
+            'errors': list(errors.values()),
+        }
+
+    def _process_document(self, document, pdf_file, progress=None) -> Tuple[Dict[str, Any], List[Exception]]:
+        """
+        Extract, chunk and embed `pdf_file` into `document`, with the
+        document's chunking parameters.
+
+        Pages are streamed and hashed one at a time. A page whose hash matches the
+        previous run keeps its chunks and vectors untouched; changed pages are
+        re-chunked and committed in small groups together with their hashes, so
+        memory stays bounded and an interrupted run resumes where it stopped.
+        `progress`, if given, is called with the number of pages read so far.
+        """
+        report = {
+            'pages_total': 0,
+            'pages_skipped': 0,
+            'chunks_reused': 0,
+            'chunks_embedded': 0,
+            'batches_total': 0,
+            'batches_failed': 0,
+        }
+        errors = []
+        old_hashes = list(document.page_hashes or [])
+        pages_total = 0
+        text_length = 0
+        pending = []  # [(page, page_hash, text, [(start, end, chunk_hash), ...]), ...]
+        pending_chunks = 0
+        # Enough chunks to keep every concurrent embedding request busy
+        flush_size = self.embedding_batch_size * self.embedding_client.concurrency
+        
+        def flush():
+            stored = self._store_pages(document, pending)
+            errors.extend(stored.pop('errors'))
+            for key, value in stored.items():
+                report[key] += value
+        
+        for page, page_text in enumerate(self.iter_pdf_pages(pdf_file)):
+            cleaned = self.clean_text(page_text)
+            page_hash = self.content_hash(cleaned)
+            text_length += len(cleaned)
+            pages_total += 1
+            if progress:
+                progress(pages_total)
+            
+            if page < len(old_hashes) and old_hashes[page] == page_hash:
+                report['pages_skipped'] += 1
+                continue
             
-            return embeddings
+            chunks = [
+                (start, end, self.content_hash(cleaned[start:end]))
+                for start, end in self.iter_chunk_spans(cleaned, document.chunk_size, document.chunk_overlap)
+            ]
+            pending.append((page, page_hash, cleaned, chunks))
+            pending_chunks += len(chunks)
+            
+            if pending_chunks >= flush_size:
+                flush()
+                pending, pending_chunks = [], 0
+        
+        if pending:
+            flush()
+        report['pages_total'] = pages_total
+        
+        with transaction.atomic():
+            # The new version may have fewer pages than the previous one
+            document.chunks.filter(page__gte=pages_total).delete()
+            document.pages.filter(page__gte=pages_total).delete()
+            document.page_hashes = document.page_hashes[:pages_total]
+            document.chunks_count = document.chunks.count()
+            document.text_length = text_length
+            document.processed = not errors and document.chunks_count > 0
+            document.save(update_fields=['page_hashes', 'chunks_count', 'text_length', 'processed'])
+        
+        return report, errors
+
+    def file_sha256(self, file) -> str:
+        """SHA-256 of an uploaded or stored file, read in chunks."""
+        digest = hashlib.sha256()
+        file.seek(0)
+        for block in file.chunks():
+            digest.update(block)
+        file.seek(0)
+        return digest.hexdigest()
+
+    def attach_document(self, knowledge_file, document):
+        """Point `knowledge_file` at `document` and drop its previous document if unused."""
+        previous = knowledge_file.document
+        knowledge_file.document = document
+        knowledge_file.chunks_count = document.chunks_count
+        knowledge_file.text_length = document.text_length
+        knowledge_file.processed = document.processed
+        if knowledge_file.pk:
+            knowledge_file.save(update_fields=['document', 'chunks_count', 'text_length', 'processed'])
+        if previous and previous.pk != document.pk:
+            if not KnowledgeBaseFile.objects.filter(course_id=knowledge_file.course_id, document=previous).exists():
+                course_index.remove_document(knowledge_file.course_id, previous.pk)
+            previous.delete_if_unused()
+
+    def publish(self, knowledge_file) -> None:
+        """Seal the file's current chunks into its course's index."""
+        if not (knowledge_file.processed and knowledge_file.document_id):
+            return
+        try:
+            course_index.add_document(
+                knowledge_file.course_id,
+                knowledge_file.document_id,
+                self.course_embedding_model(knowledge_file.course_id)
+            )
+        except Exception:
+            # Retrieval falls back to scanning the chunk rows of unsealed documents
+            logger.exception("Could not seal document %s into the index", knowledge_file.document_id)
+        summary_builder.schedule(knowledge_file.course_id)
+
+    def unpublish(self, knowledge_file) -> None:
+        """Remove the file's document from its course's index, unless another file of the course uses it."""
+        if knowledge_file.document_id and not KnowledgeBaseFile.objects.filter(
+            course_id=knowledge_file.course_id, document_id=knowledge_file.document_id
+        ).exclude(pk=knowledge_file.pk).exists():
+            course_index.remove_document(knowledge_file.course_id, knowledge_file.document_id)
+
+    def rechunk_course(self, course_id: int) -> Dict[str, int]:
+        """
+        Reprocess every file of the course with its current chunking parameters.
+
+        Run in the background after a teacher changes them. Each file keeps
+        serving its previous chunks until its new document is ready; files
+        whose PDF another course already chunked the same way are only
+        re-pointed at that document.
+        """
+        counts = {'files': 0, 'failed': 0}
+        chunking = self.profile_for(course_id).chunking
+        files = KnowledgeBaseFile.objects.filter(course_id=course_id).exclude(file='').select_related('document')
+        for knowledge_file in files:
+            document = knowledge_file.document
+            if document and document.processed and all(
+                    getattr(document, key) == value for key, value in chunking.items()):
+                continue
+            result = self.process_pdf_file(knowledge_file)
+            counts['files'] += 1
+            counts['failed'] += not result.get('success')
+        logger.info("Course %s rechunked: %s", course_id, counts)
+        return counts
+
+    def profile_for(self, course_id: int) -> RetrievalProfile:
+        """Retrieval profile of the course, or the defaults if it has none."""
+        profile = RetrievalProfile.objects.filter(course_id=course_id).first()
+        return profile or RetrievalProfile(
+            course_id=course_id,
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            top_k=self.max_chunks_for_context,
+        )
+
+    def _document_for(self, knowledge_file, sha256, chunking):
+        """Return the document that should hold the content with the given hash and chunking."""
+        current = knowledge_file.document
+        same_chunking = current is not None and (
+            current.chunk_size == chunking['chunk_size'] and current.chunk_overlap == chunking['chunk_overlap']
+        )
+        if same_chunking and current.sha256 == sha256:
+            return current
+        
+        existing = KnowledgeDocument.objects.filter(sha256=sha256, **chunking).first()
+        if existing:
+            return existing
+        
+        if same_chunking and not current.files.exclude(pk=knowledge_file.pk).exists():
+            # Only this upload uses the previous version: update it in place so
+            # unchanged pages keep their chunks
+            current.sha256 = sha256
+            current.processed = False
+            current.save(update_fields=['sha256', 'processed'])
+            return current
+        
+        document, _ = KnowledgeDocument.objects.get_or_create(sha256=sha256, **chunking)
+        return document
+
+    def process_pdf_file(self, knowledge_file, source=None, sha256=None, progress=None) -> Dict[str, Any]:
+        """
+        Process a KnowledgeBaseFile: extract text, chunk it, and create embeddings.
+
+        The file is identified by its SHA-256. If the same PDF was already
+        processed for any course, its document is referenced and nothing is
+        extracted or embedded; otherwise the document is (re)processed
+        incrementally, page by page.
+
+        `source` is a local copy of the PDF (e.g. the upload's temporary file)
+        and `sha256` its hash when already known. Without a source the stored
+        file is read through the local storage cache. `progress` receives the
+        number of pages read so far.
+        """
+        if source is not None:
+            return self._process_pdf_file(knowledge_file, source, sha256, progress)
+        try:
+            cached = storage_cache.open(knowledge_file.file)
         except Exception as e:
-            # Fallback to TF-IDF if OpenAI fails
-            return self.get_embeddings_tfidf(texts)
-    
-    def get_embeddings_tfidf(self, texts: List[str]) -> List[List[float]]:
-        """Fallback embedding method using TF-IDF."""
-        if not TfidfVectorizer:
-            raise ImportError("scikit-learn is required for TF-IDF embeddings")
-            
-        vectorizer = TfidfVectorizer(max_features=384, stop_words='english')
-        tfidf_matrix = vectorizer.fit_transform(texts)
-        return tfidf_matrix.toarray().tolist()
-    
-    def process_pdf_file(self, knowledge_file) -> Dict[str, Any]:
-        """Process a KnowledgeBaseFile: extract text, chunk it, and create embeddings."""
+            return self._processing_failed(knowledge_file, e, {})
+        with cached:
+            return self._process_pdf_file(knowledge_file, cached, sha256, progress)
+
+    def _processing_failed(self, knowledge_file, error, report) -> Dict[str, Any]:
+        # Save error information
+        knowledge_file.processing_error = str(error)
+        knowledge_file.processed = False
+        knowledge_file.save(update_fields=['processing_error', 'processed'])
+        
+        return {
+            'success': False,
+            'error': str(error),
+            **report,
+        }
+
+    def _process_pdf_file(self, knowledge_file, source, sha256, progress=None) -> Dict[str, Any]:
+        report = {
+            'pages_total': 0,
+            'pages_skipped': 0,
+            'chunks_reused': 0,
+            'chunks_embedded': 0,
+            'batches_total': 0,
+            'batches_failed': 0,
+            'deduplicated': False,
+        }
         try:
-            # Extract text from PDF
-            extracted_text = self.extract_text_from_pdf(knowledge_file.file)
+            knowledge_file.processing_error = ""
+            knowledge_file.save(update_fields=['processing_error'])
             
-            cleaned_text = self.clean_text(extracted_text)
+            document = self._document_for(
+                knowledge_file,
+                sha256 or self.file_sha256(source),
+                self.profile_for(knowledge_file.course_id).chunking
+            )
             
-            # Create chunks
-            chunks = self.chunk_text(cleaned_text)
+            if document.processed and document.pk != knowledge_file.document_id:
+                # Identical PDF already processed elsewhere: just reference it
+                self.attach_document(knowledge_file, document)
+                self.publish(knowledge_file)
+                report.update(
+                    deduplicated=True,
+                    pages_total=len(document.page_hashes),
+                    pages_skipped=len(document.page_hashes),
+                    chunks_reused=document.chunks_count,
+                )
+                return {
+                    'success': True,
+                    'chunks_count': document.chunks_count,
+                    'text_length': document.text_length,
+                    **report,
+                }
             
-            if not chunks:
+            if not (knowledge_file.processed and knowledge_file.document_id):
+                self.attach_document(knowledge_file, document)
+            # Otherwise the file keeps serving its current document until the new one is ready
+            document_report, errors = self._process_document(document, source, progress)
+            report.update(document_report)
+            self.attach_document(knowledge_file, document)
+            
+            if errors:
+                # What was embedded stays searchable; reprocessing retries the rest
+                error = f"{report['batches_failed']} de {report['batches_total']} lotes de embeddings fallaron: {errors[0]}"
+                knowledge_file.processed = document.chunks_count > 0
+                knowledge_file.processing_error = error
+                knowledge_file.save(update_fields=['processed', 'processing_error'])
+                self.publish(knowledge_file)
                 return {
                     'success': False,
-                    'error': 'No text could be extracted from the PDF'
+                    'error': error,
+                    **report,
                 }
             
-            # Get embeddings
-            embeddings = self.get_embeddings_openai(chunks)
-            
-            # Update the knowledge file
-            knowledge_file.extracted_text = cleaned_text
-            knowledge_file.text_chunks = chunks
-            knowledge_file.embeddings = embeddings
-            knowledge_file.processed = True
-            knowledge_file.processing_error = ""
-            knowledge_file.save()
+            if not document.chunks_count:
+                knowledge_file.processing_error = 'No text could be extracted from the PDF'
+                knowledge_file.save(update_fields=['processing_error'])
+                return {
+                    'success': False,
+                    'error': 'No text could be extracted from the PDF',
+                    **report,
+                }
             
+            self.publish(knowledge_file)
             return {
                 'success': True,
-                'chunks_count': len(chunks),
-                'text_length': len(cleaned_text)
+                'chunks_count': document.chunks_count,
+                'text_length': document.text_length,
+                **report,
             }
             
         except Exception as e:
-            # Save error information
-            knowledge_file.processing_error = str(e)
-            knowledge_file.processed = False
-            knowledge_file.save()
-            
-            return {
-                'success': False,
-                'error': str(e)
-            }
+            return self._processing_failed(knowledge_file, e, report)
     
-    def find_relevant_chunks(self, query: str, course_id: int, limit: int = None) -> List[Tuple[str, float]]:
-        """Find the most relevant text chunks for a given query."""
+    def chunk_texts(self, chunk_ids) -> Dict[int, str]:
+        """
+        Text of the given chunks, sliced from their compressed pages.
+
+        Each page is read and decompressed once however many of its chunks are
+        requested. Chunks that no longer exist are left out.
+        """
+        rows = list(
+            KnowledgeChunk.objects
+            .filter(id__in=list(chunk_ids))
+            .values_list('id', 'document_id', 'page', 'start', 'end')
+        )
+        if not rows:
+            return {}
         
-        if limit is None:
-            limit = self.max_chunks_for_context
-            
-        try:
-            # Get all processed files for the course
-            knowledge_files = KnowledgeBaseFile.objects.filter(
+        pages_by_document = {}
+        for _, document_id, page, _, _ in rows:
+            pages_by_document.setdefault(document_id, set()).add(page)
+        condition = Q()
+        for document_id, pages in pages_by_document.items():
+            condition |= Q(document_id=document_id, page__in=pages)
+        texts = {
+            (page.document_id, page.page): page.text
+            for page in KnowledgePage.objects.filter(condition)
+        }
+        return {
+            chunk_id: texts[(document_id, page)][start:end]
+            for chunk_id, document_id, page, start, end in rows
+            if (document_id, page) in texts
+        }
+
+    def course_embedding_model(self, course_id: int) -> str:
+        """Embedding model the course's index is queried with."""
+        model = Course.objects.filter(pk=course_id).values_list('embedding_model', flat=True).first()
+        return model or self.embedding_client.model
+
+    def knowledge_version(self, course_id: int) -> int:
+        """The course's knowledge version, which every cached scope is keyed on."""
+        return Course.objects.filter(pk=course_id).values_list('knowledge_version', flat=True).first() or 0
+
+    @staticmethod
+    def scope_key(course_id: int, group_id: Optional[int], version: int) -> str:
+        return f"knowledge-scope:{course_id}:{group_id or 0}:{version}"
+
+    def _scope(self, course_id: int, group=None) -> Tuple[frozenset, str]:
+        """
+        The documents the chatbot may search for the course (or the group's
+        scope) and their version, read with one query and cached under the
+        course's knowledge version. The signals bump that version in the
+        database, so every process stops using its cached scopes at once.
+        """
+        group_id = group.pk if group is not None and group.scoped_knowledge else None
+        version = getattr(group, 'knowledge_version', None)
+        if version is None:
+            version = self.knowledge_version(course_id)
+        key = self.scope_key(course_id, group_id, version)
+        scope = cache.get(key)
+        if scope is None:
+            files = KnowledgeBaseFile.objects.filter(
                 course_id=course_id,
                 processed=True,
-                text_chunks__len__gt=0
+                document__isnull=False
+            )
+            if group_id:
+                files = files.filter(scoped_groups=group_id)
+            documents = sorted(set(files.values_list('document_id', 'document__sha256')))
+            scope = (
+                frozenset(pk for pk, _ in documents),
+                self.content_hash('\n'.join(f"{pk}:{sha256}" for pk, sha256 in documents)),
             )
+            cache.set(key, scope, settings.KNOWLEDGE_SCOPE_CACHE_TIMEOUT)
+        return scope
+
+    def live_documents(self, course_id: int, group=None) -> set:
+        """
+        Documents the chatbot may search for a course: those of its processed
+        files or, for a group with a scoped knowledge base, only the files the
+        teacher selected for that group.
+        """
+        return set(self._scope(course_id, group)[0])
+
+    def index_version(self, course_id: int, group=None) -> str:
+        """
+        Hash of the documents the chatbot may search for the course (or the
+        group's scope) and of their content: it changes when a file is added,
+        removed or re-uploaded with new content, even if its document is
+        updated in place.
+        """
+        return self._scope(course_id, group)[1]
+
+    @staticmethod
+    def group_key(group_id: int, version: int) -> str:
+        return f"knowledge-group:{group_id}:{version}"
+
+    def chat_group(self, course_id: int, group_id: Optional[int]) -> Optional[Group]:
+        """
+        The student's group as retrieval needs it: its id and whether its
+        knowledge base is scoped. Only the course's knowledge version is read
+        per message; the flag is cached under it (the group id comes from the
+        prompt cache, see PromptCompiler.group_id). The returned group carries
+        that version, so the scope lookups for the message do not read it again.
+        """
+        if not group_id:
+            return None
+        version = self.knowledge_version(course_id)
+        key = self.group_key(group_id, version)
+        scoped = cache.get(key)
+        if scoped is None:
+            scoped = bool(Group.objects.filter(pk=group_id).values_list('scoped_knowledge', flat=True).first())
+            cache.set(key, scoped, settings.KNOWLEDGE_SCOPE_CACHE_TIMEOUT)
+        group = Group(pk=group_id, course_id=course_id, scoped_knowledge=scoped)
+        group.knowledge_version = version
+        return group
+
+    def invalidate_scope(self, course_id: int) -> None:
+        """
+        Bump the course's knowledge version, so the cached scopes of the course
+        and of its groups are no longer used by any process.
+        """
+        Course.objects.filter(pk=course_id).update(knowledge_version=F('knowledge_version') + 1)
+
+    def warm_scope(self, group) -> None:
+        """Precompute the index masks of a group's scope so its first query is not slower."""
+        course_index.warm(
+            group.course_id,
+            self.live_documents(group.course_id, group),
+            self.course_embedding_model(group.course_id),
+        )
+
+    def find_summary(self, query_embedding: np.ndarray, course_id: int, live_documents: set, model: str,
+                     include_course: bool = True) -> Optional[Tuple[str, float]]:
+        """
+        Best summary node for the unit `query_embedding` among the section and
+        file nodes of `live_documents` and, with `include_course`, the course node.
+        """
+        nodes = Q(document_id__in=live_documents)
+        if include_course:
+            nodes |= Q(course_id=course_id, level=KnowledgeSummary.Level.COURSE)
+        rows = [
+            (pk, vector) for pk, vector in
+            KnowledgeSummary.objects.filter(nodes, embedding_model=model).values_list('id', 'vector')
+            if len(vector) == query_embedding.nbytes
+        ]
+        if not rows:
+            return None
+        
+        matrix = np.frombuffer(b''.join(bytes(vector) for _, vector in rows), dtype=np.float32).reshape(len(rows), -1)
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        scores = (matrix @ query_embedding) / norms
+        best = int(np.argmax(scores))
+        text = KnowledgeSummary.objects.filter(pk=rows[best][0]).values_list('text', flat=True).first()
+        return (text, float(scores[best])) if text else None
+
+    def rerank_keywords(self, query: str, results: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+        """Add to each similarity the share of the query's keywords found in the chunk, and re-sort."""
+        terms = {term for term in re.findall(r'\w+', query.lower()) if len(term) > 2}
+        if not terms:
+            return results
+        reranked = []
+        for text, similarity in results:
+            words = set(re.findall(r'\w+', text.lower()))
+            reranked.append((text, similarity + self.hybrid_weight * len(terms & words) / len(terms)))
+        return sorted(reranked, key=lambda item: item[1], reverse=True)
+
+    def embed_query(self, query: str, course_id: int) -> Tuple[str, np.ndarray]:
+        """The course's embedding model and the unit embedding of `query` with it."""
+        model = self.course_embedding_model(course_id)
+        query_embedding = np.asarray(self.get_embeddings_openai([query], model=model)[0], dtype=np.float32)
+        query_embedding /= np.linalg.norm(query_embedding) or 1.0
+        return model, query_embedding
+
+    async def aembed_query(self, query: str, course_id: int) -> Tuple[str, np.ndarray]:
+        """Async version of embed_query: the embedding round trip does not hold a thread."""
+        model = await Course.objects.filter(pk=course_id).values_list('embedding_model', flat=True).afirst()
+        model = model or self.embedding_client.model
+        query_embedding = np.asarray((await self.embedding_client.aembed([query], model=model))[0], dtype=np.float32)
+        query_embedding /= np.linalg.norm(query_embedding) or 1.0
+        return model, query_embedding
+
+    def find_relevant_chunks(self, query: str, course_id: int, limit: int = None, group=None,
+                             summaries: bool = True, query_embedding=None) -> List[Tuple[str, float]]:
+        """
+        Find the most relevant text chunks for a given query.
+
+        Documents sealed into the course's index segments are scored from the
+        cached segment matrices; any document not sealed yet is scanned from
+        its chunk rows, streaming only ids and packed vectors a block at a time.
+        The text is sliced from the compressed pages just for the best `limit`
+        chunks. With a `group` whose knowledge base is scoped, only its
+        selected documents are visible, applied as precomputed row masks over
+        the segments.
+
+        The course's retrieval profile sets the default `limit`, drops chunks
+        under its score threshold and picks the engine: exact scoring, an
+        approximate search over clustered segments, or hybrid, which reranks
+        extra vector hits by their overlap with the query's keywords.
+
+        With `summaries`, a summary node that matches the query better than
+        every chunk by KNOWLEDGE_SUMMARY_MARGIN (typically a broad question
+        about a file or the whole course) is returned first, followed by the
+        best chunks.
+
+        `query_embedding` is an optional result of `embed_query` (or a Future
+        of it started by the caller, so the embedding round trip overlaps the
+        lookups done here).
+        """
+        
+        try:
+            profile = self.profile_for(course_id)
+            if limit is None:
+                limit = profile.top_k
+            hybrid = profile.engine == RetrievalProfile.Engine.HYBRID
+            candidates = limit * self.hybrid_candidates if hybrid else limit
             
-            if not knowledge_files.exists():
+            # Get the chunks of all processed files for the course (or the group's scope)
+            live_documents = self.live_documents(course_id, group)
+            if not live_documents:
                 return []
             
-            # Get query embedding
-            query_embedding = self.get_embeddings_openai([query])[0]
-            
-            relevant_chunks = []
-            
-            for kf in knowledge_files:
-                chunks = kf.text_chunks
-                embeddings = kf.embeddings
-                
-                if not chunks or not embeddings or len(chunks) != len(embeddings):
-                    continue
-                
-                # Calculate similarities
-                similarities = []
-                for i, emb in enumerate(embeddings):
-                    if np and cosine_similarity:
-                        sim = cosine_similarity([query_embedding], [emb])[0][0]
-                    else:
-                        # Fallback: simple dot product similarity
-                        sim = sum(a * b for a, b in zip(query_embedding, emb))
-                    similarities.append(sim)
-                
-                # Add chunks with their similarities
-                for chunk, similarity in zip(chunks, similarities):
-                    relevant_chunks.append((chunk, similarity))
-            
-            # Sort by similarity and return top chunks
-            relevant_chunks.sort(key=lambda x: x[1], reverse=True)
-            
-            return relevant_chunks[:limit]
+            # The course is read with the model of its index. While a reindex is
+            # migrating it to a new model, the new vectors live in ChunkEmbedding
+            # and only become visible when the course switches.
+            if isinstance(query_embedding, Future):
+                query_embedding = query_embedding.result()
+            if query_embedding is not None:
+                model, query_embedding = query_embedding
+            else:
+                model, query_embedding = self.embed_query(query, course_id)
+            vector_bytes = query_embedding.nbytes
+            
+            # Keep only the best `candidates` chunks while streaming over the rows
+            top_chunks, covered = course_index.search(
+                course_id, model, query_embedding, candidates, live_documents,
+                approximate=profile.engine == RetrievalProfile.Engine.ANN
+            )
+            document_ids = live_documents - covered
+            
+            chunk_rows = itertools.chain(
+                KnowledgeChunk.objects.filter(
+                    document_id__in=document_ids,
+                    embedding_model=model
+                ).values_list('id', 'vector').iterator(chunk_size=2000),
+                ChunkEmbedding.objects.filter(
+                    chunk__document_id__in=document_ids,
+                    model=model
+                ).values_list('chunk_id', 'vector').iterator(chunk_size=2000),
+            ) if document_ids else ()
+            
+            def score(ids, vectors):
+                matrix = np.frombuffer(b''.join(vectors), dtype=np.float32).reshape(len(ids), -1)
+                norms = np.linalg.norm(matrix, axis=1)
+                norms[norms == 0] = 1.0
+                for chunk_id, similarity in zip(ids, (matrix @ query_embedding) / norms):
+                    similarity = float(similarity)
+                    if len(top_chunks) < candidates:
+                        heapq.heappush(top_chunks, (similarity, chunk_id))
+                    elif similarity > top_chunks[0][0]:
+                        heapq.heapreplace(top_chunks, (similarity, chunk_id))
+            
+            ids, vectors = [], []
+            for chunk_id, vector in chunk_rows:
+                if len(vector) != vector_bytes:
+                    continue  # Missing or from a different embedding model
+                ids.append(chunk_id)
+                vectors.append(bytes(vector))
+                if len(ids) >= 2000:
+                    score(ids, vectors)
+                    ids, vectors = [], []
+            if ids:
+                score(ids, vectors)
+            top_chunks = [(similarity, chunk_id) for similarity, chunk_id in top_chunks
+                          if similarity >= profile.score_threshold]
+            
+            summary = None
+            if summaries:
+                summary = self.find_summary(
+                    query_embedding, course_id, live_documents, model,
+                    # A scoped group must not see an overview of files outside its scope
+                    include_course=not (group is not None and group.scoped_knowledge)
+                )
+                best_chunk = max(top_chunks)[0] if top_chunks else None
+                if not summary or summary[1] < profile.score_threshold or (
+                        best_chunk is not None and summary[1] < best_chunk + settings.KNOWLEDGE_SUMMARY_MARGIN):
+                    summary = None
+            
+            # Only the pages of the winning chunks are read and decompressed
+            texts = self.chunk_texts(chunk_id for _, chunk_id in top_chunks)
+            
+            # Sort by similarity and return top chunks (a chunk may have been
+            # replaced by a reprocess since its segment was sealed)
+            results = [
+                (texts[chunk_id], similarity)
+                for similarity, chunk_id in sorted(top_chunks, reverse=True)
+                if chunk_id in texts
+            ]
+            if hybrid:
+                results = self.rerank_keywords(query, results)
+            if summary:
+                # The overview leads, and the best chunks keep the details it leaves out
+                return [summary] + results[:max(limit - 1, 1)]
+            return results[:limit]
             
         except Exception as e:
             return []
     
-    def create_rag_context(self, query: str, course_id: int) -> str:
+    def create_rag_context(self, query: str, course_id: int, group=None, query_embedding=None) -> str:
         """Create context from relevant knowledge base chunks."""
-        relevant_chunks = self.find_relevant_chunks(query, course_id)
+        relevant_chunks = self.find_relevant_chunks(query, course_id, group=group, query_embedding=query_embedding)
         
         if not relevant_chunks:
             return ""
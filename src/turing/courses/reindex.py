@@ -0,0 +1,170 @@
+# courses/reindex.py
+import threading
+import time
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .embedding_client import embedding_client
+from .models import ChunkEmbedding, Course, KnowledgeBaseFile, KnowledgeChunk
+from .rag_utils import rag_processor
+from .segments import course_index
+
+
+class ReindexProgress:
+    """Thread-safe counters for the reindex, with throughput and ETA."""
+
+    def __init__(self, chunks_total: int):
+        self.chunks_total = chunks_total
+        self.chunks_done = 0
+        self.documents_done = 0
+        self.documents_failed = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, chunks: int) -> None:
+        with self.lock:
+            self.chunks_done += chunks
+
+    def document_finished(self, failed: bool = False) -> None:
+        with self.lock:
+            if failed:
+                self.documents_failed += 1
+            else:
+                self.documents_done += 1
+
+    def summary(self) -> str:
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            rate = self.chunks_done / elapsed if elapsed else 0.0
+            remaining = self.chunks_total - self.chunks_done
+            eta = f"{remaining / rate:.0f}s" if rate else "?"
+            return (
+                f"{self.chunks_done}/{self.chunks_total} fragmentos "
+                f"({rate:.1f}/s, ETA {eta}), documentos: {self.documents_done} listos, "
+                f"{self.documents_failed} con error"
+            )
+
+
+def effective_model_filter(model: str) -> Q:
+    """Courses whose index is read with `model` (an empty value means settings.EMBEDDING_MODEL)."""
+    if model == settings.EMBEDDING_MODEL:
+        return Q(embedding_model=model) | Q(embedding_model='')
+    return Q(embedding_model=model)
+
+
+def missing_chunks(model: str, document_ids: Iterable[int]):
+    """Chunks of the documents without a vector for `model`: the work left, and the checkpoint."""
+    return (
+        KnowledgeChunk.objects
+        .filter(document_id__in=document_ids)
+        .exclude(embedding_model=model)
+        .exclude(embeddings__model=model)
+    )
+
+
+def course_documents(course_ids: Iterable[int]):
+    return (
+        KnowledgeBaseFile.objects
+        .filter(course_id__in=course_ids, document__isnull=False)
+        .values_list('document_id', flat=True)
+        .distinct()
+    )
+
+
+def reindex_document(document_id: int, model: str, progress: ReindexProgress, batch_size: int = None) -> None:
+    """
+    Embed the chunks of a document that have no vector for `model` yet.
+
+    Every group of batches is committed as it completes, so an interrupted
+    run resumes from the chunks still missing. Raises the first embedding
+    error after storing what succeeded.
+    """
+    batch_size = batch_size or rag_processor.embedding_batch_size
+    group_size = batch_size * embedding_client.concurrency
+    failed_ids = set()
+    first_error = None
+    while True:
+        chunk_ids = list(
+            missing_chunks(model, [document_id])
+            .exclude(id__in=failed_ids)
+            .order_by('id')
+            .values_list('id', flat=True)[:group_size]
+        )
+        if not chunk_ids:
+            break
+        texts = rag_processor.chunk_texts(chunk_ids)
+        rows = [(chunk_id, texts[chunk_id]) for chunk_id in chunk_ids if chunk_id in texts]
+        # Chunks replaced by a concurrent reprocess have no page left to slice
+        failed_ids.update(chunk_id for chunk_id in chunk_ids if chunk_id not in texts)
+        
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        results, errors = embedding_client.embed_batches(
+            [[text for _, text in batch] for batch in batches],
+            model=model
+        )
+        ChunkEmbedding.objects.bulk_create([
+            ChunkEmbedding(chunk_id=chunk_id, model=model, vector=rag_processor.pack_vector(vector))
+            for batch, vectors in zip(batches, results) if vectors is not None
+            for (chunk_id, _), vector in zip(batch, vectors)
+        ], ignore_conflicts=True)
+        progress.add(sum(len(batch) for batch, vectors in zip(batches, results) if vectors is not None))
+        
+        if errors:
+            # Keep going with the rest of the document; the failed chunks are retried on the next run
+            failed_ids.update(chunk_id for i in errors for chunk_id, _ in batches[i])
+            first_error = first_error or next(iter(errors.values()))
+    
+    if first_error:
+        raise first_error
+
+
+def switch_ready_courses(model: str, course_ids: Iterable[int]) -> List[int]:
+    """
+    Point every course whose documents all have vectors for `model` at it.
+
+    The switch is a single UPDATE per course: queries see either the complete
+    old index or the complete new one.
+    """
+    switched = []
+    for course in Course.objects.filter(pk__in=course_ids).exclude(effective_model_filter(model)):
+        if missing_chunks(model, course_documents([course.pk])).exists():
+            continue
+        Course.objects.filter(pk=course.pk).update(embedding_model=model)
+        # Until its segments are rebuilt the course is served from the chunk rows
+        course_index.rebuild(course.pk, model)
+        switched.append(course.pk)
+    return switched
+
+
+def promote_vectors(model: str) -> int:
+    """
+    Move staged vectors into the chunk rows once no course reads the old ones.
+
+    Only documents whose courses all read `model` are promoted, so courses
+    still on another model keep their vectors.
+    """
+    pending_courses = Course.objects.exclude(effective_model_filter(model)).values('pk')
+    blocked_documents = KnowledgeBaseFile.objects.filter(course_id__in=pending_courses).values('document_id')
+    staged = (
+        ChunkEmbedding.objects
+        .filter(model=model)
+        .exclude(chunk__document_id__in=blocked_documents)
+        .select_related('chunk')
+    )
+    promoted = 0
+    while True:
+        batch = list(staged.order_by('id')[:500])
+        if not batch:
+            return promoted
+        with transaction.atomic():
+            chunks = []
+            for embedding in batch:
+                embedding.chunk.vector = embedding.vector
+                embedding.chunk.embedding_model = model
+                chunks.append(embedding.chunk)
+            KnowledgeChunk.objects.bulk_update(chunks, ['vector', 'embedding_model'])
+            ChunkEmbedding.objects.filter(pk__in=[embedding.pk for embedding in batch]).delete()
+        promoted += len(batch)
@@ -0,0 +1,347 @@
+# courses/segments.py
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from . import background
+from .models import ChunkEmbedding, IndexSegment, KnowledgeBaseFile, KnowledgeChunk
+
+
+def _normalized(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _partition_bytes(partition: Tuple[np.ndarray, List[np.ndarray]]) -> int:
+    centroids, members = partition
+    return centroids.nbytes + sum(rows.nbytes for rows in members)
+
+
+class CourseIndex:
+    """
+    Segmented vector index of each course.
+
+    Every processed document is sealed into its own small segment, so making a
+    new upload searchable costs the same however large the course is. Queries
+    scan all live segments of the course; a background merge keeps their
+    number bounded by combining the smallest ones, dropping tombstoned rows on
+    the way. Decoded segments are cached per process, as they never change.
+
+    Restricting a query to some documents (tombstones, a group's scope) is a
+    boolean row mask per segment, computed once per set of visible documents
+    and kept in a small LRU, so scoped searches cost the same as full ones.
+
+    Approximate searches split each large segment into clusters the first
+    time it is searched that way, and only score the rows of the clusters
+    closest to the query. The clusters count toward the segment cache and
+    are evicted with their segment.
+    """
+
+    def __init__(self, max_segments=None, merge_factor=None, cache_bytes=None, mask_cache_size=None):
+        self._max_segments = max_segments
+        self._merge_factor = merge_factor
+        self._cache_bytes = cache_bytes
+        self._mask_cache_size = mask_cache_size
+        self.cache: "OrderedDict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]]" = OrderedDict()
+        self.cache_size = 0
+        self.masks: "OrderedDict[Tuple[int, FrozenSet[int]], np.ndarray]" = OrderedDict()
+        self.partitions: Dict[int, Tuple[np.ndarray, List[np.ndarray]]] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def max_segments(self) -> int:
+        return self._max_segments or settings.KNOWLEDGE_SEGMENT_MAX
+
+    @property
+    def merge_factor(self) -> int:
+        return self._merge_factor or settings.KNOWLEDGE_SEGMENT_MERGE_FACTOR
+
+    @property
+    def cache_bytes(self) -> int:
+        return settings.KNOWLEDGE_SEGMENT_CACHE_BYTES if self._cache_bytes is None else self._cache_bytes
+
+    @property
+    def mask_cache_size(self) -> int:
+        return settings.KNOWLEDGE_MASK_CACHE_SIZE if self._mask_cache_size is None else self._mask_cache_size
+
+    # Escritura
+
+    @staticmethod
+    def _document_vectors(document_ids: Iterable[int], model: str):
+        """(chunk_id, document_id, vector) of the documents' chunks for `model`."""
+        document_ids = list(document_ids)
+        return itertools.chain(
+            KnowledgeChunk.objects
+            .filter(document_id__in=document_ids, embedding_model=model)
+            .values_list('id', 'document_id', 'vector')
+            .iterator(chunk_size=2000),
+            ChunkEmbedding.objects
+            .filter(chunk__document_id__in=document_ids, model=model)
+            .values_list('chunk_id', 'chunk__document_id', 'vector')
+            .iterator(chunk_size=2000),
+        )
+
+    @staticmethod
+    def _pack(course_id, model, documents, chunk_ids, row_documents, vectors) -> IndexSegment:
+        matrix = _normalized(np.frombuffer(b''.join(vectors), dtype=np.float32).reshape(len(vectors), -1))
+        return IndexSegment(
+            course_id=course_id,
+            model=model,
+            documents=sorted(documents),
+            rows=len(chunk_ids),
+            chunk_ids=np.asarray(chunk_ids, dtype=np.int64).tobytes(),
+            row_documents=np.asarray(row_documents, dtype=np.int64).tobytes(),
+            vectors=matrix.astype(np.float32).tobytes(),
+        )
+
+    def _tombstone(self, course_id: int, document_id: int, model: str = None) -> None:
+        segments = IndexSegment.objects.select_for_update().filter(course_id=course_id).only('documents', 'tombstones')
+        if model:
+            segments = segments.filter(model=model)
+        with transaction.atomic():
+            for segment in segments:
+                if document_id in segment.documents and document_id not in segment.tombstones:
+                    segment.tombstones = segment.tombstones + [document_id]
+                    segment.save(update_fields=['tombstones'])
+
+    def add_document(self, course_id: int, document_id: int, model: str, merge: bool = True) -> None:
+        """Seal the current chunks of a document into a new segment of the course."""
+        rows = [
+            (chunk_id, doc_id, bytes(vector))
+            for chunk_id, doc_id, vector in self._document_vectors([document_id], model)
+            if vector
+        ]
+        dims = {len(vector) for _, _, vector in rows}
+        with transaction.atomic():
+            # An earlier version of the document stays searchable until this commit
+            self._tombstone(course_id, document_id, model)
+            if rows and len(dims) == 1:
+                self._pack(
+                    course_id, model, [document_id],
+                    [chunk_id for chunk_id, _, _ in rows],
+                    [doc_id for _, doc_id, _ in rows],
+                    [vector for _, _, vector in rows],
+                ).save()
+        if merge:
+            self.schedule_merge(course_id, model)
+
+    def remove_document(self, course_id: int, document_id: int) -> None:
+        """Tombstone a document deleted from the course; compaction drops its rows."""
+        self._tombstone(course_id, document_id)
+
+    def rebuild(self, course_id: int, model: str) -> None:
+        """Seal every processed document of the course (e.g. after switching models)."""
+        document_ids = set(
+            KnowledgeBaseFile.objects
+            .filter(course_id=course_id, processed=True, document__isnull=False)
+            .values_list('document_id', flat=True)
+        )
+        with transaction.atomic():
+            IndexSegment.objects.filter(course_id=course_id).delete()
+            for document_id in document_ids:
+                self.add_document(course_id, document_id, model, merge=False)
+            self.schedule_merge(course_id, model)
+
+    # Mezcla
+
+    def schedule_merge(self, course_id: int, model: str) -> None:
+        if IndexSegment.objects.filter(course_id=course_id, model=model).count() > self.max_segments:
+            transaction.on_commit(lambda: background.submit(self.merge, course_id, model))
+
+    def merge(self, course_id: int, model: str, force: bool = False) -> int:
+        """
+        Merge the smallest segments of the course until at most `max_segments`
+        remain (or all of them into one with `force`, which also compacts away
+        every tombstone). Returns the number of segments merged.
+        """
+        merged = 0
+        while True:
+            with transaction.atomic():
+                segments = list(
+                    IndexSegment.objects.select_for_update()
+                    .filter(course_id=course_id, model=model)
+                    .order_by('rows', 'id')
+                )
+                if force:
+                    if len(segments) <= 1 and not any(segment.tombstones for segment in segments):
+                        return merged
+                    group = segments
+                else:
+                    if len(segments) <= self.max_segments:
+                        return merged
+                    group = segments[:self.merge_factor]
+
+                chunk_ids, row_documents, vectors, documents = [], [], [], set()
+                for segment in group:
+                    ids, docs, matrix = self._decode(segment)
+                    keep = ~np.isin(docs, segment.tombstones)
+                    chunk_ids.extend(ids[keep].tolist())
+                    row_documents.extend(docs[keep].tolist())
+                    vectors.extend(row.tobytes() for row in matrix[keep])
+                    documents.update(set(segment.documents) - set(segment.tombstones))
+
+                IndexSegment.objects.filter(pk__in=[segment.pk for segment in group]).delete()
+                if chunk_ids:
+                    self._pack(course_id, model, documents, chunk_ids, row_documents, vectors).save()
+                merged += len(group)
+
+    # Lectura
+
+    @staticmethod
+    def _decode(segment) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ids = np.frombuffer(segment.chunk_ids, dtype=np.int64)
+        docs = np.frombuffer(segment.row_documents, dtype=np.int64)
+        matrix = np.frombuffer(segment.vectors, dtype=np.float32).reshape(len(ids), -1) if len(ids) else np.zeros((0, 0), np.float32)
+        return ids, docs, matrix
+
+    def _load(self, segment_ids: List[int]) -> Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        with self.lock:
+            loaded = {pk: self.cache[pk] for pk in segment_ids if pk in self.cache}
+            for pk in loaded:
+                self.cache.move_to_end(pk)
+
+        missing = [pk for pk in segment_ids if pk not in loaded]
+        for segment in IndexSegment.objects.filter(pk__in=missing).only('chunk_ids', 'row_documents', 'vectors'):
+            decoded = self._decode(segment)
+            loaded[segment.pk] = decoded
+            size = sum(array.nbytes for array in decoded)
+            with self.lock:
+                if segment.pk not in self.cache:
+                    self.cache[segment.pk] = decoded
+                    self.cache_size += size
+                self._shrink()
+        return loaded
+
+    def _shrink(self) -> None:
+        """Drop the least recently used segments, with their clusters and masks (caller holds the lock)."""
+        while self.cache_size > self.cache_bytes and self.cache:
+            evicted_pk, evicted = self.cache.popitem(last=False)
+            self.cache_size -= sum(array.nbytes for array in evicted)
+            partition = self.partitions.pop(evicted_pk, None)
+            if partition is not None:
+                self.cache_size -= _partition_bytes(partition)
+            for key in [key for key in self.masks if key[0] == evicted_pk]:
+                del self.masks[key]
+
+    def _mask(self, pk: int, docs: np.ndarray, visible: FrozenSet[int]) -> np.ndarray:
+        """Rows of segment `pk` whose document is in `visible`, cached per pair."""
+        key = (pk, visible)
+        with self.lock:
+            mask = self.masks.get(key)
+            if mask is not None:
+                self.masks.move_to_end(key)
+                return mask
+        mask = np.isin(docs, np.fromiter(visible, dtype=np.int64, count=len(visible)))
+        mask.setflags(write=False)
+        with self.lock:
+            self.masks[key] = mask
+            while len(self.masks) > self.mask_cache_size:
+                self.masks.popitem(last=False)
+        return mask
+
+    @staticmethod
+    def _cluster(matrix: np.ndarray, iterations: int = 8) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """Spherical k-means with about sqrt(rows) clusters: (centroids, row indices of each cluster)."""
+        rows = len(matrix)
+        clusters = max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(0)
+        centroids = matrix[rng.choice(rows, clusters, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.concatenate([
+                np.argmax(matrix[i:i + 8192] @ centroids.T, axis=1) for i in range(0, rows, 8192)
+            ])
+            for cluster in range(clusters):
+                members = matrix[assignment == cluster]
+                if len(members):
+                    centroids[cluster] = members.sum(axis=0)
+            centroids = _normalized(centroids)
+        return centroids, [np.flatnonzero(assignment == cluster) for cluster in range(clusters)]
+
+    def _candidates(self, pk: int, matrix: np.ndarray, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows of the clusters closest to `query`, or None to score the whole segment."""
+        if len(matrix) < settings.KNOWLEDGE_ANN_MIN_ROWS:
+            return None
+        with self.lock:
+            partition = self.partitions.get(pk)
+        if partition is None:
+            partition = self._cluster(matrix)
+            with self.lock:
+                # Kept only while the segment is cached, and counted in its budget
+                if pk in self.cache and pk not in self.partitions:
+                    self.partitions[pk] = partition
+                    self.cache_size += _partition_bytes(partition)
+                    self._shrink()
+        centroids, members = partition
+        probes = min(settings.KNOWLEDGE_ANN_PROBES, len(centroids))
+        nearest = np.argpartition(-(centroids @ query), probes - 1)[:probes]
+        return np.concatenate([members[cluster] for cluster in nearest])
+
+    def _visible(self, course_id: int, model: Optional[str],
+                 live_documents: Set[int]) -> Tuple[Dict[int, Optional[FrozenSet[int]]], Set[int]]:
+        """
+        Documents to search in each segment of the course: None when every row
+        of the segment is visible, else the frozen set of visible documents.
+        """
+        segments = IndexSegment.objects.filter(course_id=course_id)
+        if model:
+            segments = segments.filter(model=model)
+        covered = set()
+        visible = {}
+        for pk, documents, tombstones in segments.values_list('id', 'documents', 'tombstones'):
+            live = (set(documents) - set(tombstones)) & live_documents
+            if live:
+                visible[pk] = None if len(live) == len(documents) else frozenset(live)
+                covered |= live
+        return visible, covered
+
+    def warm(self, course_id: int, live_documents: Set[int], model: str = None) -> None:
+        """Precompute the masks for a set of visible documents (e.g. a new group scope)."""
+        visible, _ = self._visible(course_id, model, set(live_documents))
+        for pk, (ids, docs, matrix) in self._load(list(visible)).items():
+            if visible[pk] is not None:
+                self._mask(pk, docs, visible[pk])
+
+    def search(self, course_id: int, model: str, query: np.ndarray, limit: int,
+               live_documents: Set[int], approximate: bool = False) -> Tuple[List[Tuple[float, int]], Set[int]]:
+        """
+        Score the unit `query` vector against the course's segments, exactly
+        or, with `approximate`, only against the nearest clusters of each.
+
+        Returns the best (similarity, chunk_id) pairs and the set of live
+        documents the segments cover; the caller scans the rest row by row.
+        """
+        visible, covered = self._visible(course_id, model, live_documents)
+
+        top = []
+        for pk, (ids, docs, matrix) in self._load(list(visible)).items():
+            if not len(ids) or matrix.shape[1] != query.shape[0]:
+                continue
+            rows = self._candidates(pk, matrix, query) if approximate else None
+            mask = self._mask(pk, docs, visible[pk]) if visible[pk] is not None else None
+            if rows is not None:
+                ids, matrix = ids[rows], matrix[rows]
+                mask = mask[rows] if mask is not None else None
+            scores = matrix @ query
+            if mask is not None:
+                scores[~mask] = -np.inf
+            best = np.argpartition(-scores, limit)[:limit] if len(scores) > limit else range(len(scores))
+            for i in best:
+                if scores[i] == -np.inf:
+                    continue
+                item = (float(scores[i]), int(ids[i]))
+                if len(top) < limit:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+        return top, covered
+
+
+# Global instance
+course_index = CourseIndex()
@@ -0,0 +1,52 @@
+# courses/signals.py
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Group, KnowledgeBaseFile, KnowledgeDocument
+from .rag_utils import rag_processor
+from .segments import course_index
+from .summaries import summary_builder
+
+
+@receiver(post_delete, sender=KnowledgeBaseFile)
+def delete_unused_document(sender, instance, **kwargs):
+    """Al borrar un archivo (también en cascada), libera su documento si quedó huérfano."""
+    if instance.document_id:
+        # Sus fragmentos dejan de aparecer en el índice del curso (lápida hasta la compactación)
+        if not KnowledgeBaseFile.objects.filter(course_id=instance.course_id, document_id=instance.document_id).exists():
+            course_index.remove_document(instance.course_id, instance.document_id)
+            # El resumen del curso aún menciona el archivo borrado
+            summary_builder.schedule(instance.course_id)
+        document = KnowledgeDocument.objects.filter(pk=instance.document_id).first()
+        if document:
+            document.delete_if_unused()
+
+
+# Documentos que el chatbot puede consultar por curso y grupo: cambian de versión
+# (en la base de datos, para todos los procesos) cuando cambia un archivo, el
+# contenido de un documento o el alcance de un grupo
+
+@receiver([post_save, post_delete], sender=KnowledgeBaseFile)
+def invalidate_course_scope(sender, instance, **kwargs):
+    transaction.on_commit(lambda: rag_processor.invalidate_scope(instance.course_id))
+
+
+@receiver(post_save, sender=KnowledgeDocument)
+def invalidate_document_scope(sender, instance, created, **kwargs):
+    # Un documento actualizado en su lugar cambia la versión de los cursos que lo usan
+    if not created:
+        course_ids = set(instance.files.values_list('course_id', flat=True))
+        transaction.on_commit(lambda: [rag_processor.invalidate_scope(course_id) for course_id in course_ids])
+
+
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_group_scope(sender, instance, **kwargs):
+    transaction.on_commit(lambda: rag_processor.invalidate_scope(instance.course_id))
+
+
+@receiver(m2m_changed, sender=Group.knowledge_files.through)
+def invalidate_scoped_files(sender, instance, action, reverse, **kwargs):
+    # Cambiaron los archivos de un grupo o, desde el otro lado, los grupos de un archivo
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: rag_processor.invalidate_scope(instance.course_id))
@@ -0,0 +1,109 @@
+# courses/storage_cache.py
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files import File
+
+
+def local_copy(upload) -> File:
+    """
+    Open an independent handle on an uploaded file.
+
+    Large uploads already live in a temporary file on disk, which is reopened;
+    small in-memory uploads are copied into a buffer. The handle can be read
+    while another thread sends the original upload to storage.
+    """
+    if hasattr(upload, 'temporary_file_path'):
+        return File(open(upload.temporary_file_path(), 'rb'), name=upload.name)
+    upload.seek(0)
+    data = upload.read()
+    upload.seek(0)
+    return File(io.BytesIO(data), name=upload.name)
+
+
+class StorageCache:
+    """
+    Read-through cache of storage objects on the local disk.
+
+    Objects are keyed by their storage name, written atomically and evicted
+    least recently used first once the directory grows past `max_bytes`.
+    Uploads prime the cache, so reprocessing a file never downloads it again.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        return self._directory or settings.KNOWLEDGE_CACHE_DIR
+
+    @property
+    def max_bytes(self) -> int:
+        return settings.KNOWLEDGE_CACHE_MAX_BYTES if self._max_bytes is None else self._max_bytes
+
+    def path_for(self, name: str) -> str:
+        extension = os.path.splitext(name)[1]
+        return os.path.join(self.directory, hashlib.sha1(name.encode('utf-8')).hexdigest() + extension)
+
+    def put(self, name: str, source) -> str:
+        """Store the content of the open file `source` under the storage name `name`."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                source.seek(0)
+                shutil.copyfileobj(source, out, 1024 * 1024)
+            source.seek(0)
+            os.replace(tmp_path, self.path_for(name))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict_over_limit()
+        return self.path_for(name)
+
+    def open(self, field_file) -> File:
+        """Open a local copy of a stored file, downloading it only on a cache miss."""
+        path = self.path_for(field_file.name)
+        if os.path.exists(path):
+            os.utime(path)  # Mark as recently used
+        else:
+            with field_file.storage.open(field_file.name, 'rb') as remote:
+                path = self.put(field_file.name, remote)
+        return File(open(path, 'rb'), name=field_file.name)
+
+    def discard(self, name: str) -> None:
+        try:
+            os.remove(self.path_for(name))
+        except FileNotFoundError:
+            pass
+
+    def evict_over_limit(self) -> None:
+        with self.lock:
+            try:
+                entries = [entry for entry in os.scandir(self.directory)
+                           if entry.is_file() and not entry.name.endswith('.part')]
+            except FileNotFoundError:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            total = sum(entry.stat().st_size for entry in entries)
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                size = entry.stat().st_size
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+# Global instance
+storage_cache = StorageCache()
@@ -0,0 +1,195 @@
+# courses/summaries.py
+import hashlib
+import threading
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from . import background
+from turing.llm_gateway import get_gateway
+
+from .embedding_client import embedding_client
+from .models import Course, KnowledgeBaseFile, KnowledgeDocument, KnowledgeSummary
+
+Level = KnowledgeSummary.Level
+
+INSTRUCTIONS = {
+    Level.SECTION: (
+        "Resume el siguiente fragmento de material de un curso universitario en un párrafo "
+        "de como máximo 120 palabras. Menciona los temas y conceptos principales que cubre."
+    ),
+    Level.FILE: (
+        "A continuación están los resúmenes de las secciones de un documento de un curso "
+        "universitario. Escribe un resumen del documento completo de como máximo 180 palabras, "
+        "organizado por temas en el orden en que aparecen."
+    ),
+    Level.COURSE: (
+        "A continuación están los resúmenes de los documentos de un curso universitario. "
+        "Escribe un panorama general de lo que cubre el curso de como máximo 200 palabras, "
+        "mencionando las unidades o documentos principales."
+    ),
+}
+
+
+def _hash(parts: Iterable[str]) -> str:
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class SummaryBuilder:
+    """
+    Builds the summary tree of each course's knowledge base.
+
+    Runs offline, after ingestion: a few pages at a time are summarized into
+    section nodes, sections into one node per document and documents into one
+    node per course, and every node is embedded like a chunk. Each node keeps
+    the hash of what it summarizes, so a rebuild only calls the LLM for the
+    parts that changed. Document nodes are shared by every course using the
+    same PDF, like their chunks.
+    """
+
+    def __init__(self, gateway=None, chat_model=None, section_pages=None, max_input_chars=12000):
+        self._gateway = gateway
+        self._chat_model = chat_model
+        self._section_pages = section_pages
+        self.max_input_chars = max_input_chars
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.locks = {}
+
+    @property
+    def gateway(self):
+        return self._gateway or get_gateway()
+
+    @property
+    def chat_model(self) -> str:
+        return self._chat_model or settings.KNOWLEDGE_SUMMARY_MODEL
+
+    @property
+    def section_pages(self) -> int:
+        return self._section_pages or settings.KNOWLEDGE_SUMMARY_SECTION_PAGES
+
+    def summarize(self, text: str, level: str) -> str:
+        return self.gateway.chat(
+            [
+                {"role": "system", "content": INSTRUCTIONS[level]},
+                {"role": "user", "content": text[:self.max_input_chars]},
+            ],
+            model=self.chat_model,
+            temperature=0.2,
+        ).strip()
+
+    def _node(self, node: Optional[KnowledgeSummary], source_hash: str, model: str,
+              make_text: Callable[[], str], **fields) -> KnowledgeSummary:
+        """Create or refresh a node; unchanged nodes embedded with `model` are kept as they are."""
+        if node is not None and node.source_hash == source_hash and node.embedding_model == model:
+            return node
+        if node is None:
+            node = KnowledgeSummary(**fields)
+        else:
+            for name, value in fields.items():
+                setattr(node, name, value)
+        if node.pk is None or node.source_hash != source_hash:
+            node.text = make_text()
+        node.source_hash = source_hash
+        node.vector = np.asarray(embedding_client.embed([node.text], model=model)[0], dtype=np.float32).tobytes()
+        node.embedding_model = model
+        node.token_count = embedding_client.estimate_tokens([node.text])
+        node.save()
+        return node
+
+    def _lock(self, key) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def build_document(self, document: KnowledgeDocument, model: str) -> Optional[KnowledgeSummary]:
+        """Build the section and file nodes of a document and return its file node."""
+        with self._lock(('document', document.pk)):
+            pages = list(document.pages.order_by('page'))
+            page_hashes = document.page_hashes or []
+            existing = {(node.level, node.first_page): node for node in document.summaries.all()}
+
+            sections = []
+            for i in range(0, len(pages), self.section_pages):
+                group = pages[i:i + self.section_pages]
+                sections.append(self._node(
+                    existing.get((Level.SECTION, group[0].page)),
+                    _hash(page_hashes[page.page] if page.page < len(page_hashes) else '' for page in group),
+                    model,
+                    lambda group=group: self.summarize('\n\n'.join(page.text for page in group), Level.SECTION),
+                    level=Level.SECTION, document=document,
+                    first_page=group[0].page, last_page=group[-1].page,
+                ))
+
+            file_node = None
+            if sections:
+                file_node = self._node(
+                    existing.get((Level.FILE, 0)),
+                    _hash(section.source_hash for section in sections),
+                    model,
+                    lambda: self.summarize(
+                        '\n\n'.join(f"Páginas {s.first_page + 1}-{s.last_page + 1}: {s.text}" for s in sections),
+                        Level.FILE,
+                    ),
+                    level=Level.FILE, document=document,
+                    first_page=0, last_page=sections[-1].last_page,
+                )
+            keep = [node.pk for node in sections] + ([file_node.pk] if file_node else [])
+            document.summaries.exclude(pk__in=keep).delete()
+            return file_node
+
+    def build_course(self, course_id: int, model: str = None) -> Optional[KnowledgeSummary]:
+        """Build the tree of every processed file of the course and its course node."""
+        model = model or (
+            Course.objects.filter(pk=course_id).values_list('embedding_model', flat=True).first()
+            or embedding_client.model
+        )
+        with self._lock(('course', course_id)):
+            files = (
+                KnowledgeBaseFile.objects
+                .filter(course_id=course_id, processed=True, document__isnull=False)
+                .select_related('document')
+                .order_by('name')
+            )
+            file_nodes = []
+            for knowledge_file in files:
+                node = self.build_document(knowledge_file.document, model)
+                if node:
+                    file_nodes.append((str(knowledge_file), node))
+
+            existing = KnowledgeSummary.objects.filter(course_id=course_id, level=Level.COURSE).first()
+            if not file_nodes:
+                if existing:
+                    existing.delete()
+                return None
+            return self._node(
+                existing,
+                _hash(f"{name}:{node.source_hash}" for name, node in file_nodes),
+                model,
+                lambda: self.summarize(
+                    '\n\n'.join(f"Documento «{name}»: {node.text}" for name, node in file_nodes),
+                    Level.COURSE,
+                ),
+                level=Level.COURSE, course_id=course_id,
+            )
+
+    def _run(self, course_id: int) -> None:
+        with self.lock:
+            self.pending.discard(course_id)
+        self.build_course(course_id)
+
+    def schedule(self, course_id: int) -> None:
+        """Rebuild the course's tree in the background once the current transaction commits."""
+        if not settings.KNOWLEDGE_SUMMARIES_ENABLED:
+            return
+        with self.lock:
+            # A bulk import publishes many files: one pending rebuild covers them all
+            if course_id in self.pending:
+                return
+            self.pending.add(course_id)
+        transaction.on_commit(lambda: background.submit(self._run, course_id))
+
+
+# Global instance
+summary_builder = SummaryBuilder()
@@ -1,3 +1,594 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import OrderedDict
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+import openai
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from turing.llm_gateway import StubGateway, get_gateway, set_gateway
+from .answer_cache import SemanticAnswerCache
+from .bulk_import import create_import, fail_stale_imports
+from .cloning import clone_course
+from .direct_upload import SIGNING_SALT, DirectUploadError, finish_upload
+from .embedding_client import EmbeddingClient
+from .ingest import StorageUploadError, ingest_pdf
+from .models import (
+    AnswerCache, ChunkEmbedding, Course, DirectUploadClaim, Group, IndexSegment, KnowledgeBaseFile, KnowledgeChunk,
+    KnowledgeDocument, KnowledgeImport, KnowledgeImportItem, KnowledgeSummary, RetrievalProfile,
+)
+from .rag_utils import rag_processor
+from .reindex import ReindexProgress, missing_chunks, promote_vectors, reindex_document, switch_ready_courses
+from .segments import CourseIndex, course_index
+
+
+def make_pdf(*pages: str) -> bytes:
+    """A minimal PDF with one line of text per page."""
+    count = len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (' '.join(f"{4 + 2 * i} 0 R" for i in range(count)), count),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('latin-1')
+    pdf += ''.join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('latin-1')
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('latin-1')
+    return pdf
+
+
+def make_teacher(n='1'):
+    return get_user_model().objects.create_user(
+        email=f"t{n}@example.com", password='pw', name='Ana', last_name='Pérez',
+        cedula=n, university_code=n, user_group='g', role='Teacher',
+    )
+
+
+class FlakyGateway(StubGateway):
+    """Fails the first `failures` calls for each batch whose first text is in `failing`."""
+
+    def __init__(self, failing, failures):
+        super().__init__()
+        self.failing = failing
+        self.failures = failures
+        self.attempts = {}
+
+    def embed(self, texts, model=None, timeout=None, retries=None):
+        attempt = self.attempts[texts[0]] = self.attempts.get(texts[0], 0) + 1
+        if texts[0] in self.failing and attempt <= self.failures:
+            raise openai.APIConnectionError(request=httpx.Request('POST', 'http://llm.invalid/v1'))
+        return super().embed(texts, model=model)
+
+
+class EmbeddingClientTests(SimpleTestCase):
+    def embedding_client(self, gateway):
+        return EmbeddingClient(gateway=gateway, model='stub', concurrency=2, max_retries=2, backoff_base=0)
+
+    def test_transient_errors_are_retried(self):
+        gateway = FlakyGateway(failing={'b'}, failures=2)
+        results, errors = self.embedding_client(gateway).embed_batches([['a'], ['b']])
+        self.assertEqual(errors, {})
+        self.assertEqual(results, [StubGateway().embed(['a']), StubGateway().embed(['b'])])
+        self.assertEqual(gateway.attempts, {'a': 1, 'b': 3})
+
+    def test_batch_failing_after_all_retries_does_not_fail_the_others(self):
+        gateway = FlakyGateway(failing={'b'}, failures=3)
+        results, errors = self.embedding_client(gateway).embed_batches([['a'], ['b'], ['c']])
+        self.assertEqual(list(errors), [1])
+        self.assertIsInstance(errors[1], openai.APIConnectionError)
+        self.assertIsNone(results[1])
+        self.assertIsNotNone(results[0])
+        self.assertIsNotNone(results[2])
+
+
+class KnowledgeTestCase(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        storage = override_settings(
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': self.media}},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            KNOWLEDGE_CACHE_DIR=self.media + '/cache',
+            KNOWLEDGE_SUMMARIES_ENABLED=False,
+        )
+        storage.enable()
+        self.addCleanup(storage.disable)
+        set_gateway(StubGateway())
+        self.addCleanup(set_gateway, None)
+        cache.clear()
+        # Decoded segments are cached by pk, and the rolled back ids are reused by the next test
+        index_caches = mock.patch.multiple(course_index, cache=OrderedDict(), cache_size=0, masks=OrderedDict(), partitions={})
+        index_caches.start()
+        self.addCleanup(index_caches.stop)
+
+        self.teacher = make_teacher()
+        self.course = Course.objects.create(name='Cálculo', owner=self.teacher, level='1')
+
+
+class IngestPdfTests(KnowledgeTestCase):
+    def upload(self, course, name, content):
+        return ingest_pdf(course, name, SimpleUploadedFile(f"{name}.pdf", content, content_type='application/pdf'))
+
+    def test_identical_pdf_reuses_stored_copy_and_document(self):
+        pdf = make_pdf('Derivadas y limites', 'Integrales por partes')
+        first, result = self.upload(self.course, 'Guía', pdf)
+        self.assertTrue(result['success'])
+        self.assertFalse(result.get('stored_copy'))
+
+        other = Course.objects.create(name='Física', owner=self.teacher, level='1')
+        copy, result = self.upload(other, 'Guía', pdf)
+        self.assertTrue(result['stored_copy'])
+        self.assertTrue(result['deduplicated'])
+        self.assertEqual(copy.file.name, first.file.name)
+        self.assertEqual(copy.document_id, first.document_id)
+        self.assertEqual(KnowledgeDocument.objects.count(), 1)
+
+    def test_other_chunking_reuses_stored_copy_only(self):
+        pdf = make_pdf('Derivadas y limites')
+        first, _ = self.upload(self.course, 'Guía', pdf)
+
+        other = Course.objects.create(name='Física', owner=self.teacher, level='1')
+        RetrievalProfile.objects.create(course=other, chunk_size=600, chunk_overlap=50)
+        copy, result = self.upload(other, 'Guía', pdf)
+        self.assertTrue(result['success'])
+        self.assertFalse(result.get('stored_copy'))
+        self.assertFalse(result.get('deduplicated'))
+        self.assertEqual(copy.file.name, first.file.name)
+        self.assertNotEqual(copy.document_id, first.document_id)
+        self.assertEqual(copy.document.chunk_size, 600)
+
+
+class IngestNewVersionTests(KnowledgeTestCase):
+    def upload(self, content):
+        return ingest_pdf(self.course, 'Guía', SimpleUploadedFile('guia.pdf', content, content_type='application/pdf'))
+
+    def failing_storage(self):
+        return mock.patch.object(FileSystemStorage, 'save', side_effect=OSError("Almacenamiento caído"))
+
+    def assert_nothing_searchable(self):
+        segments = IndexSegment.objects.filter(course=self.course)
+        self.assertTrue(segments.exists())
+        for segment in segments:
+            self.assertEqual(sorted(segment.tombstones), sorted(segment.documents))
+
+    def test_previous_pdf_is_deleted_after_the_new_one_is_stored(self):
+        first, _ = self.upload(make_pdf('Primera version'))
+        old_name = first.file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            second, result = self.upload(make_pdf('Segunda version'))
+        self.assertTrue(result['success'])
+        self.assertEqual(second.pk, first.pk)
+        self.assertNotEqual(second.file.name, old_name)
+        self.assertTrue(second.file.storage.exists(second.file.name))
+        self.assertFalse(second.file.storage.exists(old_name))
+
+    def test_failed_upload_keeps_the_previous_version(self):
+        first, _ = self.upload(make_pdf('Primera version'))
+        with self.captureOnCommitCallbacks(execute=True), self.failing_storage():
+            with self.assertRaises(StorageUploadError):
+                self.upload(make_pdf('Segunda version'))
+
+        first.refresh_from_db()
+        self.assertTrue(first.file.storage.exists(first.file.name))
+        self.assertFalse(first.processed)
+        self.assertEqual(rag_processor.live_documents(self.course.pk), set())
+        self.assert_nothing_searchable()
+
+    def test_unchanged_pages_are_not_embedded_again(self):
+        self.upload(make_pdf('Limites laterales', 'Regla de la cadena', 'Integrales por partes'))
+        embedded = len(get_gateway().calls)
+        _, result = self.upload(make_pdf('Limites laterales', 'Regla del producto', 'Integrales por partes'))
+
+        self.assertTrue(result['success'])
+        self.assertEqual((result['pages_total'], result['pages_skipped']), (3, 2))
+        self.assertEqual(result['chunks_embedded'], 1)
+        self.assertEqual(get_gateway().calls[embedded:], [('embed', ['Regla del producto'])])
+        self.assertEqual(
+            sorted(rag_processor.chunk_texts(KnowledgeChunk.objects.values_list('pk', flat=True)).values()),
+            ['Integrales por partes', 'Limites laterales', 'Regla del producto'],
+        )
+
+    def test_failed_new_upload_is_unpublished(self):
+        with self.failing_storage(), self.assertRaises(StorageUploadError):
+            self.upload(make_pdf('Primera version'))
+
+        self.assertFalse(KnowledgeBaseFile.objects.exists())
+        self.assert_nothing_searchable()
+
+
+class FinishUploadTests(KnowledgeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.field = KnowledgeBaseFile._meta.get_field('file')
+        self.name = self.field.storage.save('knowledge_base/guia-1a2b3c4d.pdf', ContentFile(make_pdf('Derivadas')))
+        self.token = signing.dumps(
+            {'name': self.name, 'filename': 'guia.pdf', 'purpose': 'knowledge_base',
+             'user': self.teacher.pk, 'course': self.course.pk},
+            salt=SIGNING_SALT,
+        )
+
+    def finish(self):
+        return finish_upload(self.field, self.token, 'knowledge_base', self.teacher, self.course.pk)
+
+    def test_token_is_single_use(self):
+        self.assertEqual(self.finish()['name'], self.name)
+        with self.assertRaises(DirectUploadError):
+            self.finish()
+
+    def test_token_is_single_use_across_processes(self):
+        self.finish()
+        cache.clear()  # Another process: only the database is shared
+        with self.assertRaises(DirectUploadError):
+            self.finish()
+
+    def test_expired_claims_are_removed(self):
+        DirectUploadClaim.objects.create(name='knowledge_base/vieja.pdf')
+        DirectUploadClaim.objects.update(claimed_at=timezone.now() - timedelta(days=1))
+        self.finish()
+        self.assertEqual(list(DirectUploadClaim.objects.values_list('name', flat=True)), [self.name])
+
+    def test_replay_after_row_exists_is_rejected(self):
+        self.finish()
+        KnowledgeBaseFile.objects.create(course=self.course, name='Guía', file=self.name)
+        cache.clear()  # Another process: only the row is shared
+        with self.assertRaises(DirectUploadError):
+            self.finish()
+
+    def test_token_of_other_course_is_rejected(self):
+        other = Course.objects.create(name='Física', owner=self.teacher, level='1')
+        with self.assertRaises(DirectUploadError):
+            finish_upload(self.field, self.token, 'knowledge_base', self.teacher, other.pk)
+
+
+class SemanticAnswerCacheTests(KnowledgeTestCase):
+    def setUp(self):
+        super().setUp()
+        AnswerCache.objects.create(course=self.course, enabled=True)
+        self.document = KnowledgeDocument.objects.create(sha256='a' * 64, processed=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            KnowledgeBaseFile.objects.create(
+                course=self.course, name='Guía', file='guia.pdf', processed=True, document=self.document
+            )
+        self.answers = SemanticAnswerCache()
+        self.embedding = ('stub', np.ones(4, dtype=np.float32) / 2)
+
+    def probe(self, system_prompt='Eres un asistente.'):
+        return self.answers.probe(self.course.pk, None, system_prompt, '¿Qué es una derivada?', self.embedding)
+
+    def test_same_question_hits(self):
+        probe = self.probe()
+        self.assertIsNone(probe.answer)
+        self.answers.store(probe, 'La tasa de cambio.')
+        self.assertEqual(self.probe().answer, 'La tasa de cambio.')
+
+    def test_changed_prompt_misses(self):
+        self.answers.store(self.probe(), 'La tasa de cambio.')
+        self.assertIsNone(self.probe('Responde en inglés.').answer)
+
+    def test_document_updated_in_place_misses(self):
+        self.answers.store(self.probe(), 'La tasa de cambio.')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.document.sha256 = 'b' * 64
+            self.document.save(update_fields=['sha256'])
+        self.assertIsNone(self.probe().answer)
+
+    def test_new_file_misses(self):
+        self.answers.store(self.probe(), 'La tasa de cambio.')
+        with self.captureOnCommitCallbacks(execute=True):
+            KnowledgeBaseFile.objects.create(
+                course=self.course, name='Taller', file='taller.pdf', processed=True,
+                document=KnowledgeDocument.objects.create(sha256='c' * 64, processed=True),
+            )
+        self.assertIsNone(self.probe().answer)
+
+    def test_group_scope_change_invalidates_live_documents(self):
+        group = Group.objects.create(course=self.course, name='G1', schedule='L 8-10', scoped_knowledge=True)
+        self.assertEqual(rag_processor.live_documents(self.course.pk, group), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            group.knowledge_files.set(KnowledgeBaseFile.objects.filter(course=self.course))
+        self.assertEqual(rag_processor.live_documents(self.course.pk, group), {self.document.pk})
+
+    def test_scope_change_in_another_process_is_seen(self):
+        self.answers.store(self.probe(), 'La tasa de cambio.')
+        self.assertEqual(rag_processor.live_documents(self.course.pk), {self.document.pk})
+        # Another process unpublishes the file: its signals leave this process's cache alone
+        KnowledgeBaseFile.objects.filter(course=self.course).update(processed=False)
+        self.assertEqual(rag_processor.live_documents(self.course.pk), {self.document.pk})
+        rag_processor.invalidate_scope(self.course.pk)
+
+        self.assertEqual(rag_processor.live_documents(self.course.pk), set())
+        self.assertIsNone(self.probe().answer)
+
+
+class SummaryRetrievalTests(KnowledgeTestCase):
+    def setUp(self):
+        super().setUp()
+        file_obj, _ = ingest_pdf(self.course, 'Guía', SimpleUploadedFile('guia.pdf', make_pdf('Regla de la cadena')))
+        self.model, _ = rag_processor.embed_query('x', self.course.pk)
+        self.summary = KnowledgeSummary.objects.create(
+            level=KnowledgeSummary.Level.FILE, document=file_obj.document, text='Resumen de la guía',
+            source_hash='a' * 40, embedding_model=self.model,
+        )
+
+    def search(self, query, summary_vector):
+        self.summary.vector = summary_vector.astype(np.float32).tobytes()
+        self.summary.save()
+        _, vector = rag_processor.embed_query(query, self.course.pk)
+        return [text for text, _ in rag_processor.find_relevant_chunks(query, self.course.pk, query_embedding=(self.model, vector))]
+
+    def test_specific_query_still_returns_chunks(self):
+        # The summary matches the query exactly, yet its detail is in the chunk
+        _, vector = rag_processor.embed_query('¿Cómo se deriva sen(x²)?', self.course.pk)
+        texts = self.search('¿Cómo se deriva sen(x²)?', vector)
+        self.assertIn('Regla de la cadena', ' '.join(texts))
+
+    @override_settings(KNOWLEDGE_SUMMARY_MARGIN=1.0)
+    def test_summary_within_margin_is_left_out(self):
+        _, vector = rag_processor.embed_query('¿De qué trata la guía?', self.course.pk)
+        texts = self.search('¿De qué trata la guía?', vector)
+        self.assertNotIn('Resumen de la guía', texts)
+        self.assertTrue(texts)
+
+    @override_settings(KNOWLEDGE_SUMMARY_MARGIN=0.0)
+    def test_summary_leads_the_chunks(self):
+        _, vector = rag_processor.embed_query('¿De qué trata la guía?', self.course.pk)
+        texts = self.search('¿De qué trata la guía?', vector)
+        self.assertEqual(texts[0], 'Resumen de la guía')
+        self.assertGreater(len(texts), 1)
+
+
+class ReindexTests(KnowledgeTestCase):
+    model = 'text-embedding-nuevo'
+
+    def setUp(self):
+        super().setUp()
+        file_obj, _ = ingest_pdf(
+            self.course, 'Guía',
+            SimpleUploadedFile('guia.pdf', make_pdf('Limites laterales', 'Regla de la cadena', 'Integrales por partes')),
+        )
+        self.document = file_obj.document_id
+        self.chunks = KnowledgeChunk.objects.filter(document_id=self.document).count()
+        self.assertGreater(self.chunks, 1)
+        self.progress = ReindexProgress(self.chunks)
+
+    def reindex(self):
+        reindex_document(self.document, self.model, self.progress, batch_size=1)
+
+    def search(self):
+        return rag_processor.find_relevant_chunks('Regla de la cadena', self.course.pk, summaries=False)
+
+    def test_interrupted_run_resumes_with_the_missing_chunks(self):
+        embed_batches = rag_processor.embedding_client.embed_batches
+
+        def first_batch_fails(batches, model=None):
+            results, errors = embed_batches(batches, model=model)
+            return [None, *results[1:]], {0: RuntimeError('cuota agotada')}
+
+        with mock.patch.object(rag_processor.embedding_client, 'embed_batches', side_effect=first_batch_fails):
+            with self.assertRaises(RuntimeError):
+                self.reindex()
+        self.assertEqual(missing_chunks(self.model, [self.document]).count(), 1)
+        # The course keeps answering from its complete old index
+        self.assertEqual(switch_ready_courses(self.model, [self.course.pk]), [])
+        self.assertEqual(rag_processor.course_embedding_model(self.course.pk), settings.EMBEDDING_MODEL)
+        self.assertTrue(self.search())
+
+        self.reindex()
+        self.assertEqual(self.progress.chunks_done, self.chunks)
+        self.assertEqual(ChunkEmbedding.objects.filter(model=self.model).count(), self.chunks)
+
+    def test_course_switches_once_complete(self):
+        self.reindex()
+        self.assertEqual(switch_ready_courses(self.model, [self.course.pk]), [self.course.pk])
+        self.assertEqual(rag_processor.course_embedding_model(self.course.pk), self.model)
+        # Read from the staged vectors until they are promoted
+        self.assertEqual(self.search()[0][0], 'Regla de la cadena')
+
+        self.assertEqual(promote_vectors(self.model), self.chunks)
+        self.assertFalse(ChunkEmbedding.objects.exists())
+        self.assertEqual(
+            set(KnowledgeChunk.objects.filter(document_id=self.document).values_list('embedding_model', flat=True)),
+            {self.model},
+        )
+        self.assertEqual(self.search()[0][0], 'Regla de la cadena')
+
+
+class CloneCourseTests(KnowledgeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file, _ = self.upload(self.course, make_pdf('Regla de la cadena'))
+        self.group = Group.objects.create(course=self.course, name='G1', schedule='L 8-10', scoped_knowledge=True)
+        self.group.knowledge_files.add(self.file)
+        self.clone = clone_course(self.course, self.teacher, name='Cálculo 2027-1')
+        self.copy = self.clone.knowledge_files.get()
+
+    def upload(self, course, content):
+        return ingest_pdf(course, 'Guía', SimpleUploadedFile('guia.pdf', content, content_type='application/pdf'))
+
+    def search(self, course, query, group=None):
+        return [text for text, _ in rag_processor.find_relevant_chunks(query, course.pk, group=group, summaries=False)]
+
+    def test_clone_is_searchable_without_embedding_anything(self):
+        embedded = len(get_gateway().calls)
+        self.assertEqual(self.search(self.clone, 'Regla de la cadena'), ['Regla de la cadena'])
+        self.assertEqual(get_gateway().calls[embedded:], [('embed', ['Regla de la cadena'])])
+        self.assertEqual((self.copy.document_id, self.copy.file.name), (self.file.document_id, self.file.file.name))
+
+    def test_group_scope_points_at_the_copied_files(self):
+        group = self.clone.groups.get()
+        self.assertTrue(group.scoped_knowledge)
+        self.assertEqual(list(group.knowledge_files.all()), [self.copy])
+        self.assertEqual(self.search(self.clone, 'Regla de la cadena', group), ['Regla de la cadena'])
+
+    def test_new_version_in_the_clone_leaves_the_source_alone(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            copy, result = self.upload(self.clone, make_pdf('Series de Taylor'))
+        self.assertTrue(result['success'])
+        self.assertNotEqual(copy.document_id, self.file.document_id)
+
+        self.file.refresh_from_db()
+        self.assertTrue(self.file.file.storage.exists(self.file.file.name))
+        self.assertEqual(self.search(self.course, 'Regla de la cadena'), ['Regla de la cadena'])
+        self.assertEqual(self.search(self.clone, 'Series de Taylor'), ['Series de Taylor'])
+        self.assertNotIn('Regla de la cadena', self.search(self.clone, 'Regla de la cadena'))
+
+    def test_deleting_the_clone_keeps_the_source_files(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.clone.delete()
+        self.assertTrue(KnowledgeDocument.objects.filter(pk=self.file.document_id).exists())
+        self.assertTrue(self.file.file.storage.exists(self.file.file.name))
+        self.assertEqual(self.search(self.course, 'Regla de la cadena'), ['Regla de la cadena'])
+
+
+class CourseIndexTests(KnowledgeTestCase):
+    model = 'stub'
+
+    def setUp(self):
+        super().setUp()
+        self.index = CourseIndex(max_segments=8, merge_factor=4)
+        rng = np.random.default_rng(0)
+        self.documents = []
+        for n in range(3):
+            document = KnowledgeDocument.objects.create(sha256=str(n) * 64, processed=True)
+            for ordinal in range(4):
+                vector = rng.standard_normal(8).astype(np.float32)
+                KnowledgeChunk.objects.create(
+                    document=document, ordinal=ordinal, vector=vector.tobytes(), embedding_model=self.model
+                )
+            self.index.add_document(self.course.pk, document.pk, self.model, merge=False)
+            self.documents.append(document.pk)
+
+    def search(self, live):
+        query = np.ones(8, dtype=np.float32) / np.sqrt(8)
+        top, covered = self.index.search(self.course.pk, self.model, query, 20, set(live))
+        documents = set(
+            KnowledgeChunk.objects.filter(pk__in=[chunk_id for _, chunk_id in top]).values_list('document_id', flat=True)
+        )
+        return documents, covered
+
+    def test_each_document_is_a_segment(self):
+        self.assertEqual(IndexSegment.objects.filter(course=self.course).count(), 3)
+        self.assertEqual(self.search(self.documents), (set(self.documents), set(self.documents)))
+
+    def test_tombstoned_document_is_not_searched(self):
+        removed = self.documents[0]
+        self.index.remove_document(self.course.pk, removed)
+        documents, covered = self.search(self.documents)
+        self.assertNotIn(removed, documents)
+        self.assertNotIn(removed, covered)
+
+    def test_merge_drops_tombstoned_rows(self):
+        removed = self.documents[0]
+        self.index.remove_document(self.course.pk, removed)
+        self.index.merge(self.course.pk, self.model, force=True)
+
+        segment = IndexSegment.objects.get(course=self.course)
+        self.assertEqual(sorted(segment.documents), self.documents[1:])
+        self.assertEqual(segment.tombstones, [])
+        self.assertEqual(segment.rows, 8)
+        self.assertEqual(self.search(self.documents[1:]), (set(self.documents[1:]), set(self.documents[1:])))
+
+
+@override_settings(KNOWLEDGE_IMPORT_CONCURRENCY=2)
+class BulkImportTests(KnowledgeTestCase):
+    def setUp(self):
+        super().setUp()
+        # Background tasks are queued here and run one at a time by the test
+        self.tasks = []
+        patcher = mock.patch('courses.bulk_import.background.submit', side_effect=lambda fn, *args: self.tasks.append((fn, args)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_zip(self, **members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            for name, content in members.items():
+                zf.writestr(name, content)
+        return SimpleUploadedFile('apuntes.zip', buffer.getvalue(), content_type='application/zip')
+
+    def create(self, **members):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = create_import(self.course, self.teacher, self.make_zip(**members))
+        return job
+
+    def test_job_runs_each_pdf_as_its_own_task(self):
+        job = self.create(**{'uno.pdf': make_pdf("Limites"), 'dos.pdf': make_pdf("Derivadas"), 'notas.txt': b'x'})
+        self.assertEqual(KnowledgeImport.objects.get(pk=job.pk).status, KnowledgeImport.Status.RUNNING)
+        self.assertEqual(len(self.tasks), 2)
+        self.assertTrue(os.path.exists(job.archive_path))
+
+        runs = 0
+        while self.tasks:
+            fn, args = self.tasks.pop(0)
+            fn(*args)
+            runs += 1
+            # No task stays on a worker once its PDF is done
+            self.assertFalse(job.items.filter(status=KnowledgeImportItem.Status.PROCESSING).exists())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, KnowledgeImport.Status.DONE)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(set(job.items.values_list('status', flat=True)), {KnowledgeImportItem.Status.DONE})
+        self.assertEqual(KnowledgeBaseFile.objects.filter(course=self.course).count(), 2)
+        # One task per PDF plus the one that finds each chain empty
+        self.assertEqual(runs, 4)
+        self.assertFalse(os.path.exists(job.archive_path))
+
+    @override_settings(KNOWLEDGE_IMPORT_MAX_FILE_BYTES=10)
+    def test_oversized_pdf_fails_without_failing_the_job(self):
+        job = self.create(**{'grande.pdf': make_pdf("Integrales")})
+        while self.tasks:
+            fn, args = self.tasks.pop(0)
+            fn(*args)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, KnowledgeImport.Status.DONE)
+        self.assertEqual(job.items.get().status, KnowledgeImportItem.Status.FAILED)
+        self.assertFalse(KnowledgeBaseFile.objects.exists())
+
+    def test_stale_job_is_failed_and_its_archive_removed(self):
+        job = self.create(**{'uno.pdf': make_pdf("Limites"), 'dos.pdf': make_pdf("Derivadas")})
+        # The process restarted after the first PDF was claimed: its tasks are gone
+        fresh = self.create(**{'tres.pdf': make_pdf("Series")})
+        self.tasks.clear()
+        job.items.filter(pk=job.items.first().pk).update(status=KnowledgeImportItem.Status.PROCESSING)
+        KnowledgeImport.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(fail_stale_imports(self.course), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, KnowledgeImport.Status.FAILED)
+        self.assertEqual(set(job.items.values_list('status', flat=True)), {KnowledgeImportItem.Status.FAILED})
+        self.assertFalse(os.path.exists(job.archive_path))
+        self.assertEqual(KnowledgeImport.objects.get(pk=fresh.pk).status, KnowledgeImport.Status.RUNNING)
+        self.assertTrue(os.path.exists(fresh.archive_path))
+        self.addCleanup(os.remove, fresh.archive_path)
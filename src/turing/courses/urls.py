@@ -5,9 +5,16 @@ from .views import (
     StudentGroupDetailView,
 
     CoursePromptEditView,
+    RetrievalProfileEditView,
+    AnswerCacheEditView,
+    AnswerCachePurgeView,
     KnowledgeBaseView,
     KnowledgeBaseDeleteView,
     KnowledgeBaseReprocessView,
+    knowledge_base_upload_start,
+    knowledge_base_upload_complete,
+    knowledge_base_import,
+    knowledge_base_import_status,
 )
 
 from .views_proxy import tutoring_schedule_proxy
@@ -22,6 +29,12 @@ urlpatterns = [
 
     path('course/<int:pk>/prompt/', CoursePromptEditView.as_view(), name='prompt_edit'),
 
+    path('course/<int:pk>/retrieval/', RetrievalProfileEditView.as_view(), name='retrieval_profile'),
+
+    path('course/<int:pk>/answer-cache/', AnswerCacheEditView.as_view(), name='answer_cache'),
+
+    path('course/<int:pk>/answer-cache/purge/', AnswerCachePurgeView.as_view(), name='answer_cache_purge'),
+
     path('course/<int:pk>/knowledge/', KnowledgeBaseView.as_view(), name='knowledge_base'),
     
     path('course/<int:course_pk>/knowledge/<int:file_pk>/delete/', 
@@ -30,6 +43,18 @@ urlpatterns = [
     path('course/<int:course_pk>/knowledge/<int:file_pk>/reprocess/', 
          KnowledgeBaseReprocessView.as_view(), name='knowledge_base_reprocess'),
 
+    path('course/<int:pk>/knowledge/direct-upload/', 
+         knowledge_base_upload_start, name='knowledge_base_upload_start'),
+
+    path('course/<int:pk>/knowledge/direct-upload/complete/', 
+         knowledge_base_upload_complete, name='knowledge_base_upload_complete'),
+
+    path('course/<int:pk>/knowledge/import/', 
+         knowledge_base_import, name='knowledge_base_import'),
+
+    path('course/<int:pk>/knowledge/import/<int:import_pk>/', 
+         knowledge_base_import_status, name='knowledge_base_import_status'),
+
     path("course/<int:pk>/tutoring-schedule-proxy/", 
          tutoring_schedule_proxy, name="tutoring_schedule_proxy"),
 ]
\ No newline at end of file
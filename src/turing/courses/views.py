@@ -4,12 +4,34 @@ from django.views.generic import ListView, DetailView, UpdateView, FormView, Red
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
 from django.core.exceptions import PermissionDenied
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.db import transaction
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
 
-from .models import Course, Group, Enrollment, CoursePrompt, KnowledgeBaseFile
+from .models import (
+    AnswerCache, Course, Group, Enrollment, CoursePrompt, KnowledgeBaseFile, KnowledgeImport, RetrievalProfile,
+)
 
-from .forms import CoursePromptForm, KnowledgeBaseFileForm
+from .forms import AnswerCacheForm, CoursePromptForm, KnowledgeBaseFileForm, KnowledgeImportForm, RetrievalProfileForm
 
+from .answer_cache import answer_cache
 from .rag_utils import rag_processor
+from .ingest import StorageUploadError, ingest_pdf
+from .bulk_import import ImportArchiveError, create_import, fail_stale_imports, import_progress
+from .direct_upload import DirectUploadError, direct_upload_enabled, finish_upload, start_upload
+from . import background
+
+
+def ingest_report_message(result):
+    """Resume cuánto trabajo se evitó al procesar un archivo."""
+    if result.get('deduplicated'):
+        return "El mismo PDF ya estaba procesado; se reutilizó sin nuevos embeddings."
+    return (
+        f"Páginas sin cambios: {result['pages_skipped']}/{result['pages_total']}; "
+        f"fragmentos reutilizados: {result['chunks_reused']}; "
+        f"nuevos embeddings: {result['chunks_embedded']}."
+    )
 
 
 class StudentsOnlyMixin(UserPassesTestMixin):
@@ -97,6 +119,91 @@ class CoursePromptEditView(LoginRequiredMixin, TeachersOnlyMixin, UpdateView):
         return super().form_valid(form)
 
 
+class RetrievalProfileEditView(LoginRequiredMixin, TeachersOnlyMixin, UpdateView):
+    """
+    Ajusta cómo busca el chatbot en la base de conocimiento del curso.
+    Cambiar la fragmentación reprocesa los archivos del curso en segundo plano.
+    """
+    model = RetrievalProfile
+    form_class = RetrievalProfileForm
+    template_name = 'retrieval_profile_edit.html'
+
+    def get_object(self, queryset=None):
+        course = get_object_or_404(Course, pk=self.kwargs['pk'])
+        if not (course.owner == self.request.user or Group.objects.filter(course=course, teacher=self.request.user).exists()):
+            raise PermissionDenied("No tienes permisos para configurar la búsqueda de este curso.")
+
+        obj, _ = RetrievalProfile.objects.get_or_create(course=course)
+        return obj
+
+    def get_success_url(self):
+        return reverse_lazy('courses:retrieval_profile', kwargs={'pk': self.object.course.pk})
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        if {'chunk_size', 'chunk_overlap'} & set(form.changed_data):
+            course_id = self.object.course_id
+            transaction.on_commit(lambda: background.submit(rag_processor.rechunk_course, course_id))
+            messages.success(
+                self.request,
+                "Perfil de búsqueda actualizado. Los archivos se están volviendo a fragmentar en segundo plano; "
+                "mientras tanto el chatbot sigue usando los fragmentos anteriores."
+            )
+        else:
+            messages.success(self.request, "Perfil de búsqueda actualizado.")
+        return response
+
+
+class AnswerCacheEditView(LoginRequiredMixin, TeachersOnlyMixin, UpdateView):
+    """
+    Activa y ajusta la caché semántica de respuestas del curso y muestra su
+    tasa de aciertos.
+    """
+    model = AnswerCache
+    form_class = AnswerCacheForm
+    template_name = 'answer_cache_edit.html'
+
+    def get_object(self, queryset=None):
+        course = get_object_or_404(Course, pk=self.kwargs['pk'])
+        if not (course.owner == self.request.user or Group.objects.filter(course=course, teacher=self.request.user).exists()):
+            raise PermissionDenied("No tienes permisos para configurar la caché de este curso.")
+
+        obj, _ = AnswerCache.objects.get_or_create(course=course)
+        return obj
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['entries'] = self.object.course.cached_answers.count()
+        context['hit_rate'] = round(self.object.hit_rate * 100, 1)
+        return context
+
+    def get_success_url(self):
+        return reverse_lazy('courses:answer_cache', kwargs={'pk': self.object.course.pk})
+
+    def form_valid(self, form):
+        # Sin pisar los contadores, que el chat incrementa mientras tanto
+        self.object = form.save(commit=False)
+        self.object.save(update_fields=[*form.Meta.fields, 'updated_at'])
+        messages.success(self.request, "Caché de respuestas actualizada.")
+        return redirect(self.get_success_url())
+
+
+class AnswerCachePurgeView(LoginRequiredMixin, TeachersOnlyMixin, RedirectView):
+    """Borra todas las respuestas guardadas del curso (por ejemplo, tras corregir el material)."""
+
+    def get_redirect_url(self, *args, **kwargs):
+        return reverse_lazy('courses:answer_cache', kwargs={'pk': kwargs['pk']})
+
+    def post(self, request, *args, **kwargs):
+        course = get_object_or_404(Course, pk=kwargs['pk'])
+        if not (course.owner == request.user or Group.objects.filter(course=course, teacher=request.user).exists()):
+            raise PermissionDenied("No tienes permisos para vaciar la caché de este curso.")
+
+        deleted = answer_cache.purge(course.pk)
+        messages.success(request, f"Se eliminaron {deleted} respuestas de la caché.")
+        return super().post(request, *args, **kwargs)
+
+
 class KnowledgeBaseView(LoginRequiredMixin, TeachersOnlyMixin, FormView):
     template_name = 'knowledge_base.html'
     form_class = KnowledgeBaseFileForm
@@ -111,31 +218,42 @@ class KnowledgeBaseView(LoginRequiredMixin, TeachersOnlyMixin, FormView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['course'] = self.course
-        context['files'] = KnowledgeBaseFile.objects.filter(course=self.course)
+        # Solo las columnas que muestra la tabla
+        context['files'] = KnowledgeBaseFile.objects.filter(course=self.course).only(
+            'id', 'name', 'file', 'uploaded_at', 'processed', 'processing_error', 'chunks_count'
+        )
         context['active_page'] = 'knowledge_base'
+        context['direct_upload'] = direct_upload_enabled()
+        context['import_form'] = KnowledgeImportForm()
+        fail_stale_imports(self.course)
+        context['active_imports'] = KnowledgeImport.objects.filter(
+            course=self.course,
+            status__in=[KnowledgeImport.Status.PENDING, KnowledgeImport.Status.RUNNING]
+        )
         return context
 
     def form_valid(self, form):
-        file_obj = form.save(commit=False)
-        file_obj.course = self.course
+        upload = form.cleaned_data['file']
+        name = form.cleaned_data['name'] or upload.name
         
-        if not file_obj.name and file_obj.file:
-            file_obj.name = file_obj.file.name
+        try:
+            file_obj, result = ingest_pdf(self.course, name, upload)
+        except StorageUploadError as e:
+            messages.error(self.request, f"No se pudo guardar el PDF en el almacenamiento: {e}")
+            return redirect(self.get_success_url())
         
-        file_obj.save()
-        messages.info(self.request, "Archivo subido. El procesamiento para la base de conocimiento ha comenzado en segundo plano.")
+        if result.get('stored_copy') and result.get('deduplicated'):
+            messages.success(
+                self.request,
+                f"Este PDF ya estaba procesado: se reutilizaron sus {result['chunks_count']} fragmentos sin generar nuevos embeddings."
+            )
+            return redirect(self.get_success_url())
         
-        try:
-            result = rag_processor.process_pdf_file(file_obj)
-            if result['success']:
-                messages.success(self.request, f"PDF procesado exitosamente: {result['chunks_count']} fragmentos creados.")
-            else:
-                messages.warning(self.request, f"PDF subido, pero hubo un error al procesarlo: {result['error']}")
-        except Exception as e:
-            file_obj.processing_error = str(e)
-            file_obj.processed = False
-            file_obj.save()
-            messages.error(self.request, f"Ocurrió un error inesperado durante el procesamiento del PDF: {e}")
+        messages.info(self.request, "Archivo subido. El procesamiento para la base de conocimiento ha comenzado en segundo plano.")
+        if result['success']:
+            messages.success(self.request, f"PDF procesado exitosamente: {result['chunks_count']} fragmentos. {ingest_report_message(result)}")
+        else:
+            messages.warning(self.request, f"PDF subido, pero hubo un error al procesarlo: {result['error']}")
         
         return redirect(self.get_success_url())
 
@@ -179,7 +297,7 @@ class KnowledgeBaseReprocessView(LoginRequiredMixin, TeachersOnlyMixin, Redirect
             if result['success']:
                 messages.success(
                     request, 
-                    f"Archivo reprocesado exitosamente. {result['chunks_count']} fragmentos de texto creados."
+                    f"Archivo reprocesado exitosamente. {result['chunks_count']} fragmentos de texto. {ingest_report_message(result)}"
                 )
             else:
                 messages.error(request, f"Error al reprocesar el archivo: {result['error']}")
@@ -187,4 +305,95 @@ class KnowledgeBaseReprocessView(LoginRequiredMixin, TeachersOnlyMixin, Redirect
         except Exception as e:
             messages.error(request, f"Error al reprocesar el archivo: {str(e)}")
         
-        return super().post(request, *args, **kwargs)
\ No newline at end of file
+        return super().post(request, *args, **kwargs)
+
+def _managed_course(user, pk):
+    """Curso que el profesor puede gestionar (dueño o profesor de algún grupo)."""
+    course = get_object_or_404(Course, pk=pk)
+    if not (course.owner == user or Group.objects.filter(course=course, teacher=user).exists()):
+        raise PermissionDenied("No tienes permisos para gestionar la base de conocimiento de este curso.")
+    return course
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'Teacher')
+@require_POST
+def knowledge_base_upload_start(request, pk):
+    """Entrega una URL prefirmada para subir el PDF directamente al almacenamiento."""
+    course = _managed_course(request.user, pk)
+    file_obj = KnowledgeBaseFile(course=course)
+    try:
+        upload = start_upload(
+            file_obj.file, file_obj, request.POST.get('filename', ''),
+            'knowledge_base', request.user, course.pk
+        )
+    except DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(upload)
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'Teacher')
+@require_POST
+def knowledge_base_upload_complete(request, pk):
+    """
+    Se llama cuando el navegador terminó de subir el PDF al bucket: crea el
+    registro y lanza el procesamiento en segundo plano. El worker web nunca
+    recibe los bytes del archivo.
+    """
+    course = _managed_course(request.user, pk)
+    field = KnowledgeBaseFile._meta.get_field('file')
+    try:
+        upload = finish_upload(field, request.POST.get('token', ''), 'knowledge_base', request.user, course.pk)
+    except DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    name = request.POST.get('name') or upload['filename']
+    # Igual que en el formulario: mismo nombre en el curso = nueva versión
+    file_obj = KnowledgeBaseFile.objects.filter(course=course, name=name).first()
+    if file_obj:
+        file_obj.release_file()
+    else:
+        file_obj = KnowledgeBaseFile(course=course, name=name)
+    file_obj.file = upload['name']
+    file_obj.processing_error = ""
+    file_obj.save()
+    
+    background.submit(rag_processor.process_pdf_file, file_obj)
+    messages.info(request, "Archivo subido. El procesamiento para la base de conocimiento ha comenzado en segundo plano.")
+    return JsonResponse({
+        'ok': True,
+        'file_id': file_obj.pk,
+        'redirect': str(reverse_lazy('courses:knowledge_base', kwargs={'pk': course.pk})),
+    })
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'Teacher')
+@require_POST
+def knowledge_base_import(request, pk):
+    """Recibe un zip con PDFs y los procesa en paralelo en segundo plano."""
+    course = _managed_course(request.user, pk)
+    form = KnowledgeImportForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Selecciona un archivo zip.'}, status=400)
+    
+    try:
+        job = create_import(course, request.user, form.cleaned_data['archive'])
+    except ImportArchiveError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'import_id': job.pk,
+        'status_url': str(reverse_lazy('courses:knowledge_base_import_status', kwargs={'pk': course.pk, 'import_pk': job.pk})),
+    }, status=202)
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'Teacher')
+def knowledge_base_import_status(request, pk, import_pk):
+    """Avance general y por archivo de una carga masiva (consultado periódicamente)."""
+    course = _managed_course(request.user, pk)
+    fail_stale_imports(course)
+    job = get_object_or_404(KnowledgeImport, pk=import_pk, course=course)
+    return JsonResponse(import_progress(job))
@@ -63,7 +63,9 @@
             isPolling: false,
             isSending: false,
             processedMessageIds: new Set(),
-            pendingUserMessage: null
+            pendingUserMessage: null,
+            deferredMessages: [],
+            events: null
         };
 
         (function initLastId() {
@@ -121,6 +123,58 @@
             return div;
         }
 
+        function parseSSE(frame) {
+            let event = 'message';
+            const data = [];
+            frame.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+            });
+            return { event, data: data.length ? JSON.parse(data.join('\n')) : null };
+        }
+
+        async function streamReply(response, userMsgDiv) {
+            const div = document.createElement('div');
+            div.className = 'bot';
+            div.innerHTML = `<strong>Assistant:</strong> <span class="bot-text"></span> <small></small>`;
+            const span = div.querySelector('.bot-text');
+            let text = '';
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let end;
+                while ((end = buffer.indexOf('\n\n')) !== -1) {
+                    const { event, data } = parseSSE(buffer.slice(0, end));
+                    buffer = buffer.slice(end + 2);
+
+                    if (event === 'user') {
+                        userMsgDiv.dataset.msgId = String(data.id);
+                        delete userMsgDiv.dataset.tempId;
+                        state.pendingUserMessage = null;
+                        markMessageProcessed(data.id);
+                    } else if (event === 'delta') {
+                        if (!div.parentNode) chatLog.appendChild(div);
+                        text += data.text;
+                        span.textContent = text;  // Texto plano mientras llega; el HTML final al terminar
+                        scrollToBottom();
+                    } else if (event === 'done') {
+                        if (!div.parentNode) chatLog.appendChild(div);
+                        div.dataset.msgId = String(data.id);
+                        span.innerHTML = data.html;
+                        div.querySelector('small').textContent = data.timestamp;
+                        markMessageProcessed(data.id);
+                        scrollToBottom();
+                        await typesetLatex(div);
+                    }
+                }
+            }
+        }
+
         function scrollToBottom() {
             requestAnimationFrame(() => {
                 chatLog.scrollTop = chatLog.scrollHeight;
@@ -133,7 +187,8 @@
             if (!text || state.isSending) return;
 
             const sessionId = chatForm.getAttribute('data-session-id');
-            const sendUrl = chatForm.getAttribute('data-send-url');
+            const streamUrl = chatForm.getAttribute('data-stream-url');
+            const sendUrl = streamUrl || chatForm.getAttribute('data-send-url');
             const csrfToken = chatForm.querySelector('[name=csrfmiddlewaretoken]')?.value || getCookie('csrftoken');
 
             state.isSending = true;
@@ -157,8 +212,12 @@
                 });
 
                 if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-                await response.json();
-                setTimeout(() => pollNewMessages(), 300);
+                if (streamUrl && response.body) {
+                    await streamReply(response, userMsgDiv);
+                } else {
+                    await response.json();
+                    setTimeout(() => pollNewMessages(), 300);
+                }
 
             } catch (error) {
                 const errorDiv = document.createElement('div');
@@ -171,9 +230,42 @@
                 state.isSending = false;
                 messageInput.disabled = false;
                 messageInput.focus();
+                await flushDeferred();
             }
         });
 
+        async function handleIncoming(msg) {
+            if (messageExists(msg.id)) return;
+
+            if (msg.sender === 'user') {
+                if (state.pendingUserMessage && state.pendingUserMessage.parentNode) {
+                    state.pendingUserMessage.dataset.msgId = String(msg.id);
+                    delete state.pendingUserMessage.dataset.tempId;
+                    state.pendingUserMessage.innerHTML = `<strong>User:</strong> ${msg.html} <small>${msg.timestamp}</small>`;
+                    state.pendingUserMessage = null;
+                } else {
+                    const userDiv = createUserMessage('', msg.id);
+                    userDiv.innerHTML = `<strong>User:</strong> ${msg.html} <small>${msg.timestamp}</small>`;
+                    chatLog.appendChild(userDiv);
+                }
+                markMessageProcessed(msg.id);
+                scrollToBottom();
+
+            } else if (msg.sender === 'bot') {
+                await createBotMessage(msg.html, msg.id, msg.timestamp);
+                markMessageProcessed(msg.id);
+                scrollToBottom();
+            }
+        }
+
+        async function flushDeferred() {
+            const deferred = state.deferredMessages;
+            state.deferredMessages = [];
+            for (const msg of deferred) {
+                await handleIncoming(msg);
+            }
+        }
+
         async function pollNewMessages() {
             if (state.isPolling) return;
             state.isPolling = true;
@@ -205,27 +297,7 @@
                 }
 
                 for (const msg of messages) {
-                    if (messageExists(msg.id)) continue;
-
-                    if (msg.sender === 'user') {
-                        if (state.pendingUserMessage && state.pendingUserMessage.parentNode) {
-                            state.pendingUserMessage.dataset.msgId = String(msg.id);
-                            delete state.pendingUserMessage.dataset.tempId;
-                            state.pendingUserMessage.innerHTML = `<strong>User:</strong> ${msg.html} <small>${msg.timestamp}</small>`;
-                            state.pendingUserMessage = null;
-                        } else {
-                            const userDiv = createUserMessage('', msg.id);
-                            userDiv.innerHTML = `<strong>User:</strong> ${msg.html} <small>${msg.timestamp}</small>`;
-                            chatLog.appendChild(userDiv);
-                        }
-                        markMessageProcessed(msg.id);
-                        scrollToBottom();
-
-                    } else if (msg.sender === 'bot') {
-                        await createBotMessage(msg.html, msg.id, msg.timestamp);
-                        markMessageProcessed(msg.id);
-                        scrollToBottom();
-                    }
+                    await handleIncoming(msg);
                 }
 
             } catch (error) {
@@ -234,9 +306,46 @@
             }
         }
 
-        let pollingTimer = setInterval(() => {
-            if (!state.isSending) pollNewMessages();
-        }, CHAT_POLL_MS);
+        let pollingTimer = null;
+
+        function startPolling() {
+            if (pollingTimer) return;
+            pollingTimer = setInterval(() => {
+                if (!state.isSending) pollNewMessages();
+            }, CHAT_POLL_MS);
+        }
+
+        // Con server-sent events el servidor avisa de cada mensaje nuevo; si no
+        // están disponibles (o la conexión se pierde del todo) se vuelve al polling
+        function startEvents() {
+            const eventsUrl = chatForm.getAttribute('data-events-url');
+            const sessionId = chatForm.getAttribute('data-session-id');
+            if (!eventsUrl || !sessionId || !window.EventSource) return false;
+
+            const params = new URLSearchParams({ session_id: sessionId });
+            if (state.lastMessageId) params.append('after_id', state.lastMessageId);
+            const source = new EventSource(`${eventsUrl}?${params.toString()}`);
+
+            source.addEventListener('message', async (e) => {
+                const msg = JSON.parse(e.data);
+                // Mientras se envía, el stream de la respuesta ya pinta estos mensajes
+                if (state.isSending) {
+                    state.deferredMessages.push(msg);
+                } else {
+                    await handleIncoming(msg);
+                }
+            });
+            source.addEventListener('error', () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    state.events = null;
+                    startPolling();
+                }
+            });
+            state.events = source;
+            return true;
+        }
+
+        if (!startEvents()) startPolling();
 
         document.querySelectorAll('.rename-chat').forEach((btn) => {
             btn.addEventListener('click', async (e) => {
@@ -278,6 +387,7 @@
 
         window.addEventListener('beforeunload', () => {
             if (pollingTimer) clearInterval(pollingTimer);
+            if (state.events) state.events.close();
         });
     }
 })();
\ No newline at end of file
@@ -0,0 +1,57 @@
+// Sube el PDF directamente al almacenamiento (URL prefirmada) y luego avisa al servidor.
+// Si la subida directa no está disponible, el formulario se envía de la forma tradicional.
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('form[data-direct-upload-start]').forEach(function (form) {
+        form.addEventListener('submit', async function (e) {
+            const fileInput = form.querySelector('input[type="file"]');
+            if (!fileInput || !fileInput.files.length || form.dataset.uploading) return;
+            e.preventDefault();
+
+            const file = fileInput.files[0];
+            const csrf = form.querySelector('[name="csrfmiddlewaretoken"]').value;
+            const submitButton = form.querySelector('[type="submit"]');
+            form.dataset.uploading = '1';
+            if (submitButton) submitButton.disabled = true;
+
+            function post(url, data) {
+                data.append('csrfmiddlewaretoken', csrf);
+                return fetch(url, { method: 'POST', body: data, credentials: 'same-origin' })
+                    .then(response => response.json().then(body => ({ ok: response.ok, body })));
+            }
+
+            function fallback() {
+                // Envío normal a través de Django
+                form.submit();
+            }
+
+            try {
+                const startData = new FormData();
+                startData.append('filename', file.name);
+                const start = await post(form.dataset.directUploadStart, startData);
+                if (!start.ok) return fallback();
+
+                const put = await fetch(start.body.url, {
+                    method: start.body.method,
+                    headers: start.body.headers,
+                    body: file,
+                });
+                if (!put.ok) return fallback();
+
+                const completeData = new FormData(form);
+                completeData.delete(fileInput.name);
+                completeData.delete('csrfmiddlewaretoken');
+                completeData.append('token', start.body.token);
+                const complete = await post(form.dataset.directUploadComplete, completeData);
+                if (!complete.ok) {
+                    alert(complete.body.error || 'No se pudo completar la subida.');
+                    delete form.dataset.uploading;
+                    if (submitButton) submitButton.disabled = false;
+                    return;
+                }
+                window.location.href = complete.body.redirect;
+            } catch (err) {
+                fallback();
+            }
+        });
+    });
+});
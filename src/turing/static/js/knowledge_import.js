@@ -0,0 +1,75 @@
+// Carga masiva de PDFs (zip): envía el archivo y muestra el avance consultando el servidor.
+document.addEventListener('DOMContentLoaded', function () {
+    const form = document.getElementById('knowledge-import-form');
+    const container = document.getElementById('knowledge-import-progress');
+    if (!form || !container) return;
+
+    const STATUS_LABELS = {
+        pending: 'Pendiente',
+        processing: 'Procesando',
+        running: 'En proceso',
+        done: 'Terminado',
+        failed: 'Fallido',
+    };
+
+    function render(box, data) {
+        const rows = data.items.map(item => {
+            let detail = item.status === 'processing' ? ` (${item.pages_done} páginas)` : '';
+            if (item.status === 'done') detail = ` (${item.chunks_count} fragmentos)`;
+            if (item.error) detail += ` — ${item.error}`;
+            const li = document.createElement('li');
+            li.textContent = `${item.name}: ${STATUS_LABELS[item.status] || item.status}${detail}`;
+            return li;
+        });
+        const title = document.createElement('p');
+        title.innerHTML = '<strong></strong>';
+        title.firstChild.textContent =
+            `${data.archive_name}: ${data.finished}/${data.total} archivos (${data.percent}%)` +
+            (data.failed ? `, ${data.failed} con error` : '');
+        const list = document.createElement('ul');
+        rows.forEach(li => list.appendChild(li));
+        box.replaceChildren(title, list);
+    }
+
+    function poll(box) {
+        fetch(box.dataset.statusUrl, { credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(data => {
+                render(box, data);
+                if (data.status === 'done' || data.status === 'failed') {
+                    // Recarga para mostrar los archivos nuevos en la tabla
+                    setTimeout(() => window.location.reload(), 1500);
+                } else {
+                    setTimeout(() => poll(box), 2000);
+                }
+            })
+            .catch(() => setTimeout(() => poll(box), 5000));
+    }
+
+    container.querySelectorAll('.import-progress').forEach(poll);
+
+    form.addEventListener('submit', function (e) {
+        e.preventDefault();
+        const button = form.querySelector('[type="submit"]');
+        button.disabled = true;
+        fetch(form.action, { method: 'POST', body: new FormData(form), credentials: 'same-origin' })
+            .then(response => response.json().then(body => ({ ok: response.ok, body })))
+            .then(({ ok, body }) => {
+                button.disabled = false;
+                if (!ok) {
+                    alert(body.error || 'No se pudo importar el zip.');
+                    return;
+                }
+                form.reset();
+                const box = document.createElement('div');
+                box.className = 'import-progress';
+                box.dataset.statusUrl = body.status_url;
+                container.appendChild(box);
+                poll(box);
+            })
+            .catch(() => {
+                button.disabled = false;
+                alert('No se pudo importar el zip.');
+            });
+    });
+});
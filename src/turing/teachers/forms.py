@@ -1,6 +1,6 @@
 from django import forms
 from .models import PromptConfig
-from courses.models import Group, TutoringSlot
+from courses.models import Course, Group, KnowledgeBaseFile, TutoringSlot
 
 class PromptForm(forms.ModelForm):
     class Meta:
@@ -33,3 +33,41 @@ class GroupForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'placeholder': 'Ej: Grupo 1, Cálculo Avanzado (Tarde)'}),
             'schedule': forms.TextInput(attrs={'placeholder': 'Ej: Lunes y Miércoles 14:00 - 16:00'}),
         }
+
+
+class GroupKnowledgeForm(forms.ModelForm):
+    """Selecciona los documentos de la base de conocimiento que usa el chatbot del grupo."""
+    class Meta:
+        model = Group
+        fields = ['scoped_knowledge', 'knowledge_files']
+        widgets = {
+            'knowledge_files': forms.CheckboxSelectMultiple,
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Solo los archivos del curso del grupo
+        self.fields['knowledge_files'].queryset = KnowledgeBaseFile.objects.filter(
+            course_id=self.instance.course_id
+        ).only('id', 'name', 'processed').order_by('name')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('scoped_knowledge') and not cleaned_data.get('knowledge_files'):
+            self.add_error('knowledge_files', 'Selecciona al menos un documento o desactiva el límite.')
+        return cleaned_data
+
+
+class CourseCloneForm(forms.ModelForm):
+    """Datos de la copia de una materia para un nuevo semestre."""
+    include_groups = forms.BooleanField(
+        required=False,
+        initial=True,
+        label="Copiar los grupos (sin estudiantes)"
+    )
+
+    class Meta:
+        model = Course
+        fields = ['name', 'description', 'level', 'schedule']
+        labels = {'level': 'Semestre'}
+        widgets = {'description': forms.Textarea(attrs={'rows': 3})}
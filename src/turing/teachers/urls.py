@@ -5,6 +5,7 @@ from .views import (
     TeacherDashboardView,
     CourseCreateView,
     CourseDeleteView,
+    CourseCloneView,
     ManageCourseView,
     
     # Vistas para la gestión de grupos y estudiantes
@@ -14,8 +15,11 @@ from .views import (
     # Vistas para la gestión de monitorías (actualizadas)
     TutoringScheduleListView,
     TutoringScheduleUploadView,
+    tutoring_schedule_upload_start,
+    tutoring_schedule_upload_complete,
     manage_tutoring_slots,
     GroupPromptEditView,
+    GroupKnowledgeScopeView,
 )
 
 app_name = 'teachers'
@@ -24,10 +28,15 @@ urlpatterns = [
     path('dashboard/', TeacherDashboardView.as_view(), name='dashboard'),
     path('courses/new/', CourseCreateView.as_view(), name='course_create'),
     path('courses/<int:pk>/delete/', CourseDeleteView.as_view(), name='course_delete'),
+    path('courses/<int:pk>/clone/', CourseCloneView.as_view(), name='course_clone'),
+    path('courses/<int:pk>/manage/', ManageCourseView.as_view(), name='manage_course'),
     path('courses/<int:course_pk>/groups/new/', GroupCreateView.as_view(), name='group_create'),
     path('groups/<int:group_pk>/students/', manage_group_enrollments, name='manage_enrollments'),
     path('groups/<int:group_pk>/prompt/', GroupPromptEditView.as_view(), name='group_prompt_edit'),
+    path('groups/<int:group_pk>/knowledge/', GroupKnowledgeScopeView.as_view(), name='group_knowledge_scope'),
     path('tutoring-schedules/', TutoringScheduleListView.as_view(), name='tutoring_schedules'),
     path('courses/<int:course_pk>/upload-schedule/', TutoringScheduleUploadView.as_view(), name='upload_schedule'),
+    path('courses/<int:course_pk>/upload-schedule/direct/', tutoring_schedule_upload_start, name='upload_schedule_start'),
+    path('courses/<int:course_pk>/upload-schedule/direct/complete/', tutoring_schedule_upload_complete, name='upload_schedule_complete'),
     path('groups/<int:group_pk>/manage-tutoring/', manage_tutoring_slots, name='manage_tutoring'),
 ]
\ No newline at end of file
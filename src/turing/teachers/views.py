@@ -10,11 +10,18 @@ from django.utils.translation import gettext_lazy as _
 from django.views.generic import CreateView, ListView, RedirectView, DetailView, UpdateView
 from django.forms import inlineformset_factory
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
 
 from courses.models import Course, Group, TutoringSchedule, TutoringSlot, Enrollment
 from users.models import CustomUser
 from courses.forms import CourseForm, TutoringScheduleForm
-from .forms import TutoringSlotForm, GroupForm
+from courses.direct_upload import DirectUploadError, direct_upload_enabled, finish_upload, start_upload
+from courses.rag_utils import rag_processor
+from courses.cloning import clone_course
+from courses import background
+from .forms import TutoringSlotForm, GroupForm, GroupKnowledgeForm, CourseCloneForm
 
 
 class TeachersOnlyMixin(UserPassesTestMixin):
@@ -74,6 +81,44 @@ class CourseCreateView(LoginRequiredMixin, TeachersOnlyMixin, CreateView):
         messages.success(self.request, f"Materia '{self.object.name}' creada. Ahora, crea el primer grupo.")
         return reverse('teachers:group_create', kwargs={'course_pk': self.object.pk})
 
+class CourseCloneView(LoginRequiredMixin, TeachersOnlyMixin, CreateView):
+    """
+    Copia una materia para un nuevo semestre: prompt, grupos y base de
+    conocimiento, que queda lista para consultar sin volver a procesar los PDFs.
+    Solo el 'owner' de la materia puede copiarla.
+    """
+    model = Course
+    form_class = CourseCloneForm
+    template_name = 'course_clone.html'
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        self.source = get_object_or_404(Course, pk=self.kwargs['pk'], owner=request.user)
+
+    def get_initial(self):
+        return {
+            'name': self.source.name,
+            'description': self.source.description,
+            'schedule': self.source.schedule,
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['source'] = self.source
+        context['files_count'] = self.source.knowledge_files.count()
+        context['groups_count'] = self.source.groups.count()
+        return context
+
+    def form_valid(self, form):
+        self.object = clone_course(
+            self.source,
+            self.request.user,
+            include_groups=form.cleaned_data['include_groups'],
+            **{name: form.cleaned_data[name] for name in form.Meta.fields}
+        )
+        messages.success(self.request, f"Materia '{self.object.name}' creada a partir de '{self.source.name}'.")
+        return redirect('teachers:dashboard')
+
 class GroupCreateView(LoginRequiredMixin, TeachersOnlyMixin, CreateView):
     """
     NUEVA VISTA: Para crear un nuevo grupo dentro de un curso existente.
@@ -209,6 +254,7 @@ class TutoringScheduleUploadView(LoginRequiredMixin, TeachersOnlyMixin, UpdateVi
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['course'] = self.course
+        context['direct_upload'] = direct_upload_enabled()
         return context
 
     def form_valid(self, form):
@@ -219,6 +265,50 @@ class TutoringScheduleUploadView(LoginRequiredMixin, TeachersOnlyMixin, UpdateVi
         return super().form_valid(form)
 
 
+def _schedule_course(user, course_pk):
+    course = get_object_or_404(Course, pk=course_pk)
+    if not Group.objects.filter(course=course, teacher=user).exists():
+        raise PermissionDenied("No tienes permiso para editar el horario de este curso.")
+    return course
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'Teacher')
+@require_POST
+def tutoring_schedule_upload_start(request, course_pk):
+    """Entrega una URL prefirmada para subir el horario directamente al almacenamiento."""
+    course = _schedule_course(request.user, course_pk)
+    schedule = TutoringSchedule(course=course)
+    try:
+        upload = start_upload(
+            schedule.file, schedule, request.POST.get('filename', ''),
+            'tutoring_schedule', request.user, course.pk
+        )
+    except DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(upload)
+
+
+@login_required
+@user_passes_test(lambda u: u.role == 'Teacher')
+@require_POST
+def tutoring_schedule_upload_complete(request, course_pk):
+    """Registra el horario una vez el navegador lo subió al bucket."""
+    course = _schedule_course(request.user, course_pk)
+    field = TutoringSchedule._meta.get_field('file')
+    try:
+        upload = finish_upload(field, request.POST.get('token', ''), 'tutoring_schedule', request.user, course.pk)
+    except DirectUploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    schedule, _ = TutoringSchedule.objects.get_or_create(course=course)
+    schedule.file = upload['name']  # save() borra el archivo anterior
+    schedule.updated_by = request.user
+    schedule.save()
+    messages.success(request, f"Horario de monitorías para el curso '{course.name}' actualizado correctamente.")
+    return JsonResponse({'ok': True, 'redirect': reverse('teachers:tutoring_schedules')})
+
+
 @login_required
 @user_passes_test(lambda u: u.role == 'Teacher')
 def manage_tutoring_slots(request, group_pk):
@@ -298,6 +388,34 @@ class GroupPromptEditView(LoginRequiredMixin, TeachersOnlyMixin, UpdateView):
     def get_success_url(self):
         return reverse('teachers:dashboard')
 
+class GroupKnowledgeScopeView(LoginRequiredMixin, TeachersOnlyMixin, UpdateView):
+    """Elige qué documentos de la base de conocimiento usa el chatbot de un grupo."""
+    model = Group
+    form_class = GroupKnowledgeForm
+    template_name = 'group_knowledge_scope.html'
+    pk_url_kwarg = 'group_pk'
+
+    def get_queryset(self):
+        return Group.objects.filter(teacher=self.request.user).select_related('course')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['group'] = self.object
+        context['course'] = self.object.course
+        return context
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        if self.object.scoped_knowledge:
+            # Precalcula las máscaras del nuevo alcance antes de la primera pregunta
+            group = self.object
+            transaction.on_commit(lambda: background.submit(rag_processor.warm_scope, group))
+        messages.success(self.request, f"Documentos del chatbot actualizados para {self.object.name}")
+        return response
+
+    def get_success_url(self):
+        return reverse('teachers:dashboard')
+
 class CourseDeleteView(LoginRequiredMixin, TeachersOnlyMixin, RedirectView):
     """
     Elimina un CURSO COMPLETO. Solo el 'owner' del curso puede hacerlo.
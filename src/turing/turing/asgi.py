@@ -3,6 +3,18 @@ ASGI config for turing project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serving it with an async server switches the chat to the async views, so a
+student waiting on the model does not hold a worker:
+
+    gunicorn turing.asgi:application -k uvicorn.workers.UvicornWorker
+
+Under ASGI the ORM runs in executor threads (sync_to_async) and every thread
+would keep its own persistent connection for CONN_MAX_AGE seconds; with the
+long-lived event streams that quickly exhausts the database's connection
+limit. Connections are therefore closed after each request here
+(DB_CONN_MAX_AGE=0); put a pooler such as Supabase's in front of the
+database to keep connecting cheap.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -12,5 +24,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'turing.settings')
+os.environ.setdefault('CHAT_ASYNC_VIEWS', 'True')
+os.environ['DB_CONN_MAX_AGE'] = '0'  # Forced: see above
 
 application = get_asgi_application()
@@ -0,0 +1,660 @@
+# turing/llm_gateway.py
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+from collections import Counter
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence
+
+import httpx
+import openai
+from django.conf import settings
+from django.utils.module_loading import import_string
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+# Kinds of the calls the current request joined instead of making; a request
+# sets a list here to collect them (chatbot.pipeline.Timings reports them)
+coalesced_calls: ContextVar[Optional[list]] = ContextVar('coalesced_calls', default=None)
+
+# Network errors, timeouts and 5xx responses mean the provider is struggling;
+# a 429 only means we are going too fast, so it is retried but does not trip the breaker
+PROVIDER_ERRORS = (
+    openai.APIConnectionError,  # Includes APITimeoutError
+    openai.InternalServerError,
+)
+RETRYABLE_ERRORS = PROVIDER_ERRORS + (openai.RateLimitError,)
+
+
+class CircuitOpenError(Exception):
+    """The provider failed repeatedly; calls fail fast until the breaker resets."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive provider failures and rejects
+    calls for `reset_timeout` seconds. Then a single trial call is let through:
+    success closes the circuit again, failure keeps it open for another period.
+    A trial that is interrupted (e.g. cancelled when the client goes away)
+    decides nothing: the next call becomes the trial.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def before_call(self) -> None:
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+                raise CircuitOpenError("El servicio de IA no está disponible en este momento.")
+            self.trial_running = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def record_interrupted(self) -> None:
+        with self.lock:
+            self.trial_running = False
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def flight_key(kind: str, model: str, payload, options: dict) -> str:
+    """
+    Hash identifying a request: same kind, model and options, and the same
+    messages (system prompt, history, question) or texts once whitespace is
+    normalized. Case is kept: it matters in code, identifiers and SQL.
+    """
+    data = json.dumps([kind, model, _normalize(payload), options], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class SharedStream:
+    """
+    One upstream stream read by every request that asked for it. Whichever
+    reader needs a piece nobody has fetched yet pulls it from upstream, so the
+    stream goes on while at least one reader is left; the last one to leave
+    early closes it. `on_finish` is called once upstream is exhausted.
+    """
+
+    def __init__(self, open_upstream: Callable[[], Iterator[str]], on_finish: Callable[['SharedStream'], None]):
+        self.open_upstream = open_upstream
+        self.on_finish = on_finish
+        self.upstream: Optional[Iterator[str]] = None
+        self.pieces: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.pulling = False
+        self.readers = 0
+        self.condition = threading.Condition()
+
+    def _pull(self) -> None:
+        piece, finished, error = None, False, None
+        try:
+            if self.upstream is None:
+                self.upstream = self.open_upstream()
+            piece = next(self.upstream)
+        except StopIteration:
+            finished = True
+        except Exception as e:
+            finished, error = True, e
+        with self.condition:
+            if piece is not None:
+                self.pieces.append(piece)
+            self.finished, self.error = finished, error
+            self.pulling = False
+            self.condition.notify_all()
+        if finished:
+            self.on_finish(self)
+
+    def read(self) -> Iterator[str]:
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.pieces) and not self.finished and self.pulling:
+                    self.condition.wait()
+                piece = self.pieces[index] if index < len(self.pieces) else None
+                if piece is None and self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                if piece is None:
+                    self.pulling = True
+            if piece is None:
+                self._pull()
+            else:
+                index += 1
+                yield piece
+
+
+class AsyncSharedStream:
+    """SharedStream for the async views: a task pulls upstream and readers wait on its pieces."""
+
+    def __init__(self, on_finish: Callable[['AsyncSharedStream'], None]):
+        self.on_finish = on_finish
+        self.pieces: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.readers = 0
+
+    def _publish(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def pull(self, upstream: AsyncIterator[str]) -> None:
+        try:
+            async for piece in upstream:
+                self.pieces.append(piece)
+                self._publish()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self.on_finish(self)
+            self._publish()
+            await upstream.aclose()
+
+    async def read(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            if index < len(self.pieces):
+                index += 1
+                yield self.pieces[index - 1]
+            elif self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self.changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that are in flight at the same time.
+
+    When a teacher tells a class to ask the bot about something, dozens of
+    requests with the same question (and so the same prompt, history and
+    context) arrive within a second. The first one calls the provider and the
+    rest wait for it and share its result, or its pieces for a stream, or its
+    error. Only requests already in flight are shared; nothing is kept once
+    the call ends: a finished call is forgotten as soon as it ends, even if
+    some of its readers have not read it yet. `coalesced` counts the requests
+    that did not call the provider, by kind (see LLMGateway.stats).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[str, Future] = {}
+        self.streams: Dict[str, SharedStream] = {}
+        self._async_calls = weakref.WeakKeyDictionary()
+        self._async_streams = weakref.WeakKeyDictionary()
+        self.coalesced = Counter()
+
+    def _joined(self, kind: str) -> None:
+        self.coalesced[kind] += 1
+        calls = coalesced_calls.get()
+        if calls is not None:
+            calls.append(kind)
+        logger.info("Coalesced %s request (%d so far)", kind, self.coalesced[kind])
+
+    def _forget_stream(self, key: str, shared: SharedStream) -> None:
+        # Later requests start a new call instead of joining a finished or abandoned one
+        with self.lock:
+            if self.streams.get(key) is shared:
+                del self.streams[key]
+
+    def do(self, kind: str, key: str, fn: Callable):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+            else:
+                self._joined(kind)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def stream(self, kind: str, key: str, open_upstream: Callable[[], Iterator[str]]) -> Iterator[str]:
+        with self.lock:
+            shared = self.streams.get(key)
+            if shared is None:
+                shared = self.streams[key] = SharedStream(
+                    open_upstream, lambda finished: self._forget_stream(key, finished)
+                )
+            else:
+                self._joined(kind)
+            shared.readers += 1
+        return self._read(key, shared)
+
+    def _read(self, key: str, shared: SharedStream) -> Iterator[str]:
+        try:
+            yield from shared.read()
+        finally:
+            with self.lock:
+                shared.readers -= 1
+                last = shared.readers == 0
+            if last and not shared.finished:
+                self._forget_stream(key, shared)
+                if shared.upstream is not None:
+                    shared.upstream.close()
+
+    def _loop_dict(self, dicts) -> dict:
+        # Tasks and events belong to one event loop
+        loop = asyncio.get_running_loop()
+        calls = dicts.get(loop)
+        if calls is None:
+            calls = dicts[loop] = {}
+        return calls
+
+    async def ado(self, kind: str, key: str, fn: Callable):
+        """Async `do`. The call runs in its own task, so a caller that goes away does not cancel it for the rest."""
+        calls = self._loop_dict(self._async_calls)
+        task = calls.get(key)
+        if task is None:
+            task = calls[key] = asyncio.ensure_future(fn())
+
+            def forget(done):
+                if calls.get(key) is done:
+                    del calls[key]
+                if not done.cancelled():
+                    done.exception()  # Retrieved, so an error nobody waited for is not reported as unhandled
+            task.add_done_callback(forget)
+        else:
+            self._joined(kind)
+        return await asyncio.shield(task)
+
+    def astream(self, kind: str, key: str, open_upstream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        streams = self._loop_dict(self._async_streams)
+        shared = streams.get(key)
+        if shared is None:
+            def forget(finished):
+                if streams.get(key) is finished:
+                    del streams[key]
+            shared = streams[key] = AsyncSharedStream(forget)
+            shared.task = asyncio.ensure_future(shared.pull(open_upstream()))
+        else:
+            self._joined(kind)
+        shared.readers += 1
+        return self._aread(streams, key, shared)
+
+    async def _aread(self, streams: dict, key: str, shared: AsyncSharedStream) -> AsyncIterator[str]:
+        try:
+            async for piece in shared.read():
+                yield piece
+        finally:
+            shared.readers -= 1
+            if shared.readers == 0 and not shared.finished:
+                if streams.get(key) is shared:
+                    del streams[key]
+                shared.task.cancel()
+
+
+class LLMGateway:
+    """
+    Process-wide access point to the OpenAI-compatible API.
+
+    One client, and so one pool of keep-alive (HTTP/2 when the `h2` package
+    is installed and LLM_HTTP2 is set) connections, is shared by every
+    request and thread. Each call gets a timeout, transient errors are retried
+    with exponential backoff and a circuit breaker fails fast while the
+    provider is down. Point OPENAI_BASE_URL at a local server, or
+    LLM_GATEWAY at another class (e.g. StubGateway), to run without the API.
+
+    The `a*` methods are the async counterparts used by the ASGI views. Their
+    client is kept per event loop (an async connection pool cannot be shared
+    between loops) and shares the breaker with the sync one.
+
+    With LLM_SINGLE_FLIGHT, identical requests in flight at the same time
+    share one provider call (see SingleFlight).
+    """
+
+    def __init__(self, client=None, timeout=None, max_retries=None, breaker=None, backoff_base=0.5,
+                 flights=None):
+        self._client = client
+        self._client_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.timeout = settings.LLM_TIMEOUT if timeout is None else timeout
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.breaker = breaker or CircuitBreaker(settings.LLM_CIRCUIT_FAILURES, settings.LLM_CIRCUIT_RESET)
+        self.backoff_base = backoff_base
+        self.flights = flights or SingleFlight()
+
+    def stats(self) -> dict:
+        """State of the breaker and requests coalesced so far (in this process), by kind."""
+        return {'circuit': self.breaker.state, 'coalesced': dict(self.flights.coalesced)}
+
+    @staticmethod
+    def _http2() -> bool:
+        if not settings.LLM_HTTP2:
+            return False
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _pool_options(self) -> dict:
+        return {
+            'http2': self._http2(),
+            'limits': httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+            ),
+            'timeout': httpx.Timeout(self.timeout, connect=settings.LLM_CONNECT_TIMEOUT),
+        }
+
+    def _client_options(self) -> dict:
+        return {
+            'api_key': settings.OPENAI_API_KEY,
+            'base_url': settings.OPENAI_BASE_URL or None,
+            'max_retries': 0,  # Retries are handled here, together with the breaker
+        }
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = OpenAI(http_client=httpx.Client(**self._pool_options()), **self._client_options())
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """Async client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(http_client=httpx.AsyncClient(**self._pool_options()), **self._client_options())
+            self._async_clients[loop] = client
+        return client
+
+    def _record(self, error: Exception) -> None:
+        if isinstance(error, PROVIDER_ERRORS):
+            self.breaker.record_failure()
+        else:
+            # A 429 means the provider answered; other errors (bad request,
+            # auth) are ours, not the provider's
+            self.breaker.record_success()
+
+    def _call(self, fn, retries: Optional[int] = None):
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = fn()
+            except Exception as e:
+                self._record(e)
+                if not isinstance(e, RETRYABLE_ERRORS) or attempt >= retries:
+                    raise
+                time.sleep(self.backoff_base * 2 ** attempt)
+                attempt += 1
+            except BaseException:
+                self.breaker.record_interrupted()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def _acall(self, fn, retries: Optional[int] = None):
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await fn()
+            except Exception as e:
+                self._record(e)
+                if not isinstance(e, RETRYABLE_ERRORS) or attempt >= retries:
+                    raise
+                await asyncio.sleep(self.backoff_base * 2 ** attempt)
+                attempt += 1
+            except BaseException:
+                # CancelledError: without this a cancelled trial would keep the circuit open for good
+                self.breaker.record_interrupted()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _coalesce(self, kind: str, model: str, payload, options: dict, fn: Callable):
+        if not settings.LLM_SINGLE_FLIGHT:
+            return fn()
+        return self.flights.do(kind, flight_key(kind, model, payload, options), fn)
+
+    async def _acoalesce(self, kind: str, model: str, payload, options: dict, fn: Callable):
+        if not settings.LLM_SINGLE_FLIGHT:
+            return await fn()
+        return await self.flights.ado(kind, flight_key(kind, model, payload, options), fn)
+
+    def chat(self, messages: List[Dict[str, str]], model: str = None, timeout: float = None,
+             retries: int = None, **kwargs) -> str:
+        """Text of the assistant's reply to `messages`."""
+        model = model or settings.CHAT_MODEL
+
+        def call():
+            completion = self._call(lambda: self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout or self.timeout,
+                **kwargs
+            ), retries)
+            return completion.choices[0].message.content or ""
+        return self._coalesce('chat', model, messages, kwargs, call)
+
+    def stream(self, messages: List[Dict[str, str]], model: str = None, timeout: float = None,
+               retries: int = None, **kwargs) -> Iterator[str]:
+        """
+        Pieces of the assistant's reply to `messages` as they arrive.
+
+        Only opening the stream is retried. Closing the generator early (e.g.
+        because the browser went away) closes the upstream response, so the
+        provider stops generating (once every request sharing it is gone).
+        """
+        model = model or settings.CHAT_MODEL
+        open_upstream = lambda: self._stream(messages, model, timeout, retries, **kwargs)
+        if not settings.LLM_SINGLE_FLIGHT:
+            return open_upstream()
+        return self.flights.stream('stream', flight_key('stream', model, messages, kwargs), open_upstream)
+
+    def _stream(self, messages, model, timeout, retries, **kwargs) -> Iterator[str]:
+        response = self._call(lambda: self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout or self.timeout,
+            stream=True,
+            **kwargs
+        ), retries)
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except PROVIDER_ERRORS:
+            self.breaker.record_failure()
+            raise
+        finally:
+            response.close()
+
+    def embed(self, texts: Sequence[str], model: str = None, timeout: float = None,
+              retries: int = None) -> List[List[float]]:
+        """Embedding of each text."""
+        model = model or settings.EMBEDDING_MODEL
+        texts = list(texts)
+
+        def call():
+            response = self._call(lambda: self.client.embeddings.create(
+                model=model,
+                input=texts,
+                timeout=timeout or self.timeout,
+            ), retries)
+            return [item.embedding for item in response.data]
+        return self._coalesce('embed', model, texts, {}, call)
+
+
+    async def achat(self, messages: List[Dict[str, str]], model: str = None, timeout: float = None,
+                    retries: int = None, **kwargs) -> str:
+        model = model or settings.CHAT_MODEL
+
+        async def call():
+            completion = await self._acall(lambda: self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=timeout or self.timeout,
+                **kwargs
+            ), retries)
+            return completion.choices[0].message.content or ""
+        return await self._acoalesce('chat', model, messages, kwargs, call)
+
+    def astream(self, messages: List[Dict[str, str]], model: str = None, timeout: float = None,
+                retries: int = None, **kwargs) -> AsyncIterator[str]:
+        model = model or settings.CHAT_MODEL
+        open_upstream = lambda: self._astream(messages, model, timeout, retries, **kwargs)
+        if not settings.LLM_SINGLE_FLIGHT:
+            return open_upstream()
+        return self.flights.astream('stream', flight_key('stream', model, messages, kwargs), open_upstream)
+
+    async def _astream(self, messages, model, timeout, retries, **kwargs) -> AsyncIterator[str]:
+        response = await self._acall(lambda: self.async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout or self.timeout,
+            stream=True,
+            **kwargs
+        ), retries)
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except PROVIDER_ERRORS:
+            self.breaker.record_failure()
+            raise
+        finally:
+            await response.close()
+
+    async def aembed(self, texts: Sequence[str], model: str = None, timeout: float = None,
+                     retries: int = None) -> List[List[float]]:
+        model = model or settings.EMBEDDING_MODEL
+        texts = list(texts)
+
+        async def call():
+            response = await self._acall(lambda: self.async_client.embeddings.create(
+                model=model,
+                input=texts,
+                timeout=timeout or self.timeout,
+            ), retries)
+            return [item.embedding for item in response.data]
+        return await self._acoalesce('embed', model, texts, {}, call)
+
+
+class StubGateway:
+    """
+    Offline gateway for tests and local development: echoes the last message
+    and returns deterministic pseudo-embeddings derived from each text's hash.
+    """
+
+    dimensions = 16
+
+    def __init__(self, **kwargs):
+        self.breaker = CircuitBreaker(settings.LLM_CIRCUIT_FAILURES, settings.LLM_CIRCUIT_RESET)
+        self.calls = []
+
+    def stats(self) -> dict:
+        return {'circuit': self.breaker.state, 'coalesced': {}}
+
+    def chat(self, messages, model=None, timeout=None, retries=None, **kwargs) -> str:
+        self.calls.append(('chat', messages))
+        return f"Respuesta de prueba a: {messages[-1]['content']}"
+
+    def stream(self, messages, model=None, timeout=None, retries=None, **kwargs) -> Iterator[str]:
+        words = self.chat(messages, model, timeout, retries, **kwargs).split(' ')
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + ' '
+
+    def embed(self, texts, model=None, timeout=None, retries=None) -> List[List[float]]:
+        self.calls.append(('embed', list(texts)))
+        return [
+            [byte / 255 for byte in hashlib.sha256(text.encode('utf-8')).digest()[:self.dimensions]]
+            for text in texts
+        ]
+
+    async def achat(self, messages, model=None, timeout=None, retries=None, **kwargs) -> str:
+        return self.chat(messages, model, timeout, retries, **kwargs)
+
+    async def astream(self, messages, model=None, timeout=None, retries=None, **kwargs) -> AsyncIterator[str]:
+        for piece in self.stream(messages, model, timeout, retries, **kwargs):
+            yield piece
+
+    async def aembed(self, texts, model=None, timeout=None, retries=None) -> List[List[float]]:
+        return self.embed(texts, model, timeout, retries)
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway, built on first use from settings.LLM_GATEWAY."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = import_string(settings.LLM_GATEWAY)()
+    return _gateway
+
+
+def set_gateway(gateway) -> None:
+    """Replace the process-wide gateway (e.g. with a StubGateway in tests)."""
+    global _gateway
+    with _gateway_lock:
+        _gateway = gateway
@@ -6,6 +6,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 import mimetypes
+import tempfile
 
 mimetypes.add_type("application/javascript", ".mjs")
 
@@ -25,6 +26,106 @@ STATICFILES_DIRS = [
 SECRET_KEY = os.getenv('SECRET_KEY')
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+# Permite apuntar a un servidor compatible (p. ej. un stub local en pruebas)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+
+# Pasarela compartida hacia el proveedor de IA (chat y embeddings): un solo pool de
+# conexiones persistentes por proceso, timeouts, reintentos y cortocircuito.
+# LLM_GATEWAY='turing.llm_gateway.StubGateway' permite trabajar sin la API.
+LLM_GATEWAY = os.getenv('LLM_GATEWAY', 'turing.llm_gateway.LLMGateway')
+CHAT_MODEL = os.getenv('CHAT_MODEL', 'gpt-4o-mini')
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60))
+LLM_HTTP2 = os.getenv('LLM_HTTP2', 'False') == 'True'
+LLM_CIRCUIT_FAILURES = int(os.getenv('LLM_CIRCUIT_FAILURES', 5))
+LLM_CIRCUIT_RESET = float(os.getenv('LLM_CIRCUIT_RESET', 30))
+# Peticiones idénticas simultáneas (mismo prompt, historial y pregunta) comparten una sola llamada
+LLM_SINGLE_FLIGHT = os.getenv('LLM_SINGLE_FLIGHT', 'True') == 'True'
+
+# Hilos para preparar cada mensaje del chat en paralelo (búsqueda RAG mientras se
+# carga el historial). 0 ejecuta las etapas una tras otra.
+CHAT_PREPARE_WORKERS = int(os.getenv('CHAT_PREPARE_WORKERS', 8))
+# Renderizado de las respuestas (markdown + Pygments): caché LRU por hash del
+# contenido y un pool de procesos para las respuestas largas con código
+MARKDOWN_CACHE_SIZE = int(os.getenv('MARKDOWN_CACHE_SIZE', 1024))
+MARKDOWN_RENDER_WORKERS = int(os.getenv('MARKDOWN_RENDER_WORKERS', 2))
+MARKDOWN_OFFLOAD_CHARS = int(os.getenv('MARKDOWN_OFFLOAD_CHARS', 4000))
+# Vistas async del chat (send_message, poll_messages); turing/asgi.py las activa
+CHAT_ASYNC_VIEWS = os.getenv('CHAT_ASYNC_VIEWS', 'False') == 'True'
+# Entrega de mensajes por server-sent events (solo con las vistas async)
+CHAT_EVENTS_INTERVAL = float(os.getenv('CHAT_EVENTS_INTERVAL', 2))
+# Menor que SESSION_COOKIE_AGE: cada reconexión renueva la sesión, como hacía el polling
+CHAT_EVENTS_MAX_SECONDS = int(os.getenv('CHAT_EVENTS_MAX_SECONDS', 120))
+CHAT_EVENTS_RETRY_MS = int(os.getenv('CHAT_EVENTS_RETRY_MS', 2000))
+# Prompt del sistema compilado (global + curso + grupo) por par curso/grupo. Se
+# invalida al guardar una capa; con la caché en memoria por defecto cada proceso
+# tiene su copia, así que en los demás workers el cambio llega al expirar.
+CHAT_PROMPT_CACHE_TIMEOUT = int(os.getenv('CHAT_PROMPT_CACHE_TIMEOUT', 300))
+# Memoria del chat: los últimos mensajes van completos y los anteriores se resumen
+# en segundo plano, de a CHAT_SUMMARY_BATCH, en un resumen por sesión
+CHAT_RECENT_MESSAGES = int(os.getenv('CHAT_RECENT_MESSAGES', 6))
+CHAT_SUMMARY_ENABLED = os.getenv('CHAT_SUMMARY_ENABLED', 'True') == 'True'
+CHAT_SUMMARY_BATCH = int(os.getenv('CHAT_SUMMARY_BATCH', 6))
+CHAT_SUMMARY_MAX_WORDS = int(os.getenv('CHAT_SUMMARY_MAX_WORDS', 250))
+CHAT_SUMMARY_MODEL = os.getenv('CHAT_SUMMARY_MODEL', 'gpt-4o-mini')
+# Hilos propios para los resúmenes, aparte de BACKGROUND_WORKERS (importaciones, reprocesos)
+CHAT_SUMMARY_WORKERS = int(os.getenv('CHAT_SUMMARY_WORKERS', 2))
+
+# Embeddings para la base de conocimiento (RAG)
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv('EMBEDDING_REQUESTS_PER_MINUTE', 3000))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', 1000000))
+EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', 5))
+EMBEDDING_TIMEOUT = float(os.getenv('EMBEDDING_TIMEOUT', 30))
+
+# Copia local de los PDF del almacenamiento para no volver a descargarlos al reprocesar
+KNOWLEDGE_CACHE_DIR = os.getenv('KNOWLEDGE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'turing-knowledge-cache'))
+KNOWLEDGE_CACHE_MAX_BYTES = int(os.getenv('KNOWLEDGE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+
+# Índice segmentado por curso: máximo de segmentos antes de mezclar, cuántos se mezclan
+# a la vez y memoria para las matrices decodificadas
+KNOWLEDGE_SEGMENT_MAX = int(os.getenv('KNOWLEDGE_SEGMENT_MAX', 8))
+KNOWLEDGE_SEGMENT_MERGE_FACTOR = int(os.getenv('KNOWLEDGE_SEGMENT_MERGE_FACTOR', 4))
+KNOWLEDGE_SEGMENT_CACHE_BYTES = int(os.getenv('KNOWLEDGE_SEGMENT_CACHE_BYTES', 256 * 1024 * 1024))
+# Máscaras precalculadas (segmento, documentos visibles) para el alcance por grupo
+KNOWLEDGE_MASK_CACHE_SIZE = int(os.getenv('KNOWLEDGE_MASK_CACHE_SIZE', 2048))
+# Documentos consultables por curso/grupo y su versión. La clave incluye Course.knowledge_version,
+# que las señales incrementan en la base de datos: todos los workers ven el cambio en la siguiente consulta.
+KNOWLEDGE_SCOPE_CACHE_TIMEOUT = int(os.getenv('KNOWLEDGE_SCOPE_CACHE_TIMEOUT', 300))
+
+# Búsqueda aproximada (perfil ANN): los segmentos con al menos estas filas se agrupan
+# en clústeres y cada consulta solo revisa los más cercanos
+KNOWLEDGE_ANN_MIN_ROWS = int(os.getenv('KNOWLEDGE_ANN_MIN_ROWS', 1024))
+KNOWLEDGE_ANN_PROBES = int(os.getenv('KNOWLEDGE_ANN_PROBES', 8))
+
+# Resúmenes jerárquicos (secciones, archivos y curso) para preguntas generales
+KNOWLEDGE_SUMMARIES_ENABLED = os.getenv('KNOWLEDGE_SUMMARIES_ENABLED', 'True') == 'True'
+KNOWLEDGE_SUMMARY_MODEL = os.getenv('KNOWLEDGE_SUMMARY_MODEL', 'gpt-4o-mini')
+KNOWLEDGE_SUMMARY_SECTION_PAGES = int(os.getenv('KNOWLEDGE_SUMMARY_SECTION_PAGES', 8))
+# Ventaja mínima (similitud coseno) de un resumen sobre el mejor fragmento para incluirlo en el contexto
+KNOWLEDGE_SUMMARY_MARGIN = float(os.getenv('KNOWLEDGE_SUMMARY_MARGIN', 0.05))
+
+# Caché semántica de respuestas (cada curso la activa): máximo de respuestas guardadas por curso
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 500))
+
+# Hilos para trabajo en segundo plano (procesamiento de PDFs tras una subida directa)
+BACKGROUND_WORKERS = int(os.getenv('BACKGROUND_WORKERS', 2))
+
+# Carga masiva de PDFs desde un zip
+KNOWLEDGE_IMPORT_CONCURRENCY = int(os.getenv('KNOWLEDGE_IMPORT_CONCURRENCY', 3))
+KNOWLEDGE_IMPORT_MAX_FILES = int(os.getenv('KNOWLEDGE_IMPORT_MAX_FILES', 200))
+KNOWLEDGE_IMPORT_MAX_FILE_BYTES = int(os.getenv('KNOWLEDGE_IMPORT_MAX_FILE_BYTES', 100 * 1024 * 1024))
+# Segundos sin avance tras los cuales una importación se marca como fallida (el proceso se reinició)
+KNOWLEDGE_IMPORT_STALE_AFTER = int(os.getenv('KNOWLEDGE_IMPORT_STALE_AFTER', 30 * 60))
+
+# Subidas directas al bucket S3 con URLs prefirmadas
+DIRECT_UPLOADS_ENABLED = os.getenv('DIRECT_UPLOADS_ENABLED', 'True') == 'True'
+DIRECT_UPLOAD_EXPIRES = int(os.getenv('DIRECT_UPLOAD_EXPIRES', 900))
+DIRECT_UPLOAD_MAX_BYTES = int(os.getenv('DIRECT_UPLOAD_MAX_BYTES', 100 * 1024 * 1024))
 
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
@@ -85,7 +186,8 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
-        'CONN_MAX_AGE': 600,
+        # turing/asgi.py lo fuerza a 0: bajo ASGI cada hilo del executor tendría su conexión
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
         'OPTIONS': {
             'sslmode': os.getenv('DB_SSLMODE', 'require'),
         },
@@ -120,7 +222,8 @@ STORAGES = {
             "secret_key": os.environ.get("SUPABASE_S3_SECRET_ACCESS_KEY"),
             "bucket_name": os.environ.get("SUPABASE_BUCKET_NAME"),
             "region_name": os.environ.get("SUPABASE_S3_REGION_NAME"),
-            "endpoint_url": f"https://{os.environ.get('SUPABASE_PROJECT_ID')}.storage.supabase.co/storage/v1/s3",
+            # S3_ENDPOINT_URL permite usar un S3 local (MinIO, moto) en desarrollo y pruebas
+            "endpoint_url": os.environ.get("S3_ENDPOINT_URL") or f"https://{os.environ.get('SUPABASE_PROJECT_ID')}.storage.supabase.co/storage/v1/s3",
             "custom_domain": f"{os.environ.get('SUPABASE_PROJECT_ID')}.supabase.co/storage/v1/object/public/{os.environ.get('SUPABASE_BUCKET_NAME')}",
             "object_parameters": {'CacheControl': 'max-age=86400'},
             "location": "",  